@@ -1,12 +1,18 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { isValidInstagramUrl, extractInstagramId } from '@/lib/utils'
+import { isValidInstagramUrl, extractInstagramId, proxiedThumbnail } from '@/lib/utils'
 import { spawn } from 'child_process'
+import { getExtractorPool } from '@/lib/python-worker-pool'
 import path from 'path'
 
+// Overall time for one extraction, fallback included
+const EXTRACT_DEADLINE_MS = 30000
+// Below this the simple script has no realistic chance of finishing
+const MIN_FALLBACK_MS = 3000
+
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json()
-    const { url } = body
+    const { url, index } = body
 
     if (!url) {
       return NextResponse.json(
@@ -15,6 +21,13 @@ export async function POST(request: NextRequest) {
       )
     }
 
+    if (index !== undefined && !(Number.isInteger(index) && index >= 1)) {
+      return NextResponse.json(
+        { error: 'index must be a positive integer' },
+        { status: 400 }
+      )
+    }
+
     if (!isValidInstagramUrl(url)) {
       return NextResponse.json(
         { error: 'Invalid Instagram URL' },
@@ -33,65 +46,23 @@ export async function POST(request: NextRequest) {
     // Log the request for analytics
     console.log(`Processing Instagram video: ${videoId}`)
 
-    try {
-      // Try the Railway-optimized Python script first
-      let pythonScript = path.join(process.cwd(), 'scripts', 'instagram_downloader_railway.py')
-      let pythonCommand = 'python3'
-      
-      // On Windows, try 'python' instead of 'python3'
-      if (process.platform === 'win32') {
-        pythonCommand = 'python'
-      }
-      
-      // In Railway environment, use 'python' command
-      if (process.env.RAILWAY_ENVIRONMENT) {
-        pythonCommand = 'python'
-      }
-      
-      const pythonProcess = spawn(pythonCommand, [pythonScript, url], {
-        stdio: ['pipe', 'pipe', 'pipe']
-      })
-
-      let stdout = ''
-      let stderr = ''
-
-      pythonProcess.stdout.on('data', (data) => {
-        stdout += data.toString()
-      })
-
-      pythonProcess.stderr.on('data', (data) => {
-        stderr += data.toString()
-      })
+    // One budget covers the hedged extraction and any fallback, so a slow upstream can't cost both in series
+    const deadline = Date.now() + EXTRACT_DEADLINE_MS
 
-      // Wait for the process to complete
-      const result = await new Promise((resolve, reject) => {
-        pythonProcess.on('close', (code) => {
-          if (code === 0) {
-            try {
-              const pythonResult = JSON.parse(stdout)
-              resolve(pythonResult)
-            } catch (parseError) {
-              reject(new Error('Failed to parse Python script output'))
-            }
-          } else {
-            reject(new Error(`Python script failed: ${stderr}`))
-          }
-        })
-
-        pythonProcess.on('error', (error) => {
-          reject(new Error(`Failed to start Python script: ${error.message}`))
-        })
-
-        // Set a timeout for the Python script
-        setTimeout(() => {
-          pythonProcess.kill()
-          reject(new Error('Python script timeout'))
-        }, 30000) // 30 second timeout
-      })
+    try {
+      // Hedged yt-dlp/HTML extraction, served by a pool of warm workers
+      const result = await getExtractorPool().extract(url, EXTRACT_DEADLINE_MS, index)
 
       const pythonResult = result as any
 
       if (!pythonResult.success) {
+        if (pythonResult.retry_after !== undefined) {
+          // Instagram is throttling us and the worker's circuit breaker is open
+          return NextResponse.json(
+            { error: pythonResult.error },
+            { status: 503, headers: { 'Retry-After': String(Math.ceil(pythonResult.retry_after)) } }
+          )
+        }
         return NextResponse.json(
           { error: pythonResult.error || 'Failed to extract video information' },
           { status: 400 }
@@ -103,7 +74,7 @@ export async function POST(request: NextRequest) {
         id: pythonResult.data.id,
         title: pythonResult.data.title,
         description: pythonResult.data.description,
-        thumbnail: pythonResult.data.thumbnail,
+        thumbnail: proxiedThumbnail(pythonResult.data.thumbnail),
         videoUrl: pythonResult.data.video_url,
         duration: pythonResult.data.duration,
         size: pythonResult.data.filesize,
@@ -111,20 +82,29 @@ export async function POST(request: NextRequest) {
         width: pythonResult.data.width,
         height: pythonResult.data.height,
         format: pythonResult.data.format,
+        // Every item of a carousel post; request one with `index`
+        media: pythonResult.data.media,
+        mediaIndex: pythonResult.data.media_index,
         originalUrl: url,
         extractedAt: new Date().toISOString()
       }
 
       return NextResponse.json({
         success: true,
-        data: videoData
+        data: videoData,
+        // Served from cache while Instagram is unavailable
+        ...(pythonResult.stale ? { stale: true } : {})
       })
 
     } catch (pythonError) {
       console.error('Advanced Python script error:', pythonError)
-      
-      // Try the simple Python script as fallback
+
+      // Try the simple Python script as fallback, with whatever is left of the budget
+      const remainingMs = deadline - Date.now()
       try {
+        if (remainingMs < MIN_FALLBACK_MS) {
+          throw new Error('Extraction deadline exceeded; skipping the simple script')
+        }
         const simplePythonScript = path.join(process.cwd(), 'scripts', 'instagram_downloader_simple.py')
         let pythonCommand = process.platform === 'win32' ? 'python' : 'python3'
         
@@ -171,7 +151,7 @@ export async function POST(request: NextRequest) {
           setTimeout(() => {
             simplePythonProcess.kill()
             reject(new Error('Simple Python script timeout'))
-          }, 15000) // 15 second timeout
+          }, remainingMs)
         })
 
         const simplePythonResult = simpleResult as any
@@ -182,7 +162,7 @@ export async function POST(request: NextRequest) {
             id: simplePythonResult.data.id,
             title: simplePythonResult.data.title,
             description: simplePythonResult.data.description,
-            thumbnail: simplePythonResult.data.thumbnail,
+            thumbnail: proxiedThumbnail(simplePythonResult.data.thumbnail),
             videoUrl: simplePythonResult.data.video_url,
             duration: simplePythonResult.data.duration,
             size: simplePythonResult.data.filesize || 0,
@@ -204,28 +184,14 @@ export async function POST(request: NextRequest) {
         console.error('Simple Python script error:', simplePythonError)
       }
       
-      // Final fallback to mock data if both Python scripts fail
-      const mockVideoData = {
-        id: videoId,
-        title: 'Instagram Video',
-        description: 'Downloaded from Instagram',
-        thumbnail: 'https://via.placeholder.com/400x400/667eea/ffffff?text=Instagram+Video',
-        videoUrl: '', // No direct download URL available
-        duration: 0,
-        size: 0,
-        quality: 'normal',
-        width: 0,
-        height: 0,
-        format: 'mp4',
-        originalUrl: url,
-        extractedAt: new Date().toISOString()
-      }
-
-      return NextResponse.json({
-        success: true,
-        data: mockVideoData,
-        warning: 'Using fallback method - video extraction may be limited'
-      })
+      // Both Python scripts failed; report it rather than returning placeholder data
+      return NextResponse.json(
+        {
+          error: 'Failed to extract video information',
+          message: 'Instagram is not responding right now, please try again later'
+        },
+        { status: 503, headers: { 'Retry-After': '30' } }
+      )
     }
 
   } catch (error) {
@@ -0,0 +1,183 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process'
+import path from 'path'
+
+type WorkerMessage = {
+  id: string | null
+  success: boolean
+  op?: string
+  data?: any
+  error?: string
+}
+
+type PendingRequest = {
+  resolve: (message: WorkerMessage) => void
+  reject: (error: Error) => void
+  timer: NodeJS.Timeout
+}
+
+function positiveIntEnv(name: string, fallback: number): number {
+  // A pool needs at least one worker (and slot); anything unparsable keeps the default
+  const value = parseInt(process.env[name] ?? '', 10)
+  return Number.isNaN(value) ? fallback : Math.max(1, value)
+}
+
+function pythonCommand(): string {
+  // In Railway environment, use 'python' command
+  if (process.env.RAILWAY_ENVIRONMENT) return 'python'
+  return process.platform === 'win32' ? 'python' : 'python3'
+}
+
+class PythonWorker {
+  private process: ChildProcessWithoutNullStreams
+  private buffer = ''
+  private pending = new Map<string, PendingRequest>()
+  private nextId = 0
+  alive = true
+
+  constructor(script: string, concurrency: number) {
+    this.process = spawn(pythonCommand(), [script, '--worker', '--concurrency', String(concurrency)], {
+      stdio: ['pipe', 'pipe', 'pipe']
+    })
+
+    this.process.stdout.on('data', (data) => this.onData(data.toString()))
+    this.process.stderr.on('data', (data) => {
+      console.error('Python worker stderr:', data.toString())
+    })
+    this.process.on('exit', () => this.shutdown(new Error('Python worker exited')))
+    this.process.on('error', (error) => {
+      this.shutdown(new Error(`Failed to start Python worker: ${error.message}`))
+    })
+    // Writing to a worker that died mid-request raises EPIPE here; unhandled, it would crash the server
+    this.process.stdin.on('error', (error) => {
+      this.shutdown(new Error(`Python worker stdin failed: ${error.message}`))
+      this.process.kill()
+    })
+  }
+
+  get inFlight(): number {
+    return this.pending.size
+  }
+
+  send(payload: Record<string, unknown>, timeoutMs: number): Promise<WorkerMessage> {
+    if (!this.alive) {
+      return Promise.reject(new Error('Python worker is not running'))
+    }
+
+    const id = String(this.nextId++)
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id)
+        reject(new Error('Python worker timeout'))
+      }, timeoutMs)
+
+      this.pending.set(id, { resolve, reject, timer })
+      this.process.stdin.write(JSON.stringify({ ...payload, id }) + '\n')
+    })
+  }
+
+  kill() {
+    this.process.kill()
+  }
+
+  private onData(chunk: string) {
+    this.buffer += chunk
+    let newline = this.buffer.indexOf('\n')
+    while (newline !== -1) {
+      const line = this.buffer.slice(0, newline).trim()
+      this.buffer = this.buffer.slice(newline + 1)
+      if (line) this.onMessage(line)
+      newline = this.buffer.indexOf('\n')
+    }
+  }
+
+  private onMessage(line: string) {
+    let message: WorkerMessage
+    try {
+      message = JSON.parse(line)
+    } catch {
+      console.error('Failed to parse Python worker output:', line)
+      return
+    }
+
+    if (message.id === null) return
+    const request = this.pending.get(message.id)
+    if (!request) return
+
+    this.pending.delete(message.id)
+    clearTimeout(request.timer)
+    request.resolve(message)
+  }
+
+  private shutdown(error: Error) {
+    this.alive = false
+    this.pending.forEach((request) => {
+      clearTimeout(request.timer)
+      request.reject(error)
+    })
+    this.pending.clear()
+  }
+}
+
+export class PythonWorkerPool {
+  private workers: PythonWorker[] = []
+  private healthTimer: NodeJS.Timeout | null = null
+
+  private size: number
+  private concurrency: number
+
+  constructor(
+    private script: string,
+    size: number,
+    concurrency: number,
+    private pingIntervalMs = 30000
+  ) {
+    // pick() needs at least one worker to choose from
+    this.size = Math.max(1, Math.floor(size) || 1)
+    this.concurrency = Math.max(1, Math.floor(concurrency) || 1)
+  }
+
+  async extract(url: string, timeoutMs: number, index?: number): Promise<WorkerMessage> {
+    this.start()
+    // index picks one carousel item; the worker serves it from its cached fetch of the post
+    const request = { op: 'extract', url, timeout: timeoutMs / 1000 - 1, ...(index ? { index } : {}) }
+    return this.pick().send(request, timeoutMs)
+  }
+
+  private start() {
+    this.workers = this.workers.filter((worker) => worker.alive)
+    while (this.workers.length < this.size) {
+      this.workers.push(new PythonWorker(this.script, this.concurrency))
+    }
+
+    if (!this.healthTimer) {
+      this.healthTimer = setInterval(() => this.ping(), this.pingIntervalMs)
+      this.healthTimer.unref()
+    }
+  }
+
+  private pick(): PythonWorker {
+    // Least-loaded worker gets the next request
+    return this.workers.reduce((best, worker) => (worker.inFlight < best.inFlight ? worker : best))
+  }
+
+  private ping() {
+    this.workers.forEach((worker) => {
+      worker.send({ op: 'ping' }, 5000).catch(() => worker.kill())
+    })
+    this.start()
+  }
+}
+
+let defaultPool: PythonWorkerPool | null = null
+
+export function getExtractorPool(): PythonWorkerPool {
+  if (!defaultPool) {
+    // Runs yt-dlp and the HTML extractor as hedged strategies under one deadline
+    defaultPool = new PythonWorkerPool(
+      path.join(process.cwd(), 'scripts', 'instagram_downloader.py'),
+      positiveIntEnv('EXTRACTOR_WORKERS', 2),
+      positiveIntEnv('EXTRACTOR_WORKER_CONCURRENCY', 4)
+    )
+  }
+  return defaultPool
+}
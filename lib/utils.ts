@@ -5,14 +5,26 @@ export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs))
 }
 
+// Same URL shapes as scripts/instagram_urls.py: /p/, /reel/, /reels/ and /tv/ posts,
+// profile-prefixed links, m. and instagr.am hosts, and share links
+const INSTAGRAM_URL_PATTERN =
+  /^https?:\/\/(?:(?:www|m)\.)?(?:instagram\.com|instagr\.am)\/(?:share\/(?:(?:p|reels?)\/)?([A-Za-z0-9_-]+)|(?:[A-Za-z0-9_.]+\/)?(?:p|reels?|tv)\/(?!audio\/)([A-Za-z0-9_-]+))(?:[/?#]|$)/i
+
 export function isValidInstagramUrl(url: string): boolean {
-  const instagramRegex = /^https?:\/\/(www\.)?instagram\.com\/(p|reel|tv)\/[A-Za-z0-9_-]+\/?/
-  return instagramRegex.test(url)
+  return INSTAGRAM_URL_PATTERN.test(url.trim())
 }
 
 export function extractInstagramId(url: string): string | null {
-  const match = url.match(/\/(p|reel|tv)\/([A-Za-z0-9_-]+)/)
-  return match ? match[2] : null
+  const match = url.trim().match(INSTAGRAM_URL_PATTERN)
+  return match ? match[1] || match[2] : null
+}
+
+// Route thumbnails through scripts/instagram_store.py when THUMBNAIL_PROXY_URL is set,
+// so each one is fetched from Instagram's CDN once and then served from disk
+export function proxiedThumbnail(url?: string): string | undefined {
+  const proxy = process.env.THUMBNAIL_PROXY_URL
+  if (!url || !proxy) return url
+  return `${proxy.replace(/\/+$/, '')}/thumb?url=${encodeURIComponent(url)}`
 }
 
 export function formatFileSize(bytes: number): string {
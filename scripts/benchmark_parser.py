@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for extract_video_info_from_html
+Compares the single-pass parser with the previous five-scan regex
+implementation on the recorded fixtures, padded to several page sizes.
+"""
+
+import argparse
+import json
+import os
+import re
+import timeit
+from html import unescape
+
+from instagram_parser import parse_video_info
+from instagram_standin import FIXTURES_DIR
+
+FIXTURES = ['video_jsonld', 'video_og', 'no_video']
+PAGE_SIZES = [32 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def legacy_extract_video_info_from_html(html, video_id):
+    """The previous implementation: one DOTALL findall plus four meta searches"""
+    json_ld_pattern = r'<script type="application/ld\+json">(.*?)</script>'
+    json_ld_matches = re.findall(json_ld_pattern, html, re.DOTALL)
+
+    for json_ld in json_ld_matches:
+        try:
+            data = json.loads(json_ld)
+            if isinstance(data, dict) and 'videoObject' in data:
+                video_obj = data['videoObject']
+                return {
+                    'id': video_id,
+                    'title': video_obj.get('name', 'Instagram Video'),
+                    'description': video_obj.get('description', ''),
+                    'thumbnail': video_obj.get('thumbnailUrl', ''),
+                    'video_url': video_obj.get('contentUrl', ''),
+                    'duration': video_obj.get('duration', 0),
+                    'width': video_obj.get('width', 0),
+                    'height': video_obj.get('height', 0),
+                    'format': 'mp4',
+                    'quality': 'normal'
+                }
+        except json.JSONDecodeError:
+            continue
+
+    title_match = re.search(r'<meta property="og:title" content="([^"]*)"', html)
+    description_match = re.search(r'<meta property="og:description" content="([^"]*)"', html)
+    image_match = re.search(r'<meta property="og:image" content="([^"]*)"', html)
+    video_match = re.search(r'<meta property="og:video" content="([^"]*)"', html)
+
+    return {
+        'id': video_id,
+        'title': title_match.group(1) if title_match else 'Instagram Video',
+        'description': description_match.group(1) if description_match else '',
+        'thumbnail': image_match.group(1) if image_match else '',
+        'video_url': video_match.group(1) if video_match else '',
+        'duration': 0,
+        'width': 0,
+        'height': 0,
+        'format': 'mp4',
+        'quality': 'normal'
+    }
+
+
+def load_fixture(name, size):
+    """Read a recorded page and pad its body up to size characters"""
+    with open(os.path.join(FIXTURES_DIR, f'{name}.html'), encoding='utf-8') as f:
+        html = f.read()
+
+    head, body = html.split('</head>', 1)
+    while len(head) + len(body) < size:
+        body = body.replace('</body>', body[:body.index('</body>')] + '</body>', 1)
+    return head + '</head>' + body
+
+
+def same_fields(legacy, current):
+    """Compare results, allowing for the entity decoding the legacy parser skipped"""
+    keys = ('title', 'description', 'thumbnail', 'video_url')
+    return all(unescape(str(legacy[key])) == str(current[key]) for key in keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=50, help='iterations per measurement')
+    args = parser.parse_args()
+
+    print(f"{'fixture':<14}{'size':>10}{'legacy ms':>12}{'single ms':>12}{'speedup':>10}  same")
+    for name in FIXTURES:
+        for size in PAGE_SIZES:
+            html = load_fixture(name, size)
+            legacy = timeit.timeit(lambda: legacy_extract_video_info_from_html(html, name), number=args.number)
+            current = timeit.timeit(lambda: parse_video_info(html, name), number=args.number)
+            same = same_fields(legacy_extract_video_info_from_html(html, name), parse_video_info(html, name))
+            print(f"{name:<14}{len(html) // 1024:>8}KB"
+                  f"{legacy / args.number * 1000:>12.3f}{current / args.number * 1000:>12.3f}"
+                  f"{legacy / current:>9.1f}x  {'yes' if same else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Instagram downloader scripts
+Every request through the CLI is a fresh interpreter, so module import
+time is paid per request. Uses python -X importtime to measure the import
+cost of each script, and checks that rejecting an invalid URL loads no
+network library. Exits non-zero when a script exceeds the budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = ['instagram_downloader', 'instagram_downloader_railway', 'instagram_downloader_simple']
+
+# Import budget per script module, excluding interpreter start-up itself
+STARTUP_BUDGET_MS = 100.0
+
+# Must not be imported just to reject a bad URL
+HEAVY_MODULES = ('requests', 'urllib3', 'yt_dlp', 'aiohttp', 'asyncio')
+
+INVALID_URL = 'https://example.com/not-instagram'
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse -X importtime output into (module, self_us, cumulative_us) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_importtime(args: List[str]) -> Tuple[List[Tuple[str, int, int]], float]:
+    """Run python -X importtime with args; return the parsed rows and wall time in ms"""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=SCRIPTS_DIR,
+                               capture_output=True, text=True, timeout=60)
+    return parse_importtime(completed.stderr), (time.perf_counter() - started) * 1000
+
+
+def import_ms(script: str) -> float:
+    """Cumulative import time of one script module, in ms"""
+    rows, _ = run_importtime(['-c', f'import {script}'])
+    return next(cumulative for name, _, cumulative in rows if name.strip() == script) / 1000
+
+
+def reject_profile(script: str) -> Dict[str, object]:
+    """Run the CLI on an invalid URL; report wall time and any heavy modules it loaded"""
+    rows, wall_ms = run_importtime([f'{script}.py', INVALID_URL])
+    loaded = {name.strip() for name, _, _ in rows}
+    return {
+        'wall_ms': round(wall_ms, 1),
+        'heavy_modules': [module for module in HEAVY_MODULES if module in loaded],
+    }
+
+
+def slowest_imports(script: str, count: int = 5) -> List[Tuple[str, float]]:
+    """The script's slowest imports by self time"""
+    rows, _ = run_importtime(['-c', f'import {script}'])
+    # Rows before the script's own subtree belong to interpreter start-up
+    start = next(index for index, (name, _, _) in enumerate(rows) if name.strip().startswith('instagram_'))
+    ranked = sorted(rows[start:], key=lambda row: row[1], reverse=True)[:count]
+    return [(name.strip(), self_us / 1000) for name, self_us, _ in ranked]
+
+
+def check_startup(script: str, budget_ms: float = STARTUP_BUDGET_MS, number: int = 3) -> Dict[str, object]:
+    """Measure one script and decide whether it meets the cold-start budget"""
+    median_ms = statistics.median(import_ms(script) for _ in range(number))
+    reject = reject_profile(script)
+    return {
+        'script': script,
+        'import_ms': round(median_ms, 1),
+        'reject_wall_ms': reject['wall_ms'],
+        'heavy_modules': reject['heavy_modules'],
+        'ok': median_ms <= budget_ms and not reject['heavy_modules'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument('--number', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to list per script')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'script':<32}{'import ms':>11}{'reject ms':>11}  heavy modules on reject")
+    for script in SCRIPTS:
+        result = check_startup(script, args.budget_ms, args.number)
+        failed = failed or not result['ok']
+        print(f"{script:<32}{result['import_ms']:>11.1f}{result['reject_wall_ms']:>11.1f}  "
+              f"{', '.join(result['heavy_modules']) or '-'}{'' if result['ok'] else '  OVER BUDGET'}")
+        for name, self_ms in slowest_imports(script, args.top):
+            print(f"    {name:<36}{self_ms:>8.2f} ms")
+
+    print(f"\nBudget: {args.budget_ms:.0f} ms per script import, no {', '.join(HEAVY_MODULES)} on reject")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the Instagram downloader scripts
+Covers URL parsing and canonicalization, HTML metadata extraction on the recorded fixtures,
+yt-dlp format selection and end-to-end download_video for the three
+downloader classes against the local stand-in server. Reports throughput,
+p50/p95/p99 latency and peak RSS, and can save results as JSON and compare
+them with an earlier run.
+
+End-to-end runs stay offline: InstagramDownloader only runs its HTML
+strategy here, since yt-dlp would go to the real Instagram. Each
+downloader gets its own guard that neither rate limits, retries nor trips,
+so the numbers measure the downloader rather than the token bucket, and
+injected errors show up as errors.
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmark_parser import FIXTURES, PAGE_SIZES, load_fixture
+from instagram_downloader import InstagramDownloader
+from instagram_downloader_railway import RailwayInstagramDownloader
+from instagram_downloader_simple import SimpleInstagramDownloader
+from instagram_formats import FormatPolicy, apply_format_policy
+from instagram_http import configure_session_pool
+from instagram_metrics import Instrumentation, MetricsRegistry
+from instagram_parser import parse_video_info
+from instagram_ratelimit import UpstreamGuard
+from instagram_standin import StandInServer
+from instagram_strategies import StrategyRunner
+from instagram_urls import DedupIndex, parse_url
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+GROUPS = ['video_id', 'urls', 'parse', 'formats', 'e2e']
+
+DOWNLOADERS = [
+    ('instagram', InstagramDownloader),
+    ('railway', RailwayInstagramDownloader),
+    ('simple', SimpleInstagramDownloader),
+]
+
+SAMPLE_URLS = [
+    'https://www.instagram.com/p/C0ffee00000/',
+    'https://www.instagram.com/reel/C0ffee00001/?igshid=MzRlODBiNWFlZA==',
+    'https://instagram.com/tv/C0ffee00002',
+    'https://www.instagram.com/stories/instafetch_demo/3141592653589793238/',
+    'https://example.com/not-instagram',
+]
+
+TARGET_480P = FormatPolicy(target_height=480)
+
+# Fixtures with a video; InstagramDownloader reports a post without one as a failure
+E2E_FIXTURES = ['video_jsonld', 'video_og', 'carousel']
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of this process so far, in KB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(name: str, timings: List[float], elapsed: float, errors: int = 0,
+              **params: Any) -> Dict[str, Any]:
+    """Build one result record from per-call timings (seconds)"""
+    ordered = sorted(timings)
+    return {
+        'name': name,
+        'params': params,
+        'count': len(timings),
+        'errors': errors,
+        'throughput': round(len(timings) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 4) if timings else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 4),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 4),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 4),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def measure(name: str, fn: Callable[[Any], Any], inputs: List[Any], number: int,
+            **params: Any) -> Dict[str, Any]:
+    """Time fn once per input, number rounds over inputs"""
+    timings = []
+    started = time.perf_counter()
+    for _ in range(number):
+        for value in inputs:
+            call_started = time.perf_counter()
+            fn(value)
+            timings.append(time.perf_counter() - call_started)
+    return summarize(name, timings, time.perf_counter() - started, **params)
+
+
+def bench_video_id(args) -> List[Dict[str, Any]]:
+    results = []
+    for label, downloader_class in DOWNLOADERS:
+        downloader = downloader_class()
+        results.append(measure(f'video_id/{label}', downloader.extract_video_id, SAMPLE_URLS,
+                               args.number * 20))
+    return results
+
+
+URL_SHAPES = [
+    'https://www.instagram.com/p/{code}/',
+    'https://www.instagram.com/reel/{code}/?igshid=MzRlODBiNWFlZA==',
+    'https://instagram.com/reels/{code}/?utm_source=ig_web_copy_link',
+    'https://m.instagram.com/tv/{code}',
+    'http://instagr.am/p/{code}/',
+    'https://www.instagram.com/instafetch_demo/p/{code}/?img_index=2',
+    'https://www.instagram.com/share/reel/{code}/',
+    'https://www.instagram.com/stories/instafetch_demo/{code}/',
+]
+
+
+def synthetic_urls(count: int, unique: int, seed: int = 0) -> List[str]:
+    """count URLs over unique posts, in every known shape plus some that do not match"""
+    rng = random.Random(seed)
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-'
+    codes = [''.join(rng.choice(alphabet) for _ in range(11)) for _ in range(unique)]
+    return [rng.choice(URL_SHAPES).format(code=rng.choice(codes)) for _ in range(count)]
+
+
+def bench_urls(args) -> List[Dict[str, Any]]:
+    urls = synthetic_urls(args.urls, max(1, args.urls // 4))
+    results = [measure('urls/parse', parse_url, urls, 1, urls=len(urls))]
+
+    started = time.perf_counter()
+    index = DedupIndex()
+    for url in urls:
+        index.add(url)
+    elapsed = time.perf_counter() - started
+    results.append(summarize('urls/dedup', [elapsed], elapsed, **index.stats()))
+    # One "call" is the whole list; report URLs per second instead
+    results[-1]['throughput'] = round(len(urls) / elapsed, 2) if elapsed else 0.0
+    return results
+
+
+def bench_parse(args) -> List[Dict[str, Any]]:
+    results = []
+    for fixture in FIXTURES:
+        for size in PAGE_SIZES:
+            html = load_fixture(fixture, size)
+            results.append(measure(f'parse/{fixture}/{size // 1024}KB',
+                                   lambda page: parse_video_info(page, fixture), [html], args.number,
+                                   bytes=len(html)))
+    return results
+
+
+def synthetic_ytdlp_info(format_count: int) -> Dict[str, Any]:
+    """A yt-dlp info dict shaped like an Instagram reel with format_count formats"""
+    formats = []
+    for index in range(format_count):
+        height = 240 + (index % 8) * 120
+        formats.append({
+            'format_id': f'{index}',
+            'url': f'https://scontent.cdninstagram.com/v/{index}.mp4?oe=6F3A2B10',
+            'ext': 'mp4' if index % 3 else 'webm',
+            'vcodec': 'none' if index % 5 == 0 else 'avc1.64001F',
+            'acodec': 'mp4a.40.2' if index % 2 else 'none',
+            'width': height * 9 // 16,
+            'height': height,
+            'filesize': height * 4096,
+        })
+    return {'id': 'C0ffee00000', 'title': 'Reel', 'duration': 14.0, 'formats': formats}
+
+
+def bench_formats(args) -> List[Dict[str, Any]]:
+    downloader = InstagramDownloader()
+    results = []
+    for format_count in (4, 16, 64):
+        info = synthetic_ytdlp_info(format_count)
+        results.append(measure(f'formats/{format_count}', downloader.video_info_from_ytdlp, [info],
+                               args.number * 20, formats=format_count))
+        indexed = {'success': True, 'data': downloader.video_info_from_ytdlp(info)}
+        results.append(measure(f'formats/{format_count}/policy',
+                               lambda result: apply_format_policy(result, TARGET_480P), [indexed],
+                               args.number * 20, formats=format_count))
+    return results
+
+
+def run_e2e(downloader, urls: List[str], concurrency: int) -> tuple:
+    """Return (timings, errors, elapsed) for download_video over urls"""
+    def timed(url):
+        started = time.perf_counter()
+        result = downloader.download_video(url)
+        return time.perf_counter() - started, result.get('success', False)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, urls))
+    elapsed = time.perf_counter() - started
+
+    return [timing for timing, _ in outcomes], sum(1 for _, ok in outcomes if not ok), elapsed
+
+
+def unthrottled_guard() -> UpstreamGuard:
+    """A guard that never waits, retries or opens its breaker"""
+    return UpstreamGuard(rate=1e9, burst=10 ** 9, max_retries=0, failure_threshold=10 ** 9)
+
+
+def bench_e2e(args) -> List[Dict[str, Any]]:
+    urls = [f'http://www.instagram.com/p/{E2E_FIXTURES[index % len(E2E_FIXTURES)]}/'
+            for index in range(args.requests)]
+    results = []
+    with StandInServer(latency=args.latency, error_rate=args.error_rate, seed=0) as server:
+        for label, downloader_class in DOWNLOADERS:
+            downloader = downloader_class()
+            downloader.guard = unthrottled_guard()
+            if isinstance(downloader, InstagramDownloader):
+                downloader.strategies = StrategyRunner([('html', downloader.get_video_info_requests)])
+            downloader.session.proxies = {'http': server.url}
+            configure_session_pool(downloader.session, args.concurrency)
+            if args.timings:
+                downloader.instrumentation = Instrumentation(MetricsRegistry())
+
+            timings, errors, elapsed = run_e2e(downloader, urls, args.concurrency)
+            results.append(summarize(f'e2e/{label}', timings, elapsed, errors,
+                                     concurrency=args.concurrency, latency=args.latency,
+                                     error_rate=args.error_rate, instrumented=args.timings))
+    return results
+
+
+BENCHMARKS = {
+    'video_id': bench_video_id,
+    'urls': bench_urls,
+    'parse': bench_parse,
+    'formats': bench_formats,
+    'e2e': bench_e2e,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    header = f"{'benchmark':<28}{'count':>7}{'errors':>7}{'ops/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>8}"
+    if baseline is not None:
+        header += f"{'p50 Δ':>9}{'ops/s Δ':>9}"
+    print(header)
+
+    for result in results:
+        rss = result['peak_rss_kb']
+        line = (f"{result['name']:<28}{result['count']:>7}{result['errors']:>7}{result['throughput']:>11.1f}"
+                f"{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+                f"{(rss / 1024 if rss else 0):>8.1f}")
+        previous = (baseline or {}).get(result['name'])
+        if previous:
+            p50_change = (result['p50_ms'] / previous['p50_ms'] - 1) * 100 if previous['p50_ms'] else 0.0
+            ops_change = (result['throughput'] / previous['throughput'] - 1) * 100 if previous['throughput'] else 0.0
+            line += f"{p50_change:>+8.1f}%{ops_change:>+8.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', action='append', choices=GROUPS,
+                        help='run only this group (repeatable)')
+    parser.add_argument('--number', type=int, default=50, help='rounds per micro-benchmark')
+    parser.add_argument('--urls', type=int, default=100000, help='synthetic URLs to canonicalize and dedup')
+    parser.add_argument('--requests', type=int, default=60, help='end-to-end requests per downloader')
+    parser.add_argument('--concurrency', type=int, default=4, help='end-to-end client threads')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stand-in error responses')
+    parser.add_argument('--timings', action='store_true', help='instrument end-to-end runs (overhead check)')
+    parser.add_argument('--output', metavar='PATH', help='save results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='show changes against a saved run')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = {result['name']: result for result in json.load(f)['results']}
+
+    results = []
+    for group in args.only or GROUPS:
+        results.extend(BENCHMARKS[group](args))
+
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
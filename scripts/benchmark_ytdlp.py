@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Benchmark for yt-dlp extraction: subprocess per call vs in-process API
+Each call goes through InstagramDownloader's two yt-dlp code paths. Calls
+that fail (e.g. no network access) still measure the fixed per-call
+overhead of each path: interpreter start, imports and extractor loading.
+"""
+
+import argparse
+import statistics
+import time
+
+from instagram_downloader import InstagramDownloader
+
+
+def measure(extract, url, number):
+    """Return (per-call seconds, failures) for number calls of extract(url)"""
+    timings = []
+    failures = 0
+    for _ in range(number):
+        started = time.perf_counter()
+        try:
+            extract(url)
+        except Exception:
+            failures += 1
+        timings.append(time.perf_counter() - started)
+    return timings, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='https://www.instagram.com/p/C0ffee00000/')
+    parser.add_argument('--number', type=int, default=5, help='calls per path')
+    args = parser.parse_args()
+
+    downloader = InstagramDownloader()
+    paths = [
+        ('subprocess', downloader.extract_info_ytdlp_subprocess),
+        ('in-process', downloader.extract_info_ytdlp_in_process),
+    ]
+
+    print(f"{'path':<12}{'first ms':>10}{'median ms':>11}{'mean ms':>10}  failures")
+    for name, extract in paths:
+        timings, failures = measure(extract, args.url, args.number)
+        print(f"{name:<12}{timings[0] * 1000:>10.1f}{statistics.median(timings) * 1000:>11.1f}"
+              f"{statistics.mean(timings) * 1000:>10.1f}  {failures}/{args.number}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Batch extraction helpers for the Instagram downloader scripts
+
+URLs are fanned out over a thread pool sharing one pooled requests.Session
+and results are yielded in completion order, so callers can stream them.
+URLs naming a post already seen in the job are not fetched again; they get
+the first URL's result.
+"""
+
+import sys
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, Optional, Tuple
+
+from instagram_metrics import dumps_result
+from instagram_urls import DedupIndex
+
+DEFAULT_BATCH_WORKERS = 8
+
+
+def read_urls(stream: IO[str]) -> Iterator[str]:
+    """Yield one URL per non-empty line, skipping # comments"""
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def iter_batch(download: Callable[[str], Dict[str, Any]], urls: Iterable[str], session,
+               max_workers: int = DEFAULT_BATCH_WORKERS) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Run download over urls with bounded concurrency, yielding (url, result) as each completes
+
+    Each post is downloaded once: duplicates (by canonical key) share the
+    result of the first URL for it.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    from instagram_http import configure_session_pool
+
+    max_workers = max(1, int(max_workers))
+    configure_session_pool(session, max_workers)
+
+    def run(url: str) -> Dict[str, Any]:
+        try:
+            return download(url)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    # Only keep a small window of URLs queued so huge inputs stream lazily
+    window = max_workers * 2
+    urls = iter(urls)
+    pending = {}
+    index = DedupIndex()
+    # Duplicates waiting on an in-flight key, and results of finished keys
+    waiting = {}
+    finished = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                url = next(urls, None)
+                if url is None:
+                    exhausted = True
+                    break
+                key, first = index.add(url)
+                if first:
+                    pending[executor.submit(run, url)] = url, key
+                    if key is not None:
+                        waiting[key] = []
+                elif key in finished:
+                    yield url, finished[key]
+                else:
+                    waiting[key].append(url)
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, key = pending.pop(future)
+                result = future.result()
+                yield url, result
+                if key is not None:
+                    finished[key] = result
+                    for duplicate in waiting.pop(key):
+                        yield duplicate, result
+
+
+def run_batch(downloader, stream: IO[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+              output_dir: Optional[str] = None, output: IO[str] = None) -> None:
+    """Write one JSON line per URL read from stream as results complete"""
+    output = output or sys.stdout
+    instrumentation = getattr(downloader, 'instrumentation', None)
+    metrics = instrumentation.metrics if instrumentation is not None else None
+
+    results = downloader.download_videos(read_urls(stream), max_workers=max_workers, output_dir=output_dir)
+    for url, result in results:
+        output.write(dumps_result({'url': url, **result}, metrics=metrics) + '\n')
+        output.flush()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Shortcode-keyed metadata cache for the Instagram downloader scripts
+
+Results are kept in an in-memory LRU with size and TTL limits, optionally
+backed by a SQLite file so they survive process restarts. The file is
+bounded like the LRU: evicted entries are deleted from it too, and a
+periodic sweep drops rows past the stale window and trims it to
+max_entries (rows left by an earlier run are not in the LRU). Failed
+extractions are cached as negatives with a shorter TTL. Expired successes
+are kept for a while longer so get_stale can serve them while Instagram
+is unavailable.
+
+The media URLs in a result are signed and expire (their oe= parameter),
+so a result lives until expiry_margin before its earliest URL expires,
+capped at max_ttl; ttl only applies to results without signed URLs.
+CacheRefresher re-extracts entries that are being hit shortly before
+they expire, so popular posts never go cold.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from instagram_urls import cdn_url_expiry
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 3600.0
+DEFAULT_NEGATIVE_TTL = 60.0
+DEFAULT_STALE_TTL = 6 * 3600.0
+DEFAULT_MAX_TTL = 24 * 3600.0
+DEFAULT_EXPIRY_MARGIN = 300.0
+DEFAULT_REFRESH_LEAD = 120.0
+DEFAULT_REFRESH_MIN_HITS = 2
+DEFAULT_REFRESH_INTERVAL = 30.0
+# Seconds between sweeps of the on-disk tier
+DEFAULT_SWEEP_INTERVAL = 60.0
+
+Extract = Callable[[], Dict[str, Any]]
+
+
+def media_expiry(result: Dict[str, Any]) -> Optional[float]:
+    """Earliest expiry of the signed media URLs in a result, or None"""
+    data = result.get('data') or {}
+    urls = [data.get('video_url'), data.get('thumbnail')]
+    for item in data.get('media') or ():
+        urls += [item.get('url'), item.get('thumbnail')]
+    urls += [fmt.get('url') for fmt in data.get('formats') or ()]
+    expiries = [expiry for expiry in map(cdn_url_expiry, urls) if expiry is not None]
+    return min(expiries) if expiries else None
+
+
+class MetadataCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL, path: Optional[str] = None,
+                 stale_ttl: float = DEFAULT_STALE_TTL, max_ttl: float = DEFAULT_MAX_TTL,
+                 expiry_margin: float = DEFAULT_EXPIRY_MARGIN):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_ttl = max_ttl
+        self.expiry_margin = expiry_margin
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'already_expired': 0,
+        }
+
+        self._db = None
+        self._swept_at = 0.0
+        if path:
+            import sqlite3
+
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata_cache '
+                '(key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._sweep(time.time())
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires_at = entry[0], entry[1]
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    entry[2] += 1
+                    self._count_hit(result)
+                    return result
+                if not result.get('success') or expires_at + self.stale_ttl <= now:
+                    del self._entries[key]
+                self._counters['expirations'] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT result, expires_at FROM metadata_cache WHERE key = ? AND expires_at > ?',
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    self._store(key, result, row[1])[2] += 1
+                    self._counters['disk_hits'] += 1
+                    self._count_hit(result)
+                    return result
+
+            self._counters['misses'] += 1
+            return None
+
+    def get_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a successful result for key even if it has expired, within the stale TTL"""
+        with self._lock:
+            result = self._find_stale(key)
+            if result is not None:
+                self._counters['stale_hits'] += 1
+            return result
+
+    def ttl_for(self, result: Dict[str, Any], now: Optional[float] = None) -> float:
+        """Seconds to cache a result: up to its media URLs' expiry, the TTL, or the negative TTL"""
+        if not result.get('success'):
+            return self.negative_ttl
+        expiry = media_expiry(result)
+        if expiry is None:
+            return self.ttl
+        return min(self.max_ttl, expiry - self.expiry_margin - (time.time() if now is None else now))
+
+    def put(self, key: str, result: Dict[str, Any], refresh: Optional[Extract] = None) -> None:
+        """Cache a download_video result; refresh re-extracts it for CacheRefresher"""
+        now = time.time()
+        ttl = self.ttl_for(result, now)
+        if ttl <= 0:
+            if result.get('success') and self.ttl > 0:
+                # Its URLs are expired or about to; serving it later would only get 403s
+                with self._lock:
+                    self._counters['already_expired'] += 1
+            return
+
+        expires_at = now + ttl
+        with self._lock:
+            if not result.get('success') and self._find_stale(key) is not None:
+                # Keep the earlier success for get_stale instead of caching the failure
+                return
+            self._store(key, result, expires_at)[3] = refresh
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO metadata_cache (key, result, expires_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(result), expires_at)
+                )
+                if now - self._swept_at >= DEFAULT_SWEEP_INTERVAL:
+                    self._sweep(now)
+                self._db.commit()
+
+    def get_or_extract(self, key: str, extract: Extract, refresh: Optional[Extract] = None) -> Dict[str, Any]:
+        """Return the cached result for key, running extract and caching it on a miss
+
+        refresh (extract by default) is kept with the entry so CacheRefresher
+        can run it again; callers that coalesce extractions pass one that
+        goes through the same single-flight key.
+        """
+        refresh = refresh or extract
+        result = self.get(key)
+        if result is None:
+            result = extract()
+            self.put(key, result, refresh=refresh)
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[3] is None:
+                    entry[3] = refresh
+        return result
+
+    def due_for_refresh(self, lead: float, min_hits: int) -> List[Tuple[str, Extract]]:
+        """(key, refresh) of successful entries expiring within lead seconds and hit at least min_hits times
+
+        Entries already past expiry are left alone; they are only kept for get_stale.
+        """
+        now = time.time()
+        deadline = now + lead
+        with self._lock:
+            return [(key, entry[3]) for key, entry in self._entries.items()
+                    if entry[3] is not None and entry[0].get('success') and now < entry[1] <= deadline
+                    and entry[2] >= min_hits]
+
+    def disarm_refresh(self, key: str) -> None:
+        """Stop refreshing key until it is hit min_hits times again (e.g. after a failed refresh)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = 0
+                entry[3] = None
+
+    def clear(self) -> None:
+        """Drop every cached entry, including the on-disk tier"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM metadata_cache')
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                **self._counters,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': round(self._counters['hits'] / lookups, 4) if lookups else 0.0,
+                'persistent': self._db is not None,
+            }
+
+    def close(self) -> None:
+        """Close the on-disk tier"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _find_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        cutoff = now - self.stale_ttl
+        entry = self._entries.get(key)
+        if entry is not None and entry[0].get('success') and entry[1] > cutoff:
+            result = entry[0]
+        elif self._db is not None:
+            row = self._db.execute(
+                'SELECT result FROM metadata_cache WHERE key = ? AND expires_at > ?',
+                (key, cutoff)
+            ).fetchone()
+            result = json.loads(row[0]) if row is not None else None
+            if result is not None and not result.get('success'):
+                result = None
+        else:
+            result = None
+
+        # A stale copy is only worth serving while its media URLs still work
+        expiry = media_expiry(result) if result is not None else None
+        if expiry is not None and expiry <= now:
+            return None
+        return result
+
+    def _count_hit(self, result: Dict[str, Any]) -> None:
+        self._counters['hits'] += 1
+        if not result.get('success'):
+            self._counters['negative_hits'] += 1
+
+    def _store(self, key: str, result: Dict[str, Any], expires_at: float) -> list:
+        # [result, expires_at, hits, refresh]; hits count lookups since the result was stored
+        entry = [result, expires_at, 0, None]
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+            if self._db is not None:
+                self._db.execute('DELETE FROM metadata_cache WHERE key = ?', (evicted,))
+                self._db.commit()
+        return entry
+
+    def _sweep(self, now: float) -> None:
+        # Past the stale window a row can serve nothing, not even get_stale
+        self._db.execute('DELETE FROM metadata_cache WHERE expires_at <= ?', (now - self.stale_ttl,))
+        self._db.execute(
+            'DELETE FROM metadata_cache WHERE key NOT IN '
+            '(SELECT key FROM metadata_cache ORDER BY expires_at DESC LIMIT ?)',
+            (self.max_entries,)
+        )
+        self._db.commit()
+        self._swept_at = now
+
+
+class CacheRefresher:
+    """Re-extract hot cache entries in the background before their media URLs expire
+
+    An entry is hot when it has been hit at least min_hits times since it
+    was stored; a pass every interval seconds refreshes hot entries that
+    expire within lead seconds, so their next hits are served warm.
+    """
+
+    def __init__(self, cache: MetadataCache, lead: float = DEFAULT_REFRESH_LEAD,
+                 min_hits: int = DEFAULT_REFRESH_MIN_HITS, interval: Optional[float] = None):
+        self.cache = cache
+        self.lead = lead
+        self.min_hits = max(1, int(min_hits))
+        # Passes must come more often than lead, or entries expire between them
+        self.interval = interval if interval is not None else min(DEFAULT_REFRESH_INTERVAL, lead / 2)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {'passes': 0, 'refreshed': 0, 'failed': 0}
+
+    def run_once(self) -> int:
+        """Refresh every entry that is due; return how many were refreshed"""
+        refreshed = 0
+        for key, refresh in self.cache.due_for_refresh(self.lead, self.min_hits):
+            try:
+                result = refresh()
+            except Exception:
+                result = {'success': False}
+            if result.get('success'):
+                self.cache.put(key, result, refresh=refresh)
+                refreshed += 1
+            else:
+                # Leave the entry to expire (get_stale can still serve it if upstream is down),
+                # and stop retrying it every pass unless it keeps being hit
+                self.cache.disarm_refresh(key)
+                self._counters['failed'] += 1
+        self._counters['passes'] += 1
+        self._counters['refreshed'] += refreshed
+        return refreshed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> 'CacheRefresher':
+        """Refresh on a background daemon thread"""
+        self._thread = threading.Thread(target=self._run, name='cache-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, 'lead': self.lead, 'min_hits': self.min_hits, 'interval': self.interval}
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Command line handling shared by the Instagram downloader scripts
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+from typing import List, Optional
+
+from instagram_batch import DEFAULT_BATCH_WORKERS, read_urls, run_batch
+from instagram_cache import DEFAULT_REFRESH_LEAD, DEFAULT_TTL, MetadataCache
+from instagram_crawl import run_crawl
+from instagram_formats import FormatPolicy
+from instagram_jobs import DEFAULT_MAX_ATTEMPTS, print_job_progress, run_jobs
+from instagram_media import DEFAULT_CONNECTIONS, MediaDownloader, print_progress
+from instagram_metrics import Instrumentation, MetricsRegistry, dumps_result
+from instagram_ratelimit import DEFAULT_MAX_RETRIES, DEFAULT_RATE, UpstreamGuard
+from instagram_urls import extract_video_id, parse_profile_url
+from instagram_worker import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, run_worker
+
+
+class _UsageError(Exception):
+    pass
+
+
+class _JsonArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise _UsageError(message)
+
+
+def fail(message: str) -> None:
+    """Print a JSON error and exit with status 1"""
+    print(json.dumps({
+        'success': False,
+        'error': message
+    }))
+    sys.exit(1)
+
+
+def parse_args(script_name: str, argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse downloader arguments, reporting usage errors as JSON"""
+    usage = (f'Usage: python {script_name} <instagram_url> | --batch <file|-> | --jobs <queue.sqlite> '
+             '| --crawl <profile_url> | --worker '
+             '[--concurrency N] [--timeout SECONDS] [--cache-db PATH] [--cache-ttl SECONDS] [--refresh-ahead SECONDS] '
+             '[--output PATH] [--connections N] [--max-rate BYTES_PER_SECOND] [--progress] '
+             '[--timings] [--metrics PATH] [--upstream-rate REQUESTS_PER_SECOND] [--retries N] '
+             '[--max-height N] [--max-bytes N] [--target-height N] [--audio-only] [--index N] '
+             '[--checkpoint PATH] [--reels-only] [--limit N] [--processes N] [--max-attempts N] '
+             '[--store DIR] [--store-max-bytes N] [--proxy URL ...]')
+
+    parser = _JsonArgumentParser(prog=script_name, add_help=False)
+    parser.add_argument('url', nargs='?')
+    parser.add_argument('--worker', action='store_true',
+                        help='serve newline-delimited JSON requests on stdin')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="extract every URL listed in FILE ('-' for stdin)")
+    parser.add_argument('--jobs', metavar='PATH',
+                        help='run jobs from a durable SQLite queue (adding the --batch URLs) on every core')
+    parser.add_argument('--processes', type=int, help='job runner processes (default: one per core)')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help='attempts per job before it is recorded as failed')
+    parser.add_argument('--crawl', metavar='PROFILE_URL',
+                        help="extract every post of a profile, paging through its feed")
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='record crawl progress in PATH and resume from it')
+    parser.add_argument('--reels-only', action='store_true', help='crawl only video posts')
+    parser.add_argument('--limit', type=int, help='crawl at most N new posts')
+    parser.add_argument('--concurrency', type=int)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--cache-db', metavar='PATH',
+                        help='persist the metadata cache in a SQLite file')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL,
+                        help='lifetime of cached results without signed media URLs')
+    parser.add_argument('--refresh-ahead', type=float, default=DEFAULT_REFRESH_LEAD,
+                        help='in worker mode, re-extract hot posts this long before their URLs expire (0 disables)')
+    parser.add_argument('--output', metavar='PATH',
+                        help='download the media to PATH (a directory in batch mode)')
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help='parallel Range requests per media download')
+    parser.add_argument('--max-rate', type=float,
+                        help='bandwidth cap for media downloads in bytes per second')
+    parser.add_argument('--store', metavar='DIR',
+                        help='keep downloaded media in a content-addressed store, linking duplicates')
+    parser.add_argument('--store-max-bytes', type=int,
+                        help='evict the least recently used media beyond this size (default 5 GiB)')
+    parser.add_argument('--progress', action='store_true',
+                        help='report media download progress on stderr')
+    parser.add_argument('--timings', action='store_true',
+                        help='add a per-stage timings block to every result')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write Prometheus metrics to PATH when a batch finishes (implies --timings)')
+
+    parser.add_argument('--proxy', action='append', metavar='URL',
+                        help="send requests through a pool of egress proxies (repeat; 'direct' for none)")
+    parser.add_argument('--upstream-rate', type=float, default=DEFAULT_RATE,
+                        help='sustained requests per second to each Instagram host')
+    parser.add_argument('--retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help='retries for throttled or failed upstream requests')
+
+    parser.add_argument('--max-height', type=int, help='pick the tallest format at most N pixels high')
+    parser.add_argument('--max-bytes', type=int, help='pick the tallest format of at most N bytes')
+    parser.add_argument('--target-height', type=int,
+                        help='pick the smallest format at least N pixels high')
+    parser.add_argument('--audio-only', action='store_true', help='pick the best audio-only format')
+    parser.add_argument('--index', type=int, help='pick item N (1-based) of a carousel post')
+
+    try:
+        args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    except _UsageError:
+        fail(usage)
+
+    # Exactly one of a URL, --batch and/or --jobs, --crawl or --worker
+    if [bool(args.url), bool(args.batch or args.jobs), bool(args.crawl), args.worker].count(True) != 1:
+        fail(usage)
+
+    if args.metrics:
+        args.timings = True
+
+    if args.index is not None and args.index < 1:
+        fail('--index must be a positive integer')
+    if args.limit is not None and args.limit < 1:
+        fail('--limit must be a positive integer')
+    if (args.processes is not None and args.processes < 1) or args.max_attempts < 1:
+        fail('--processes and --max-attempts must be positive integers')
+
+    if args.concurrency is None:
+        args.concurrency = DEFAULT_BATCH_WORKERS if (args.batch or args.jobs or args.crawl) else DEFAULT_CONCURRENCY
+
+    return args
+
+
+def cache_from_args(args: argparse.Namespace) -> Optional[MetadataCache]:
+    """Build the metadata cache for long-running modes or when a cache file is given"""
+    if not (args.cache_db or args.worker or args.batch or args.crawl):
+        return None
+    try:
+        return MetadataCache(ttl=args.cache_ttl, path=args.cache_db)
+    except Exception as e:
+        fail(f'Could not open cache: {str(e)}')
+
+
+def store_from_args(args: argparse.Namespace) -> Optional['MediaStore']:
+    """Open the media store when --store is given"""
+    if not args.store:
+        return None
+    from instagram_store import DEFAULT_STORE_BYTES, MediaStore
+
+    try:
+        return MediaStore(args.store, max_bytes=args.store_max_bytes or DEFAULT_STORE_BYTES)
+    except Exception as e:
+        fail(f'Could not open media store: {str(e)}')
+
+
+def policy_from_args(args: argparse.Namespace) -> FormatPolicy:
+    """Build the format selection policy, reporting invalid combinations as JSON"""
+    try:
+        return FormatPolicy.from_dict({
+            'max_height': args.max_height,
+            'max_bytes': args.max_bytes,
+            'target_height': args.target_height,
+            'audio_only': args.audio_only,
+        })
+    except ValueError as e:
+        fail(str(e))
+
+
+def build_downloader(downloader_class, args: argparse.Namespace):
+    """Create a downloader configured from the command line arguments"""
+    downloader = downloader_class(cache=cache_from_args(args))
+    if args.proxy:
+        from instagram_egress import EgressPool
+
+        downloader.session = EgressPool(args.proxy).session(template=downloader.session)
+    downloader.guard = UpstreamGuard(rate=args.upstream_rate, max_retries=args.retries)
+    downloader.media = MediaDownloader(
+        downloader.session,
+        connections=args.connections,
+        max_bytes_per_second=args.max_rate,
+        progress=print_progress if args.progress else None,
+        store=store_from_args(args),
+    )
+    policy = policy_from_args(args)
+    if not policy.is_default:
+        downloader.format_policy = policy
+    if args.timings:
+        # Long-running modes also aggregate the timings into Prometheus metrics
+        metrics = MetricsRegistry() if (args.worker or args.batch or args.crawl) and not args.jobs else None
+        downloader.instrumentation = Instrumentation(metrics)
+    return downloader
+
+
+def run_job_queue(downloader_class, args: argparse.Namespace) -> None:
+    """Run --jobs mode: queue the --batch URLs, if any, and work through the queue on every core"""
+    processes = args.processes or os.cpu_count() or 1
+    # Each process rate-limits on its own, so split the upstream budget between them;
+    # progress bars from several processes would interleave, so --progress reports the queue instead
+    worker_args = argparse.Namespace(**{**vars(args), 'upstream_rate': args.upstream_rate / processes,
+                                        'progress': False})
+    urls = None
+    if args.batch == '-':
+        urls = read_urls(sys.stdin)
+    elif args.batch:
+        try:
+            with open(args.batch, encoding='utf-8') as stream:
+                urls = list(read_urls(stream))
+        except OSError as e:
+            fail(f'Could not read batch file: {str(e)}')
+
+    try:
+        run_jobs(args.jobs, functools.partial(build_downloader, downloader_class, worker_args), urls,
+                 processes=processes, threads=args.concurrency, output_dir=args.output,
+                 max_attempts=args.max_attempts,
+                 progress=print_job_progress if args.progress else None)
+    except Exception as e:
+        fail(f'Job runner failed: {str(e)}')
+
+
+def run_cli(downloader_class, script_name: str) -> None:
+    """Parse arguments and run a downloader in single-URL, batch, job queue, crawl or worker mode"""
+    args = parse_args(script_name)
+
+    # Reject bad URLs before the downloader pulls in requests
+    if args.url and not extract_video_id(args.url):
+        print(json.dumps({
+            'success': False,
+            'error': 'Could not extract video ID from URL'
+        }, indent=2))
+        return
+    if args.crawl and not parse_profile_url(args.crawl):
+        fail('Could not extract a username from the profile URL')
+    if args.upstream_rate <= 0 or args.retries < 0:
+        fail('--upstream-rate must be positive and --retries non-negative')
+
+    if args.jobs:
+        policy_from_args(args)
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        run_job_queue(downloader_class, args)
+        return
+
+    downloader = build_downloader(downloader_class, args)
+
+    if args.worker:
+        run_worker(downloader, concurrency=args.concurrency, timeout=args.timeout,
+                   refresh_ahead=args.refresh_ahead)
+        return
+
+    if args.batch or args.crawl:
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        if args.crawl:
+            try:
+                run_crawl(downloader, args.crawl, args.checkpoint, max_workers=args.concurrency,
+                          output_dir=args.output, reels_only=args.reels_only, limit=args.limit)
+            except (OSError, ValueError) as e:
+                fail(f'Could not use checkpoint: {str(e)}')
+        elif args.batch == '-':
+            run_batch(downloader, sys.stdin, max_workers=args.concurrency, output_dir=args.output)
+        else:
+            try:
+                stream = open(args.batch, encoding='utf-8')
+            except OSError as e:
+                fail(f'Could not read batch file: {str(e)}')
+            with stream:
+                run_batch(downloader, stream, max_workers=args.concurrency, output_dir=args.output)
+        if args.metrics:
+            try:
+                with open(args.metrics, 'w', encoding='utf-8') as f:
+                    f.write(downloader.instrumentation.metrics.render())
+            except OSError as e:
+                fail(f'Could not write metrics: {str(e)}')
+        return
+
+    try:
+        result = downloader.download_video(args.url, args.output, index=args.index)
+        print(dumps_result(result, indent=2))
+    except Exception as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e)
+        }))
+        sys.exit(1)
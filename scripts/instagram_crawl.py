@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Profile crawling for the Instagram downloader scripts
+
+crawl_profile pages through a profile's feed lazily, one API page at a
+time, and feeds the post URLs into the downloader's bounded batch pool,
+yielding (url, result) as each post completes. Nothing is collected in
+memory beyond the pages still in flight.
+
+A checkpoint file records the pagination cursor, every extracted
+shortcode and every failed post as JSON lines, flushed as they happen. The
+cursor only moves past a page once all of its posts have finished, so a
+crawl that is killed or stopped resumes from the oldest unfinished page and
+skips the posts it already has. Failed posts are retried first on resume,
+whichever page they came from.
+"""
+
+import json
+import os
+import sys
+from collections import deque
+from typing import Any, Dict, IO, Iterator, Optional, Set, Tuple
+
+from instagram_batch import DEFAULT_BATCH_WORKERS
+from instagram_metrics import dumps_result
+from instagram_ratelimit import UpstreamUnavailable
+from instagram_urls import CANONICAL_HOST, InstagramURL, parse_profile_url, parse_url
+
+DEFAULT_PAGE_SIZE = 12
+# Instagram's web app id; the feed API refuses requests without it
+WEB_APP_ID = '936619743392459'
+# media_type of video posts in the feed API (1 is a photo, 8 a carousel)
+VIDEO_MEDIA_TYPE = 2
+
+
+def feed_url(scheme: str, username: str, cursor: Optional[str], page_size: int = DEFAULT_PAGE_SIZE) -> str:
+    """URL of one page of a profile's feed, starting after cursor"""
+    url = f'{scheme}://{CANONICAL_HOST}/api/v1/feed/user/{username}/username/?count={page_size}'
+    return url + f'&max_id={cursor}' if cursor else url
+
+
+def iter_profile_pages(session, scheme: str, username: str, cursor: Optional[str] = None,
+                       guard=None, page_size: int = DEFAULT_PAGE_SIZE,
+                       timeout: float = 15) -> Iterator[Tuple[list, Optional[str]]]:
+    """Lazily yield (items, next_cursor) per feed page; next_cursor is None on the last page"""
+    from instagram_http import raise_for_upstream
+
+    def fetch(url: str) -> Dict[str, Any]:
+        response = session.get(url, timeout=timeout, headers={'X-IG-App-ID': WEB_APP_ID})
+        raise_for_upstream(response)
+        return response.json()
+
+    while True:
+        url = feed_url(scheme, username, cursor, page_size)
+        page = guard.call(url, lambda: fetch(url)) if guard is not None else fetch(url)
+        items = page.get('items') or []
+        cursor = page.get('next_max_id') if page.get('more_available') else None
+        yield items, cursor
+        if cursor is None or not items:
+            return
+
+
+def post_url(item: Dict[str, Any], scheme: str = 'https') -> Optional[str]:
+    """Canonical post URL of a feed item; reels get /reel/ URLs"""
+    code = item.get('code')
+    if not code:
+        return None
+    kind = 'reel' if item.get('product_type') == 'clips' else 'p'
+    return InstagramURL(kind, code, scheme).url
+
+
+class CrawlCheckpoint:
+    """Append-only JSON lines record of a crawl's cursor, extracted and failed posts
+
+    Lines are {"profile": name}, {"cursor": value}, {"done": shortcode} and
+    {"failed": shortcode, "url": url}; loading replays them, so the last
+    cursor wins and a post that failed before succeeding is not retried.
+    """
+
+    def __init__(self, path: Optional[str], profile: str):
+        self.path = path
+        self.profile = profile
+        self.cursor: Optional[str] = None
+        self.finished = False
+        self.done: Set[str] = set()
+        # Shortcode -> URL of posts whose last attempt failed
+        self.failed: Dict[str, str] = {}
+        self._file: Optional[IO[str]] = None
+
+        if path is None:
+            return
+        if os.path.exists(path):
+            self._load(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        if os.path.getsize(path) == 0:
+            self._write({'profile': profile})
+
+    def _load(self, path: str) -> None:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; everything before it is intact
+                    continue
+                if 'profile' in record and record['profile'] != self.profile:
+                    raise ValueError(f"Checkpoint {path} belongs to profile {record['profile']}")
+                if 'cursor' in record:
+                    self.cursor = record['cursor']
+                    self.finished = bool(record.get('finished'))
+                if 'done' in record:
+                    self.done.add(record['done'])
+                    self.failed.pop(record['done'], None)
+                if 'failed' in record and record['failed'] not in self.done:
+                    self.failed[record['failed']] = record['url']
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def mark_done(self, shortcode: str) -> None:
+        self.done.add(shortcode)
+        self.failed.pop(shortcode, None)
+        self._write({'done': shortcode})
+
+    def mark_failed(self, shortcode: str, url: str) -> None:
+        self.failed[shortcode] = url
+        self._write({'failed': shortcode, 'url': url})
+
+    def advance(self, cursor: Optional[str]) -> None:
+        """Record that every post before cursor has finished; None means the whole feed"""
+        self.cursor = cursor
+        self.finished = cursor is None
+        self._write({'cursor': cursor, 'finished': True} if cursor is None else {'cursor': cursor})
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def crawl_profile(downloader, profile_url: str, checkpoint_path: Optional[str] = None,
+                  max_workers: int = DEFAULT_BATCH_WORKERS, output_dir: Optional[str] = None,
+                  reels_only: bool = False, limit: Optional[int] = None,
+                  page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Extract a profile's posts, yielding (url, result) as each completes
+
+    limit caps the posts fetched in this run; reels_only skips posts that
+    are not videos. Only successful posts are marked done; failed ones are
+    recorded and retried when the crawl resumes. The crawl stops early when
+    a result says upstream is unavailable.
+    """
+    profile = parse_profile_url(profile_url)
+    if profile is None:
+        raise ValueError('Could not extract a username from the profile URL')
+    scheme, username = profile
+
+    checkpoint = CrawlCheckpoint(checkpoint_path, username)
+    # Pages whose posts are still in flight, oldest first: [next_cursor, unfinished, fully_queued]
+    pages = deque()
+    # Page of each queued post; None for retries of earlier failures
+    page_of: Dict[str, Optional[list]] = {}
+
+    def advance() -> None:
+        while pages and pages[0][1] == 0 and pages[0][2]:
+            checkpoint.advance(pages.popleft()[0])
+
+    def urls() -> Iterator[str]:
+        queued = 0
+        seen: Set[str] = set()
+        for code, url in list(checkpoint.failed.items()):
+            if limit is not None and queued >= limit:
+                return
+            seen.add(code)
+            page_of[code] = None
+            queued += 1
+            yield url
+        if checkpoint.finished:
+            return
+        for items, cursor in iter_profile_pages(downloader.session, scheme, username, checkpoint.cursor,
+                                                guard=getattr(downloader, 'guard', None),
+                                                page_size=page_size):
+            page = [cursor, 0, False]
+            pages.append(page)
+            for item in items:
+                url = post_url(item, scheme)
+                code = item.get('code')
+                if url is None or code in checkpoint.done or code in seen:
+                    continue
+                if reels_only and item.get('media_type') != VIDEO_MEDIA_TYPE:
+                    continue
+                if limit is not None and queued >= limit:
+                    return
+                seen.add(code)
+                page_of[code] = page
+                page[1] += 1
+                queued += 1
+                yield url
+            page[2] = True
+            advance()
+            if limit is not None and queued >= limit:
+                return
+
+    try:
+        for url, result in downloader.download_videos(urls(), max_workers=max_workers, output_dir=output_dir):
+            yield url, result
+            code = parse_url(url).shortcode
+            if result.get('success'):
+                checkpoint.mark_done(code)
+            else:
+                checkpoint.mark_failed(code, url)
+            if result.get('retry_after') is not None:
+                return
+            page = page_of.pop(code)
+            if page is not None:
+                page[1] -= 1
+                advance()
+    except UpstreamUnavailable as e:
+        # Paging itself is being refused; the checkpoint still holds the last safe cursor
+        yield profile_url, {'success': False, 'error': str(e), 'retry_after': round(e.retry_in, 1)}
+    except Exception as e:
+        yield profile_url, {'success': False, 'error': f'Failed to fetch the profile feed: {str(e)}'}
+    finally:
+        checkpoint.close()
+
+
+def run_crawl(downloader, profile_url: str, checkpoint_path: Optional[str] = None,
+              max_workers: int = DEFAULT_BATCH_WORKERS, output_dir: Optional[str] = None,
+              reels_only: bool = False, limit: Optional[int] = None, output: IO[str] = None) -> None:
+    """Write one JSON line per crawled post, flushed as each completes"""
+    output = output or sys.stdout
+    instrumentation = getattr(downloader, 'instrumentation', None)
+    metrics = instrumentation.metrics if instrumentation is not None else None
+
+    results = crawl_profile(downloader, profile_url, checkpoint_path, max_workers=max_workers,
+                            output_dir=output_dir, reels_only=reels_only, limit=limit)
+    for url, result in results:
+        output.write(dumps_result({'url': url, **result}, metrics=metrics) + '\n')
+        output.flush()
@@ -5,90 +5,194 @@ A Python script to extract and download Instagram videos using yt-dlp
 """
 
 import json
-import sys
 import os
-import re
-import requests
-from urllib.parse import urlparse, parse_qs
-import subprocess
-import tempfile
-from typing import Dict, Optional, Any
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Any, Tuple
+
+# requests, subprocess and the HTTP/media helpers load on first use, keeping CLI startup fast
+from instagram_batch import DEFAULT_BATCH_WORKERS, iter_batch
+from instagram_cli import run_cli
+from instagram_formats import (DEFAULT_POLICY, FormatPolicy, apply_format, apply_format_policy, build_format_index,
+                               media_item, select_media)
+from instagram_metrics import Instrumentation, instrumented, stage
+from instagram_ratelimit import AttemptCancelled, UpstreamGuard, UpstreamUnavailable, unavailable_result
+from instagram_singleflight import SingleFlight
+from instagram_urls import extract_video_id, parse_url
+
+if TYPE_CHECKING:
+    from instagram_cache import MetadataCache
+    from instagram_media import MediaDownloader
+
+class _QuietLogger:
+    """yt-dlp logger that drops messages; errors surface as exceptions instead"""
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+def ytdlp_available() -> bool:
+    """Whether yt-dlp can run here, in process or as the yt-dlp binary"""
+    import importlib.util
+    import shutil
+
+    return importlib.util.find_spec('yt_dlp') is not None or shutil.which('yt-dlp') is not None
 
 class InstagramDownloader:
-    def __init__(self):
+    def __init__(self, cache: Optional['MetadataCache'] = None, media: Optional['MediaDownloader'] = None,
+                 ytdlp_in_process: bool = True, strategy_mode: str = 'hedge'):
+        import requests
+        from instagram_http import configure_session_pool
+        from instagram_media import MediaDownloader
+        from instagram_strategies import StrategyRunner
+
+        self.cache = cache
+        self.ytdlp_in_process = ytdlp_in_process
+        strategies = [('html', self.get_video_info_requests)]
+        # Without yt-dlp every request would pay for a doomed attempt before the HTML hedge
+        if ytdlp_available():
+            strategies.insert(0, ('ytdlp', self.get_video_info_ytdlp))
+        self.strategies = StrategyRunner(strategies, mode=strategy_mode)
+        self._ytdlp_local = threading.local()
+        self.flight = SingleFlight()
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+        configure_session_pool(self.session)
+        self.media = media or MediaDownloader(self.session)
+        # Set to an Instrumentation to attach per-stage timings to results
+        self.instrumentation: Optional[Instrumentation] = None
+        # Re-selects the format of yt-dlp results from their format index
+        self.format_policy: Optional[FormatPolicy] = None
+        # Rate limits, retries and circuit breaking, shared with every downloader in the process
+        self.guard = UpstreamGuard.shared()
     
     def extract_video_id(self, url: str) -> Optional[str]:
         """Extract video ID from Instagram URL"""
-        patterns = [
-            r'instagram\.com/p/([A-Za-z0-9_-]+)',
-            r'instagram\.com/reel/([A-Za-z0-9_-]+)',
-            r'instagram\.com/tv/([A-Za-z0-9_-]+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        return extract_video_id(url)
     
+    def _ytdlp_instance(self):
+        """Return this thread's reusable YoutubeDL with only the Instagram extractor loaded"""
+        ydl = getattr(self._ytdlp_local, 'ydl', None)
+        if ydl is None:
+            import yt_dlp
+            from yt_dlp.extractor.instagram import InstagramIE
+
+            # auto_init=False skips registering yt-dlp's whole extractor list
+            ydl = yt_dlp.YoutubeDL({
+                'quiet': True,
+                'no_warnings': True,
+                'skip_download': True,
+                'socket_timeout': 30,
+                'logger': _QuietLogger(),
+            }, auto_init=False)
+            ydl.add_info_extractor(InstagramIE())
+            self._ytdlp_local.ydl = ydl
+        return ydl
+
+    def extract_info_ytdlp_in_process(self, url: str) -> Dict[str, Any]:
+        """Run yt-dlp's Instagram extractor in this process"""
+        import yt_dlp
+
+        try:
+            return self._ytdlp_instance().extract_info(url, download=False)
+        except yt_dlp.utils.DownloadError as e:
+            raise Exception(f"yt-dlp failed: {str(e)}")
+
+    def extract_info_ytdlp_subprocess(self, url: str) -> Dict[str, Any]:
+        """Run the yt-dlp binary and parse its --dump-json output"""
+        import subprocess
+
+        # Use yt-dlp to extract video information
+        cmd = [
+            'yt-dlp',
+            '--dump-json',
+            '--no-download',
+            '--no-warnings',
+            url
+        ]
+
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+
+        if result.returncode != 0:
+            raise Exception(f"yt-dlp failed: {result.stderr}")
+
+        # Parse the JSON output
+        return json.loads(result.stdout)
+
+    def video_info_from_ytdlp(self, video_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Index the formats of a yt-dlp info dict and build the result from the default pick"""
+        entries = [entry for entry in video_info.get('entries') or [] if entry]
+        if entries:
+            # A carousel: the result describes its first video and lists every item
+            first = next((entry for entry in entries if entry.get('formats')), entries[0])
+            result = self.video_info_from_ytdlp({
+                **first,
+                'title': video_info.get('title') or first.get('title'),
+                'description': video_info.get('description') or first.get('description'),
+            })
+            media = [self._ytdlp_media_item(entry) for entry in entries]
+            media = [item for item in media if item]
+            if len(media) > 1:
+                result['media'] = media
+            return result
+
+        # Every variant is kept so the result can be re-targeted without another request
+        formats = build_format_index(video_info.get('formats', []), video_info.get('duration'))
+
+        # Tallest video format, preferring mp4
+        video_format = DEFAULT_POLICY.select(formats)
+        if not video_format:
+            raise Exception("No suitable video format found")
+
+        result = apply_format({
+            'id': video_info.get('id', ''),
+            'title': video_info.get('title', 'Instagram Video'),
+            'description': video_info.get('description', ''),
+            'thumbnail': video_info.get('thumbnail', ''),
+            'duration': video_info.get('duration', 0),
+        }, video_format)
+        result['formats'] = formats
+        return result
+
+    def _ytdlp_media_item(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Compact media item for one carousel entry, using its default format"""
+        picked = DEFAULT_POLICY.select(build_format_index(entry.get('formats') or [], entry.get('duration')))
+        if picked is None:
+            return media_item('image', entry['url'], None, entry.get('width'), entry.get('height')) if entry.get('url') else None
+        return media_item('video', picked['url'], entry.get('thumbnail'), picked['width'], picked['height'],
+                          entry.get('duration'))
+
     def get_video_info_ytdlp(self, url: str) -> Dict[str, Any]:
         """Get video information using yt-dlp"""
+        import subprocess
+
+        def extract():
+            if self.ytdlp_in_process:
+                try:
+                    return self.extract_info_ytdlp_in_process(url)
+                except ImportError:
+                    # yt_dlp is not importable here; the binary may still be installed
+                    return self.extract_info_ytdlp_subprocess(url)
+            return self.extract_info_ytdlp_subprocess(url)
+
         try:
-            # Use yt-dlp to extract video information
-            cmd = [
-                'yt-dlp',
-                '--dump-json',
-                '--no-download',
-                '--no-warnings',
-                url
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                raise Exception(f"yt-dlp failed: {result.stderr}")
-            
-            # Parse the JSON output
-            video_info = json.loads(result.stdout)
-            
-            # Extract relevant information
-            formats = video_info.get('formats', [])
-            video_format = None
-            
-            # Find the best video format (prefer mp4, then by quality)
-            for fmt in formats:
-                if fmt.get('ext') == 'mp4' and fmt.get('vcodec') != 'none':
-                    if not video_format or fmt.get('height', 0) > video_format.get('height', 0):
-                        video_format = fmt
-            
-            if not video_format:
-                # Fallback to any video format
-                for fmt in formats:
-                    if fmt.get('vcodec') != 'none':
-                        video_format = fmt
-                        break
-            
-            if not video_format:
-                raise Exception("No suitable video format found")
-            
-            return {
-                'id': video_info.get('id', ''),
-                'title': video_info.get('title', 'Instagram Video'),
-                'description': video_info.get('description', ''),
-                'thumbnail': video_info.get('thumbnail', ''),
-                'video_url': video_format.get('url', ''),
-                'duration': video_info.get('duration', 0),
-                'width': video_format.get('width', 0),
-                'height': video_format.get('height', 0),
-                'filesize': video_format.get('filesize', 0),
-                'format': video_format.get('ext', 'mp4'),
-                'quality': f"{video_format.get('height', 0)}p" if video_format.get('height') else 'normal'
-            }
-            
+            with stage('ytdlp'):
+                # Shares the host's rate limit and circuit breaker with the HTML strategy
+                video_info = self.guard.call(url, extract)
+
+            with stage('format_selection'):
+                return self.video_info_from_ytdlp(video_info)
+
+        except (UpstreamUnavailable, AttemptCancelled):
+            raise
         except subprocess.TimeoutExpired:
             raise Exception("Request timeout - Instagram may be blocking the request")
         except json.JSONDecodeError:
@@ -97,42 +201,63 @@ class InstagramDownloader:
             raise Exception(f"Failed to extract video info: {str(e)}")
     
     def get_video_info_requests(self, url: str) -> Dict[str, Any]:
-        """Alternative method using requests (fallback)"""
+        """Alternative method using requests: JSON-LD and og: meta tags from the post page"""
+        import requests
+        from instagram_http import fetch_video_info
+
         try:
-            # This is a simplified approach - in production you'd need more sophisticated scraping
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            # Extract basic info from HTML (this is a simplified version)
-            # In a real implementation, you'd parse the JSON-LD or meta tags
             video_id = self.extract_video_id(url)
-            
-            return {
-                'id': video_id or 'unknown',
-                'title': 'Instagram Video',
-                'description': 'Downloaded from Instagram',
-                'thumbnail': '',
-                'video_url': '',  # Would need more complex extraction
-                'duration': 0,
-                'width': 0,
-                'height': 0,
-                'filesize': 0,
-                'format': 'mp4',
-                'quality': 'normal'
-            }
-            
+            if not video_id:
+                raise Exception("Could not extract video ID from URL")
+
+            video_info = self.guard.call(url, lambda: fetch_video_info(self.session, url, video_id, timeout=10))
+            video_info.setdefault('filesize', 0)
+            return video_info
+
         except requests.RequestException as e:
             raise Exception(f"Failed to fetch video info: {str(e)}")
-    
-    def download_video(self, url: str, output_path: str = None) -> Dict[str, Any]:
+
+    @instrumented
+    def download_video(self, url: str, output_path: Optional[str] = None,
+                       index: Optional[int] = None) -> Dict[str, Any]:
         """Download Instagram video and return information"""
+        with stage('url_parse'):
+            post = parse_url(url)
+        if post is None:
+            result = self._download_video(url)
+        else:
+            # Every URL shape of a post is fetched through its canonical URL
+            url = post.url
+            # Concurrent requests for the same post share one extraction
+            result = self.flight.do(post.shortcode, lambda: self._cached_download_video(post.shortcode, url))
+            # Carousel items (index or the URL's img_index) come from the one cached fetch
+            result = select_media(result, index or post.index)
+        result = apply_format_policy(result, self.format_policy)
+
+        # Fetch the media itself when a destination is given
+        if output_path and result.get('success'):
+            from instagram_media import save_media
+
+            result = save_media(self.media, result, output_path)
+        return result
+
+    def _cached_download_video(self, video_id: str, url: str) -> Dict[str, Any]:
+        """Serve from the metadata cache when one is configured"""
+        try:
+            if self.cache is None:
+                return self._download_video(url)
+            extract = lambda: self._download_video(url)
+            # Background refreshes share the single-flight key, so they never race a miss upstream
+            return self.cache.get_or_extract(video_id, extract, refresh=lambda: self.flight.do(video_id, extract))
+        except UpstreamUnavailable as e:
+            # Fail fast while the circuit is open, serving a stale copy if there is one
+            return unavailable_result(self.cache, video_id, e)
+
+    def _download_video(self, url: str) -> Dict[str, Any]:
+        """Extract video information without consulting the cache"""
         try:
-            # First try yt-dlp method
-            try:
-                video_info = self.get_video_info_ytdlp(url)
-            except Exception:
-                # Fallback to requests method
-                video_info = self.get_video_info_requests(url)
+            # yt-dlp and the HTML extractor run as a hedged race under one deadline
+            video_info = self.strategies.run(url)
             
             # If we have a video URL, we can provide it for download
             if video_info.get('video_url'):
@@ -146,33 +271,26 @@ class InstagramDownloader:
                     'error': 'Could not extract video URL'
                 }
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
+    def download_videos(self, urls: Iterable[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                        output_dir: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Download many Instagram videos, yielding (url, result) pairs as they complete"""
+        if output_dir:
+            # Created up front: media_path only treats an existing directory as one
+            os.makedirs(output_dir, exist_ok=True)
+        return iter_batch(lambda url: self.download_video(url, output_dir), urls, self.session, max_workers)
+
+
 def main():
     """Main function to handle command line usage"""
-    if len(sys.argv) != 2:
-        print(json.dumps({
-            'success': False,
-            'error': 'Usage: python instagram_downloader.py <instagram_url>'
-        }))
-        sys.exit(1)
-    
-    url = sys.argv[1]
-    downloader = InstagramDownloader()
-    
-    try:
-        result = downloader.download_video(url)
-        print(json.dumps(result, indent=2))
-    except Exception as e:
-        print(json.dumps({
-            'success': False,
-            'error': str(e)
-        }))
-        sys.exit(1)
+    run_cli(InstagramDownloader, 'instagram_downloader.py')
 
 if __name__ == "__main__":
     main()
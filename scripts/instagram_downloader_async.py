@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Async Instagram Video Downloader
+An asyncio-native extraction engine built on aiohttp, returning the same
+result schema as the other downloader scripts
+"""
+
+import asyncio
+import codecs
+import json
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from instagram_cache import MetadataCache
+from instagram_downloader_railway import RailwayInstagramDownloader
+from instagram_formats import select_media
+from instagram_metrics import Instrumentation, current_timings, instrumented_async, stage
+from instagram_parser import DEFAULT_MAX_BYTES, STREAM_CHUNK_SIZE, MetadataParser
+from instagram_ratelimit import UpstreamError, UpstreamGuard, UpstreamUnavailable, unavailable_result
+from instagram_singleflight import AsyncSingleFlight
+from instagram_urls import DedupIndex, canonical_url, parse_url
+
+DEFAULT_MAX_CONCURRENCY = 100
+DEFAULT_LIMIT_PER_HOST = 20
+
+
+def _timing_trace_config() -> 'aiohttp.TraceConfig':
+    """Report connect and ttfb stages from aiohttp's request tracing hooks"""
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+        context.connect = 0.0
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        context.connect = time.perf_counter() - context.connect_started
+        timings = current_timings()
+        if timings is not None:
+            timings.add('connect', context.connect)
+
+    async def on_request_end(session, context, params):
+        timings = current_timings()
+        if timings is not None:
+            timings.add('ttfb', time.perf_counter() - context.started - context.connect)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class AsyncInstagramDownloader:
+    # URL parsing is shared with the Railway downloader
+    extract_video_id = RailwayInstagramDownloader.extract_video_id
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+                 timeout: float = 10.0, keepalive_timeout: float = 30.0,
+                 proxy: Optional[str] = None, cache: Optional[MetadataCache] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        if aiohttp is None:
+            raise Exception("aiohttp is required for the async downloader (pip install aiohttp)")
+
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.proxy = proxy
+        self.cache = cache
+        self.flight = AsyncSingleFlight()
+        self.max_bytes = max_bytes
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'Upgrade-Insecure-Requests': '1',
+        }
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        # Set to an Instrumentation (before the first request) to attach per-stage timings
+        self.instrumentation: Optional[Instrumentation] = None
+        # Rate limits, retries and circuit breaking, shared with the threaded downloaders
+        self.guard = UpstreamGuard.shared()
+
+    async def __aenter__(self) -> 'AsyncInstagramDownloader':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        """Lazily create the pooled keep-alive session on the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[_timing_trace_config()] if self.instrumentation is not None else None,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Close the session and its connection pool"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def fetch_video_info(self, url: str, video_id: str) -> Dict[str, Any]:
+        """Stream a page into the metadata parser, stopping once it is done or max_bytes is read"""
+        async with self._semaphore:
+            async with self.session.get(url, proxy=self.proxy) as response:
+                response.raise_for_status()
+                if '/accounts/login' in str(response.url):
+                    raise UpstreamError('Instagram redirected to the login wall', status=response.status,
+                                        retryable=False)
+
+                decoder = codecs.getincrementaldecoder(response.get_encoding())(errors='replace')
+                parser = MetadataParser()
+                read = 0
+                capped = False
+                parse_time = 0.0
+                started = time.perf_counter()
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    read += len(chunk)
+                    parse_started = time.perf_counter()
+                    done = parser.feed(decoder.decode(chunk))
+                    parse_time += time.perf_counter() - parse_started
+                    capped = not done and read >= self.max_bytes
+                    if done or capped:
+                        # Drop the connection rather than draining the rest of the body
+                        response.close()
+                        break
+                else:
+                    parser.feed(decoder.decode(b'', final=True))
+
+                parse_started = time.perf_counter()
+                video_info = (parser.capped_video_info(video_id, self.max_bytes) if capped
+                              else parser.video_info(video_id))
+                finished = time.perf_counter()
+
+                timings = current_timings()
+                if timings is not None:
+                    parse_time += finished - parse_started
+                    timings.add('download', finished - started - parse_time)
+                    timings.add('parse', parse_time)
+                    timings.bytes_read += read
+                    timings.strategy = timings.strategy or 'html'
+                return video_info
+
+    async def get_video_info(self, url: str) -> Dict[str, Any]:
+        """Get video information from Instagram URL"""
+        try:
+            video_id = self.extract_video_id(url)
+            if not video_id:
+                raise Exception("Could not extract video ID from URL")
+
+            # Stream the Instagram page; the deadline also covers waiting for a slot
+            video_info = await self.guard.call_async(
+                url, lambda: asyncio.wait_for(self.fetch_video_info(url, video_id), self.timeout))
+
+            # If no direct video URL found, provide a note
+            if not video_info.get('video_url'):
+                video_info['video_url'] = canonical_url(url)
+                video_info['note'] = 'Direct download URL not available - Instagram may require authentication'
+
+            return video_info
+
+        except UpstreamUnavailable:
+            raise
+        except asyncio.TimeoutError:
+            raise Exception("Failed to fetch Instagram page: request timeout")
+        except aiohttp.ClientError as e:
+            raise Exception(f"Failed to fetch Instagram page: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Failed to extract video info: {str(e)}")
+
+    @instrumented_async
+    async def download_video(self, url: str, index: Optional[int] = None) -> Dict[str, Any]:
+        """Download Instagram video and return information"""
+        with stage('url_parse'):
+            post = parse_url(url)
+        if post is None:
+            return await self._download_video(url)
+
+        # Every URL shape of a post is fetched through its canonical URL, and
+        # concurrent requests for the same post share one extraction
+        result = await self.flight.do(post.shortcode, lambda: self._cached_download_video(post.shortcode, post.url))
+        # Carousel items (index or the URL's img_index) come from the one cached fetch
+        return select_media(result, index or post.index)
+
+    async def _cached_download_video(self, video_id: str, url: str) -> Dict[str, Any]:
+        """Serve from the metadata cache when one is configured"""
+        try:
+            if self.cache is None:
+                return await self._download_video(url)
+
+            result = self.cache.get(video_id)
+            if result is None:
+                result = await self._download_video(url)
+                self.cache.put(video_id, result)
+            return result
+        except UpstreamUnavailable as e:
+            # Fail fast while the circuit is open, serving a stale copy if there is one
+            return unavailable_result(self.cache, video_id, e)
+
+    async def _download_video(self, url: str) -> Dict[str, Any]:
+        """Extract video information without consulting the cache"""
+        try:
+            video_info = await self.get_video_info(url)
+
+            return {
+                'success': True,
+                'data': video_info
+            }
+
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def download_videos(self, urls: Iterable[str]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Download many Instagram videos, yielding (url, result) pairs as they complete"""
+        async def run(url: str, key: Any) -> Tuple[str, Any, Dict[str, Any]]:
+            return url, key, await self.download_video(url)
+
+        # Duplicate URLs of a post are downloaded once and share its result
+        index = DedupIndex()
+        duplicates: Dict[Any, list] = {}
+        tasks = []
+        for url in urls:
+            key, first = index.add(url)
+            if first:
+                tasks.append(asyncio.ensure_future(run(url, key)))
+                if key is not None:
+                    duplicates[key] = []
+            else:
+                duplicates[key].append(url)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                url, key, result = await next_done
+                yield url, result
+                for duplicate in duplicates.get(key, ()):
+                    yield duplicate, result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def _main_async(urls) -> None:
+    async with AsyncInstagramDownloader(cache=MetadataCache()) as downloader:
+        async for url, result in downloader.download_videos(urls):
+            print(json.dumps({'url': url, **result}), flush=True)
+
+
+def main():
+    """Main function to handle command line usage"""
+    if len(sys.argv) < 2:
+        print(json.dumps({
+            'success': False,
+            'error': 'Usage: python instagram_downloader_async.py <instagram_url> [<instagram_url> ...]'
+        }))
+        sys.exit(1)
+
+    try:
+        asyncio.run(_main_async(sys.argv[1:]))
+    except Exception as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e)
+        }))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,34 @@ Railway-optimized Instagram Video Downloader
 A lightweight Python script optimized for Railway deployment
 """
 
-import json
-import sys
-import re
-import requests
-from urllib.parse import urlparse, parse_qs
-from typing import Dict, Optional, Any
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Any, Tuple
+
+# requests and the HTTP/media helpers load on first use, keeping CLI startup fast
+from instagram_batch import DEFAULT_BATCH_WORKERS, iter_batch
+from instagram_cli import run_cli
+from instagram_formats import FormatPolicy, apply_format_policy, select_media
+from instagram_metrics import Instrumentation, instrumented, stage
+from instagram_parser import DEFAULT_MAX_BYTES, parse_video_info
+from instagram_ratelimit import UpstreamGuard, UpstreamUnavailable, unavailable_result
+from instagram_singleflight import SingleFlight
+from instagram_urls import canonical_url, extract_video_id, parse_url
+
+if TYPE_CHECKING:
+    from instagram_cache import MetadataCache
+    from instagram_media import MediaDownloader
 
 class RailwayInstagramDownloader:
-    def __init__(self):
+    def __init__(self, cache: Optional['MetadataCache'] = None, streaming: bool = True,
+                 max_bytes: int = DEFAULT_MAX_BYTES, media: Optional['MediaDownloader'] = None):
+        import requests
+        from instagram_http import configure_session_pool
+        from instagram_media import MediaDownloader
+
+        self.cache = cache
+        self.flight = SingleFlight()
+        self.streaming = streaming
+        self.max_bytes = max_bytes
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -22,98 +41,106 @@ class RailwayInstagramDownloader:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         })
+        configure_session_pool(self.session)
+        self.media = media or MediaDownloader(self.session)
+        # Set to an Instrumentation to attach per-stage timings to results
+        self.instrumentation: Optional[Instrumentation] = None
+        # Re-selects the format of yt-dlp results from their format index
+        self.format_policy: Optional[FormatPolicy] = None
+        # Rate limits, retries and circuit breaking, shared with every downloader in the process
+        self.guard = UpstreamGuard.shared()
     
     def extract_video_id(self, url: str) -> Optional[str]:
         """Extract video ID from Instagram URL"""
-        patterns = [
-            r'instagram\.com/p/([A-Za-z0-9_-]+)',
-            r'instagram\.com/reel/([A-Za-z0-9_-]+)',
-            r'instagram\.com/tv/([A-Za-z0-9_-]+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        return extract_video_id(url)
     
     def extract_video_info_from_html(self, html: str, video_id: str) -> Dict[str, Any]:
         """Extract video information from Instagram HTML page"""
         try:
-            # Look for JSON-LD structured data
-            json_ld_pattern = r'<script type="application/ld\+json">(.*?)</script>'
-            json_ld_matches = re.findall(json_ld_pattern, html, re.DOTALL)
-            
-            for json_ld in json_ld_matches:
-                try:
-                    data = json.loads(json_ld)
-                    if isinstance(data, dict) and 'videoObject' in data:
-                        video_obj = data['videoObject']
-                        return {
-                            'id': video_id,
-                            'title': video_obj.get('name', 'Instagram Video'),
-                            'description': video_obj.get('description', ''),
-                            'thumbnail': video_obj.get('thumbnailUrl', ''),
-                            'video_url': video_obj.get('contentUrl', ''),
-                            'duration': video_obj.get('duration', 0),
-                            'width': video_obj.get('width', 0),
-                            'height': video_obj.get('height', 0),
-                            'format': 'mp4',
-                            'quality': 'normal'
-                        }
-                except json.JSONDecodeError:
-                    continue
-            
-            # Look for meta tags
-            title_match = re.search(r'<meta property="og:title" content="([^"]*)"', html)
-            description_match = re.search(r'<meta property="og:description" content="([^"]*)"', html)
-            image_match = re.search(r'<meta property="og:image" content="([^"]*)"', html)
-            video_match = re.search(r'<meta property="og:video" content="([^"]*)"', html)
-            
-            return {
-                'id': video_id,
-                'title': title_match.group(1) if title_match else 'Instagram Video',
-                'description': description_match.group(1) if description_match else '',
-                'thumbnail': image_match.group(1) if image_match else '',
-                'video_url': video_match.group(1) if video_match else '',
-                'duration': 0,
-                'width': 0,
-                'height': 0,
-                'format': 'mp4',
-                'quality': 'normal'
-            }
-            
+            # JSON-LD and og:/twitter: meta tags are collected in a single pass
+            return parse_video_info(html, video_id)
         except Exception as e:
             raise Exception(f"Failed to parse HTML: {str(e)}")
-    
+
     def get_video_info(self, url: str) -> Dict[str, Any]:
         """Get video information from Instagram URL"""
+        import requests
+        from instagram_http import fetch_video_info, raise_for_upstream
+
         try:
             video_id = self.extract_video_id(url)
             if not video_id:
                 raise Exception("Could not extract video ID from URL")
             
-            # Fetch the Instagram page
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            # Extract video information from HTML
-            video_info = self.extract_video_info_from_html(response.text, video_id)
+            if self.streaming:
+                # Stream the page and stop reading once the metadata has been found
+                video_info = self.guard.call(url, lambda: fetch_video_info(
+                    self.session, url, video_id, timeout=10, max_bytes=self.max_bytes))
+            else:
+                # Fetch the Instagram page
+                def fetch_page():
+                    response = self.session.get(url, timeout=10)
+                    raise_for_upstream(response)
+                    return response
+
+                response = self.guard.call(url, fetch_page)
+
+                # Extract video information from HTML
+                with stage('parse'):
+                    video_info = self.extract_video_info_from_html(response.text, video_id)
             
             # If no direct video URL found, provide a note
             if not video_info.get('video_url'):
-                video_info['video_url'] = f"https://instagram.com/p/{video_id}/"
+                video_info['video_url'] = canonical_url(url)
                 video_info['note'] = 'Direct download URL not available - Instagram may require authentication'
             
             return video_info
             
+        except UpstreamUnavailable:
+            raise
         except requests.RequestException as e:
             raise Exception(f"Failed to fetch Instagram page: {str(e)}")
         except Exception as e:
             raise Exception(f"Failed to extract video info: {str(e)}")
     
-    def download_video(self, url: str) -> Dict[str, Any]:
+    @instrumented
+    def download_video(self, url: str, output_path: Optional[str] = None,
+                       index: Optional[int] = None) -> Dict[str, Any]:
         """Download Instagram video and return information"""
+        with stage('url_parse'):
+            post = parse_url(url)
+        if post is None:
+            result = self._download_video(url)
+        else:
+            # Every URL shape of a post is fetched through its canonical URL
+            url = post.url
+            # Concurrent requests for the same post share one extraction
+            result = self.flight.do(post.shortcode, lambda: self._cached_download_video(post.shortcode, url))
+            # Carousel items (index or the URL's img_index) come from the one cached fetch
+            result = select_media(result, index or post.index)
+        result = apply_format_policy(result, self.format_policy)
+
+        # Fetch the media itself when a destination is given
+        if output_path and result.get('success'):
+            from instagram_media import save_media
+
+            result = save_media(self.media, result, output_path)
+        return result
+
+    def _cached_download_video(self, video_id: str, url: str) -> Dict[str, Any]:
+        """Serve from the metadata cache when one is configured"""
+        try:
+            if self.cache is None:
+                return self._download_video(url)
+            extract = lambda: self._download_video(url)
+            # Background refreshes share the single-flight key, so they never race a miss upstream
+            return self.cache.get_or_extract(video_id, extract, refresh=lambda: self.flight.do(video_id, extract))
+        except UpstreamUnavailable as e:
+            # Fail fast while the circuit is open, serving a stale copy if there is one
+            return unavailable_result(self.cache, video_id, e)
+
+    def _download_video(self, url: str) -> Dict[str, Any]:
+        """Extract video information without consulting the cache"""
         try:
             video_info = self.get_video_info(url)
             
@@ -122,33 +149,26 @@ class RailwayInstagramDownloader:
                 'data': video_info
             }
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
+    def download_videos(self, urls: Iterable[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                        output_dir: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Download many Instagram videos, yielding (url, result) pairs as they complete"""
+        if output_dir:
+            # Created up front: media_path only treats an existing directory as one
+            os.makedirs(output_dir, exist_ok=True)
+        return iter_batch(lambda url: self.download_video(url, output_dir), urls, self.session, max_workers)
+
+
 def main():
     """Main function to handle command line usage"""
-    if len(sys.argv) != 2:
-        print(json.dumps({
-            'success': False,
-            'error': 'Usage: python instagram_downloader_railway.py <instagram_url>'
-        }))
-        sys.exit(1)
-    
-    url = sys.argv[1]
-    downloader = RailwayInstagramDownloader()
-    
-    try:
-        result = downloader.download_video(url)
-        print(json.dumps(result, indent=2))
-    except Exception as e:
-        print(json.dumps({
-            'success': False,
-            'error': str(e)
-        }))
-        sys.exit(1)
+    run_cli(RailwayInstagramDownloader, 'instagram_downloader_railway.py')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Egress proxy pool for the Instagram downloader scripts
+
+Spreads requests over several egress proxies so one blocked IP does not
+stop every extraction. Each proxy has its own requests.Session (and so
+its own connection pool) and a health score over its last outcomes:
+success rate, with blocks (429 or 401/403 from Instagram's pages and API,
+or a login-wall redirect) counting against it twice, scaled down by mean
+latency. A 403 from the CDN means an expired signed URL, not a burned
+egress, so media requests never count as blocks.
+
+Every request goes to the best-scoring proxy, the least loaded of those
+within SCORE_TOLERANCE of the best. A blocked proxy, or one failing
+failure_limit times in a row, is quarantined. Each quarantine in a row
+lasts twice as long as the one before, up to max_quarantine. Its history
+is cleared, so once the quarantine ends its next request is a fair probe.
+
+A block or a connection error is a verdict on one egress, not on
+Instagram, so EgressSession retries the request on another egress before
+the caller sees it; only when every egress has failed it does the response
+reach the caller's UpstreamGuard and count against the host.
+
+EgressPool.session() returns a drop-in requests.Session for the
+downloaders; 'direct' in the proxy list means no proxy.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+from urllib.parse import urlsplit
+
+import requests
+
+from instagram_http import DEFAULT_POOL_SIZE, configure_session_pool
+
+DIRECT = 'direct'
+DEFAULT_WINDOW = 50
+DEFAULT_QUARANTINE = 60.0
+DEFAULT_MAX_QUARANTINE = 900.0
+DEFAULT_FAILURE_LIMIT = 3
+# Mean latency at which a proxy's score is halved
+LATENCY_SCALE = 1.0
+# Proxies scoring within this of the best share the load
+SCORE_TOLERANCE = 0.05
+
+
+# Hosts whose refusals are aimed at the client; CDN hosts refuse expired URLs instead
+PAGE_HOSTS = ('instagram.com', 'instagr.am')
+
+
+def is_page_host(url: str) -> bool:
+    host = urlsplit(url).hostname or ''
+    return any(host == page_host or host.endswith('.' + page_host) for page_host in PAGE_HOSTS)
+
+
+def is_block(response: requests.Response, url: str) -> bool:
+    """True when Instagram is refusing this egress rather than failing or refusing one URL"""
+    if '/accounts/login' in response.url:
+        return True
+    return response.status_code in (401, 403, 429) and is_page_host(url)
+
+
+class Egress:
+    def __init__(self, proxy: str, window: int = DEFAULT_WINDOW, pool_size: int = DEFAULT_POOL_SIZE):
+        self.name = proxy
+        self.session = requests.Session()
+        # The egress decides the route; http_proxy and friends must not override it
+        self.session.trust_env = False
+        if proxy != DIRECT:
+            self.session.proxies = {'http': proxy, 'https': proxy}
+        configure_session_pool(self.session, pool_size)
+        # (ok, blocked, latency) of the most recent requests
+        self.outcomes = deque(maxlen=window)
+        self.in_flight = 0
+        self.quarantined_until = 0.0
+        self.quarantines = 0
+        self.failures = 0
+        self.counters = {'requests': 0, 'successes': 0, 'failures': 0, 'blocks': 0, 'quarantines': 0}
+
+    def score(self) -> float:
+        """Health in (0, 1]: smoothed success rate, blocks counted twice, scaled by latency"""
+        successes = sum(1 for ok, _, _ in self.outcomes if ok)
+        blocks = sum(1 for _, blocked, _ in self.outcomes if blocked)
+        latencies = [latency for ok, _, latency in self.outcomes if ok]
+        mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        success_rate = (successes + 1) / (len(self.outcomes) + blocks + 1)
+        return success_rate / (1 + mean_latency / LATENCY_SCALE)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'score': round(self.score(), 4),
+            'in_flight': self.in_flight,
+            'quarantined_for': round(max(0.0, self.quarantined_until - now), 1),
+        }
+
+
+class EgressPool:
+    def __init__(self, proxies: List[str], window: int = DEFAULT_WINDOW,
+                 quarantine: float = DEFAULT_QUARANTINE, max_quarantine: float = DEFAULT_MAX_QUARANTINE,
+                 failure_limit: int = DEFAULT_FAILURE_LIMIT, pool_size: int = DEFAULT_POOL_SIZE):
+        if not proxies:
+            raise ValueError('an egress pool needs at least one proxy')
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self.failure_limit = max(1, int(failure_limit))
+        self.pool_size = pool_size
+        self.egresses = [Egress(proxy, window, pool_size) for proxy in proxies]
+        self._lock = threading.Lock()
+        self._exhausted = 0
+        self._failovers = 0
+
+    def acquire(self, exclude: Sequence[Egress] = ()) -> Optional[Egress]:
+        """Pick the egress for the next request and count it in flight
+
+        exclude lists the egresses a request has already failed on; None
+        means no other egress is available to retry it on.
+        """
+        with self._lock:
+            now = time.monotonic()
+            available = [egress for egress in self.egresses
+                         if egress.quarantined_until <= now and egress not in exclude]
+            if available:
+                scores = {egress: egress.score() for egress in available}
+                best = max(scores.values())
+                candidates = [egress for egress in available if scores[egress] >= best - SCORE_TOLERANCE]
+                egress = min(candidates, key=lambda egress: (egress.in_flight, egress.counters['requests']))
+                if exclude:
+                    self._failovers += 1
+            elif exclude:
+                return None
+            else:
+                # Everything is quarantined: better the proxy due back first than no request at all
+                self._exhausted += 1
+                egress = min(self.egresses, key=lambda egress: egress.quarantined_until)
+            egress.in_flight += 1
+            egress.counters['requests'] += 1
+            return egress
+
+    def release(self, egress: Egress, ok: bool, latency: float, blocked: bool = False) -> None:
+        """Record the outcome of a request sent through egress"""
+        with self._lock:
+            egress.in_flight -= 1
+            egress.outcomes.append((ok, blocked, latency))
+            if ok:
+                egress.counters['successes'] += 1
+                egress.failures = 0
+                egress.quarantines = 0
+                return
+
+            egress.counters['blocks' if blocked else 'failures'] += 1
+            egress.failures += 1
+            if blocked or egress.failures >= self.failure_limit:
+                duration = min(self.max_quarantine, self.quarantine * 2 ** egress.quarantines)
+                egress.quarantined_until = time.monotonic() + duration
+                egress.quarantines += 1
+                egress.failures = 0
+                egress.outcomes.clear()
+                egress.counters['quarantines'] += 1
+
+    def resize(self, pool_size: int) -> None:
+        """Size every egress's connection pool for pool_size concurrent requests"""
+        with self._lock:
+            if pool_size == self.pool_size:
+                return
+            self.pool_size = pool_size
+            for egress in self.egresses:
+                configure_session_pool(egress.session, pool_size)
+
+    def session(self, template: Optional[requests.Session] = None) -> 'EgressSession':
+        """A requests.Session that sends each request through the pool, copying template's headers"""
+        session = EgressSession(self)
+        if template is not None:
+            session.headers.update(template.headers)
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'exhausted': self._exhausted,
+                'failovers': self._failovers,
+                'egresses': {egress.name: egress.stats(now) for egress in self.egresses},
+            }
+
+
+class EgressSession(requests.Session):
+    """requests.Session routing every request through an EgressPool"""
+
+    def __init__(self, pool: EgressPool):
+        self.pool = None
+        super().__init__()
+        self.pool = pool
+
+    def mount(self, prefix: str, adapter) -> None:
+        super().mount(prefix, adapter)
+        # configure_session_pool sizes the pool for the caller's concurrency; pass that on
+        size = getattr(adapter, '_pool_maxsize', None)
+        if self.pool is not None and size:
+            self.pool.resize(size)
+
+    def request(self, method, url, **kwargs):
+        tried = []
+        egress = self.pool.acquire()
+        while True:
+            session = egress.session
+            session.headers = self.headers
+            session.cookies = self.cookies
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                # Most likely the proxy itself is down; try the request elsewhere
+                self.pool.release(egress, False, time.monotonic() - started)
+                tried.append(egress)
+                egress = self.pool.acquire(tried)
+                if egress is None:
+                    raise
+                continue
+            except Exception:
+                self.pool.release(egress, False, time.monotonic() - started)
+                raise
+
+            blocked = is_block(response, url)
+            ok = not blocked and response.status_code < 500
+            self.pool.release(egress, ok, response.elapsed.total_seconds(), blocked)
+            if not blocked:
+                return response
+            tried.append(egress)
+            egress = self.pool.acquire(tried)
+            if egress is None:
+                # Every egress is blocked: that is for the caller's guard to act on
+                return response
+            response.close()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Format index and selection policies for the Instagram downloader scripts
+
+yt-dlp reports every variant of a post (progressive mp4s, DASH video and
+audio streams). build_format_index keeps them all in a compact list so a
+result can be re-targeted later without another upstream request, and
+FormatPolicy picks one entry: the tallest by default, or the cheapest one
+that satisfies a height, size or audio-only constraint.
+
+Carousel posts list every item in a compact `media` list the same way, and
+select_media points a result at one of them.
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+def _number(value: Any) -> Optional[float]:
+    return value if isinstance(value, (int, float)) and value > 0 else None
+
+
+def build_format_index(formats: List[Dict[str, Any]], duration: Any = None) -> List[Dict[str, Any]]:
+    """Summarize yt-dlp formats as compact entries, keeping yt-dlp's order"""
+    duration = _number(duration)
+    index = []
+    for fmt in formats:
+        if not fmt.get('url'):
+            continue
+        vcodec = fmt.get('vcodec')
+        acodec = fmt.get('acodec')
+        bitrate = _number(fmt.get('tbr')) or (
+            (_number(fmt.get('vbr')) or 0) + (_number(fmt.get('abr')) or 0)) or None
+        filesize = _number(fmt.get('filesize'))
+        approx = filesize or _number(fmt.get('filesize_approx'))
+        if approx is None and bitrate and duration:
+            # tbr is in kbit/s
+            approx = bitrate * 1000 / 8 * duration
+
+        index.append({
+            'format_id': fmt.get('format_id'),
+            'url': fmt['url'],
+            'ext': fmt.get('ext'),
+            'width': fmt.get('width') or 0,
+            'height': fmt.get('height') or 0,
+            'bitrate': round(bitrate, 1) if bitrate else None,
+            'filesize': int(filesize) if filesize else None,
+            'filesize_approx': int(approx) if approx else None,
+            'vcodec': vcodec,
+            'acodec': acodec,
+            # yt-dlp leaves codecs unset when it does not know them; only 'none' rules a track out
+            'has_video': vcodec != 'none',
+            'has_audio': acodec != 'none',
+        })
+    return index
+
+
+def media_item(kind: str, url: str, thumbnail: Any = None, width: Any = None, height: Any = None,
+               duration: Any = None) -> Dict[str, Any]:
+    """One carousel item ('video' or 'image'), leaving out fields that are unknown"""
+    item = {'type': kind, 'url': url}
+    if thumbnail and thumbnail != url:
+        item['thumbnail'] = thumbnail
+    if width:
+        item['width'] = int(width)
+    if height:
+        item['height'] = int(height)
+    if duration:
+        item['duration'] = duration
+    return item
+
+
+class FormatPolicy:
+    def __init__(self, max_height: Optional[int] = None, max_bytes: Optional[int] = None,
+                 target_height: Optional[int] = None, audio_only: bool = False):
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+        self.target_height = target_height
+        self.audio_only = audio_only
+
+    @classmethod
+    def from_dict(cls, options: Optional[Dict[str, Any]]) -> 'FormatPolicy':
+        """Build a policy from request options, e.g. {"max_height": 720}"""
+        options = options or {}
+
+        def positive_int(name):
+            value = options.get(name)
+            if value is None:
+                return None
+            value = int(value)
+            if value <= 0:
+                raise ValueError(f"{name} must be positive")
+            return value
+
+        return cls(max_height=positive_int('max_height'), max_bytes=positive_int('max_bytes'),
+                   target_height=positive_int('target_height'), audio_only=bool(options.get('audio_only')))
+
+    @property
+    def is_default(self) -> bool:
+        return not (self.max_height or self.max_bytes or self.target_height or self.audio_only)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in vars(self).items() if value}
+
+    def select(self, index: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Pick the entry this policy prefers, or None when nothing qualifies"""
+        if self.audio_only:
+            candidates = [entry for entry in index if entry['has_audio'] and not entry['has_video']]
+        else:
+            candidates = [entry for entry in index if entry['has_video']]
+
+        if self.max_height:
+            candidates = [entry for entry in candidates if 0 < entry['height'] <= self.max_height]
+        if self.max_bytes:
+            candidates = [entry for entry in candidates
+                          if entry['filesize_approx'] and entry['filesize_approx'] <= self.max_bytes]
+        if not candidates:
+            return None
+
+        # Prefer mp4 whenever one qualifies, as the downloaders always have
+        mp4 = [entry for entry in candidates if entry['ext'] == 'mp4']
+        candidates = mp4 or candidates
+
+        def cost(entry):
+            return (entry['filesize_approx'] or float('inf'), entry['bitrate'] or float('inf'), entry['height'])
+
+        if self.audio_only:
+            # Best audio within the limits
+            return max(candidates, key=lambda entry: (entry['bitrate'] or 0, entry['filesize_approx'] or 0))
+
+        if self.target_height:
+            # Smallest variant that still reaches the target resolution, else the tallest below it
+            reaching = [entry for entry in candidates if entry['height'] >= self.target_height]
+            if reaching:
+                return min(reaching, key=cost)
+            return max(candidates, key=lambda entry: entry['height'])
+
+        if self.max_bytes:
+            # Tallest variant that fits, cheapest among equals
+            return max(candidates, key=lambda entry: (entry['height'], -cost(entry)[0]))
+
+        # Tallest; the first listed wins ties
+        return max(candidates, key=lambda entry: entry['height'])
+
+
+DEFAULT_POLICY = FormatPolicy()
+
+
+def apply_format(video_info: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Point a result's top-level media fields at one index entry"""
+    return {
+        **video_info,
+        'video_url': entry['url'],
+        'format_id': entry['format_id'],
+        'width': entry['width'],
+        'height': entry['height'],
+        'filesize': entry['filesize'] or 0,
+        'format': entry['ext'] or 'mp4',
+        'quality': 'audio' if not entry['has_video'] else (f"{entry['height']}p" if entry['height'] else 'normal'),
+    }
+
+
+def apply_format_policy(result: Dict[str, Any], policy: Optional[FormatPolicy]) -> Dict[str, Any]:
+    """Re-select a successful result's format from its index, without another upstream request"""
+    if policy is None or policy.is_default or not result.get('success'):
+        return result
+    video_info = result['data']
+    index = video_info.get('formats')
+    if not index:
+        # Page-scraped results only know a single variant
+        return result
+
+    entry = policy.select(index)
+    if entry is None:
+        return {
+            'success': False,
+            'error': f"No format matches the selection policy {policy.as_dict()}"
+        }
+    # Results may be shared through the cache, so copy rather than mutate
+    return {**result, 'data': apply_format(video_info, entry)}
+
+
+def select_media(result: Dict[str, Any], index: Optional[int]) -> Dict[str, Any]:
+    """Point a successful result at one media item (1-based), without another upstream request"""
+    if index is None or not result.get('success'):
+        return result
+    video_info = result['data']
+    media = video_info.get('media')
+    count = len(media) if media else 1
+    if not 1 <= index <= count:
+        return {
+            'success': False,
+            'error': f"Media index {index} is out of range; the post has {count} item{'s' if count > 1 else ''}"
+        }
+    if not media:
+        return result
+
+    item = media[index - 1]
+    data = {
+        **video_info,
+        'media_index': index,
+        'video_url': item['url'],
+        'thumbnail': item.get('thumbnail', item['url'] if item['type'] == 'image' else ''),
+        'width': item.get('width', 0),
+        'height': item.get('height', 0),
+        'duration': item.get('duration', 0),
+        'format': 'jpg' if item['type'] == 'image' else 'mp4',
+        'quality': 'image' if item['type'] == 'image' else (f"{item['height']}p" if item.get('height') else 'normal'),
+    }
+    if item['url'] != video_info.get('video_url'):
+        # The format index and its pick describe the post's first video only
+        for key in ('formats', 'format_id'):
+            data.pop(key, None)
+        data['filesize'] = 0
+    return {**result, 'data': data}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+HTTP helpers shared by the Instagram downloader scripts
+"""
+
+import codecs
+import time
+from typing import Any, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from instagram_metrics import current_timings, stage
+from instagram_parser import DEFAULT_MAX_BYTES, STREAM_CHUNK_SIZE, MetadataParser
+from instagram_ratelimit import UpstreamError
+
+DEFAULT_POOL_SIZE = 10
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        with stage('connect'):
+            super().connect()
+
+    def getresponse(self, *args, **kwargs):
+        with stage('ttfb'):
+            return super().getresponse(*args, **kwargs)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Includes the TLS handshake
+        with stage('connect'):
+            super().connect()
+
+    def getresponse(self, *args, **kwargs):
+        with stage('ttfb'):
+            return super().getresponse(*args, **kwargs)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_TIMED_POOL_CLASSES = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report connect and ttfb stages to the active Timings"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+        return manager
+
+
+def configure_session_pool(session: requests.Session, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Mount adapters sized for pool_size concurrent requests on one session"""
+    pool_size = max(1, int(pool_size))
+    adapter = TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _incremental_decoder(encoding: str):
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def raise_for_upstream(response: requests.Response) -> None:
+    """raise_for_status, also treating a redirect to the login wall as a block"""
+    response.raise_for_status()
+    if '/accounts/login' in response.url:
+        raise UpstreamError('Instagram redirected to the login wall', status=response.status_code,
+                            retryable=False)
+
+
+def fetch_video_info(session: requests.Session, url: str, video_id: str, timeout: float,
+                     max_bytes: int = DEFAULT_MAX_BYTES) -> Dict[str, Any]:
+    """Stream a post page into the metadata parser, closing the connection once it is done"""
+    response = session.get(url, timeout=timeout, stream=True)
+    try:
+        raise_for_upstream(response)
+
+        # iter_content decompresses gzip/deflate chunk by chunk
+        decoder = _incremental_decoder(response.encoding)
+        parser = MetadataParser()
+        read = 0
+        capped = False
+        parse_time = 0.0
+        started = time.perf_counter()
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            read += len(chunk)
+            parse_started = time.perf_counter()
+            done = parser.feed(decoder.decode(chunk))
+            parse_time += time.perf_counter() - parse_started
+            if done:
+                break
+            if read >= max_bytes:
+                capped = True
+                break
+        else:
+            parser.feed(decoder.decode(b'', final=True))
+
+        parse_started = time.perf_counter()
+        video_info = parser.capped_video_info(video_id, max_bytes) if capped else parser.video_info(video_id)
+        finished = time.perf_counter()
+
+        timings = current_timings()
+        if timings is not None:
+            # Download and parsing interleave; split the loop time between them
+            parse_time += finished - parse_started
+            timings.add('download', finished - started - parse_time)
+            timings.add('parse', parse_time)
+            timings.bytes_read += read
+            timings.strategy = timings.strategy or 'html'
+        return video_info
+    finally:
+        # Closing an unfinished body drops the connection instead of draining it
+        response.close()
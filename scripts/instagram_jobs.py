@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Durable multi-process job runner for the Instagram downloader scripts
+
+Jobs live in a SQLite file, so a runner that crashes or is stopped picks
+up where it left off. run_jobs starts one process per core, each with its
+own downloader and a thread pool for I/O; processes claim jobs with a
+lease and write results keyed by the job's post (see job_key).
+
+Processing is at-least-once: a job whose process died is claimed again
+once its lease runs out (or straight away when the runner restarts), and
+writing its result a second time is a no-op. Failed jobs are retried with
+exponential backoff (or after the Retry-After of an open circuit breaker)
+until max_attempts.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Callable, Dict, IO, Iterable, List, NamedTuple, Optional
+
+from instagram_urls import parse_url
+
+DEFAULT_THREADS = 8
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE = 600.0
+DEFAULT_RETRY_DELAY = 5.0
+DEFAULT_POLL_INTERVAL = 0.2
+DEFAULT_REPORT_INTERVAL = 1.0
+# Seconds of completions the throughput figure is averaged over
+THROUGHPUT_WINDOW = 10.0
+# Crashes tolerated per worker slot before the runner gives up
+MAX_CRASHES = 3
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job(NamedTuple):
+    id: int
+    key: str
+    url: str
+    attempts: int
+
+
+def job_key(url: str) -> str:
+    """Identity of a job: the post's shortcode, plus the carousel item if one is named
+
+    Like DedupIndex, this ignores the path kind, so /p/X/ and /reel/X/ are one job.
+    """
+    post = parse_url(url)
+    if post is None:
+        return url.strip()
+    return f'{post.shortcode}?img_index={post.index}' if post.index else post.shortcode
+
+
+class JobQueue:
+    """SQLite-backed job queue shared by the runner's processes
+
+    Every process opens its own JobQueue on the same file. State changes
+    run in short IMMEDIATE transactions, so concurrent claims never hand
+    out the same job twice while its lease holds.
+    """
+
+    def __init__(self, path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 lease: float = DEFAULT_LEASE, retry_delay: float = DEFAULT_RETRY_DELAY):
+        import sqlite3
+
+        self.path = path
+        self.max_attempts = max(1, int(max_attempts))
+        self.lease = lease
+        self.retry_delay = retry_delay
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, url TEXT NOT NULL,'
+            ' state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,'
+            ' next_attempt_at REAL NOT NULL DEFAULT 0, lease_until REAL, worker TEXT, error TEXT);'
+            'CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, next_attempt_at);'
+            'CREATE TABLE IF NOT EXISTS job_results ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, url TEXT NOT NULL,'
+            ' result TEXT NOT NULL, finished_at REAL NOT NULL);'
+        )
+
+    def _transaction(self, fn: Callable[[], Any]) -> Any:
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            value = fn()
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return value
+
+    def enqueue(self, urls: Iterable[str]) -> int:
+        """Add urls, skipping ones already queued; return the number added"""
+        now = time.time()
+
+        def insert() -> int:
+            added = 0
+            for url in urls:
+                url = url.strip()
+                if not url:
+                    continue
+                key = job_key(url)
+                valid = parse_url(url) is not None
+                cursor = self._db.execute(
+                    'INSERT INTO jobs (key, url, state) VALUES (?, ?, ?) ON CONFLICT (key) DO NOTHING',
+                    (key, url, PENDING if valid else FAILED))
+                if cursor.rowcount == 1 and not valid:
+                    # Nothing to fetch; record the failure straight away
+                    self._write_result(key, url, {'success': False, 'error': 'Could not extract video ID from URL'}, now)
+                added += cursor.rowcount
+            return added
+
+        return self._transaction(insert)
+
+    def recover(self, worker: Optional[str] = None) -> int:
+        """Put running jobs (of one worker, or all of them) back in the queue"""
+        if worker is None:
+            cursor = self._db.execute("UPDATE jobs SET state = ?, lease_until = NULL WHERE state = ?",
+                                      (PENDING, RUNNING))
+        else:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, lease_until = NULL WHERE state = ? AND worker = ?",
+                (PENDING, RUNNING, worker))
+        return cursor.rowcount
+
+    def claim(self, worker: str, limit: int) -> List[Job]:
+        """Lease up to limit due jobs to worker"""
+        now = time.time()
+
+        def take() -> List[Job]:
+            rows = self._db.execute(
+                'SELECT id, key, url, attempts FROM jobs'
+                ' WHERE (state = ? AND next_attempt_at <= ?) OR (state = ? AND lease_until <= ?)'
+                ' ORDER BY next_attempt_at, id LIMIT ?',
+                (PENDING, now, RUNNING, now, limit)).fetchall()
+            self._db.executemany(
+                'UPDATE jobs SET state = ?, attempts = attempts + 1, lease_until = ?, worker = ? WHERE id = ?',
+                [(RUNNING, now + self.lease, worker, row[0]) for row in rows])
+            return [Job(row[0], row[1], row[2], row[3] + 1) for row in rows]
+
+        return self._transaction(take)
+
+    def finish(self, job: Job, result: Dict[str, Any]) -> str:
+        """Record a job's result, or schedule a retry; return the job's new state"""
+        now = time.time()
+        if result.get('success'):
+            state = DONE
+        elif job.attempts < self.max_attempts:
+            state = PENDING
+        else:
+            state = FAILED
+
+        def update() -> None:
+            if state == PENDING:
+                retry_after = result.get('retry_after')
+                delay = retry_after if retry_after is not None else self.retry_delay * 2 ** (job.attempts - 1)
+                self._db.execute(
+                    'UPDATE jobs SET state = ?, next_attempt_at = ?, lease_until = NULL, error = ?'
+                    ' WHERE id = ? AND state = ?',
+                    (PENDING, now + delay, result.get('error'), job.id, RUNNING))
+                return
+            self._write_result(job.key, job.url, result, now)
+            # A duplicate run may have finished the job already; never move it backwards
+            self._db.execute(
+                'UPDATE jobs SET state = ?, lease_until = NULL, error = ? WHERE id = ? AND state = ?',
+                (state, result.get('error'), job.id, RUNNING))
+
+        self._transaction(update)
+        return state
+
+    def _write_result(self, key: str, url: str, result: Dict[str, Any], now: float) -> None:
+        # The first result written for a job wins, which makes repeated runs harmless
+        self._db.execute(
+            'INSERT INTO job_results (key, url, result, finished_at) VALUES (?, ?, ?, ?)'
+            ' ON CONFLICT (key) DO NOTHING',
+            (key, url, json.dumps(result), now))
+
+    def results_since(self, seq: int) -> List[tuple]:
+        """(seq, url, result) of results written after seq, oldest first"""
+        rows = self._db.execute('SELECT seq, url, result FROM job_results WHERE seq > ? ORDER BY seq',
+                                (seq,)).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def last_seq(self) -> int:
+        return self._db.execute('SELECT COALESCE(MAX(seq), 0) FROM job_results').fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs per state; 'retrying' counts pending jobs that have failed before"""
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for state, count in self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+            counts[state] = count
+        counts['retrying'] = self._db.execute(
+            'SELECT COUNT(*) FROM jobs WHERE state = ? AND attempts > 0', (PENDING,)).fetchone()[0]
+        counts['total'] = sum(counts[state] for state in (PENDING, RUNNING, DONE, FAILED))
+        return counts
+
+    def idle(self) -> bool:
+        """True when no job is waiting or running"""
+        return self._db.execute('SELECT 1 FROM jobs WHERE state IN (?, ?) LIMIT 1',
+                                (PENDING, RUNNING)).fetchone() is None
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _work(path: str, worker: str, make_downloader: Callable[[], Any], threads: int,
+          output_dir: Optional[str], max_attempts: int, lease: float, retry_delay: float) -> None:
+    """Process entry point: claim jobs and run them on a thread pool until the queue is idle"""
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    from instagram_http import configure_session_pool
+
+    queue = JobQueue(path, max_attempts=max_attempts, lease=lease, retry_delay=retry_delay)
+    downloader = make_downloader()
+    configure_session_pool(downloader.session, threads)
+
+    def run(url: str) -> Dict[str, Any]:
+        try:
+            return downloader.download_video(url, output_dir)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            # Only claim what the pool can start now, so leases are not held by queued work
+            if len(pending) < threads:
+                for job in queue.claim(worker, threads - len(pending)):
+                    pending[executor.submit(run, job.url)] = job
+            if not pending:
+                if queue.idle():
+                    break
+                time.sleep(DEFAULT_POLL_INTERVAL)
+                continue
+
+            done, _ = wait(pending, timeout=DEFAULT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                queue.finish(pending.pop(future), future.result())
+    queue.close()
+
+
+def print_job_progress(report: Dict[str, Any]) -> None:
+    """Default progress reporter writing to stderr"""
+    eta = report.get('eta')
+    sys.stderr.write(
+        f"\rJobs {report['done'] + report['failed']}/{report['total']}: {report['done']} done, "
+        f"{report['failed']} failed, {report['running']} running, {report['retrying']} retrying"
+        f" | {report['throughput']:.1f} jobs/s" + (f" | ETA {eta:.0f}s" if eta is not None else '') + '  ')
+    if not report['running'] and not report['pending']:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+
+def run_jobs(path: str, make_downloader: Callable[[], Any], urls: Optional[Iterable[str]] = None,
+             processes: Optional[int] = None, threads: int = DEFAULT_THREADS,
+             output_dir: Optional[str] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+             lease: float = DEFAULT_LEASE, retry_delay: float = DEFAULT_RETRY_DELAY,
+             output: IO[str] = None, progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+             report_interval: float = DEFAULT_REPORT_INTERVAL) -> Dict[str, int]:
+    """Queue urls in the job file at path and run every outstanding job across processes
+
+    make_downloader must be picklable (a class or a module-level function or
+    partial): each process builds its own downloader with it. Results written
+    by this run are streamed to output as JSON lines; progress, if given,
+    receives a report every report_interval seconds. Returns the final
+    per-state counts.
+
+    Run one runner per job file: on start, jobs left running by an earlier
+    runner are put back in the queue.
+    """
+    import multiprocessing
+
+    output = output or sys.stdout
+    processes = max(1, int(processes or os.cpu_count() or 1))
+    if output_dir:
+        # Created before any worker starts: media_path only treats an existing directory as one
+        os.makedirs(output_dir, exist_ok=True)
+    queue = JobQueue(path, max_attempts=max_attempts, lease=lease, retry_delay=retry_delay)
+    seq = queue.last_seq()
+    if urls is not None:
+        queue.enqueue(urls)
+    queue.recover()
+
+    # Spawned rather than forked: the parent may already be running threads
+    context = multiprocessing.get_context('spawn')
+
+    def start(worker: str):
+        process = context.Process(
+            target=_work, name=worker, daemon=True,
+            args=(path, worker, make_downloader, threads, output_dir, max_attempts, lease, retry_delay))
+        process.start()
+        return process
+
+    workers = {f'worker-{number}': None for number in range(processes)}
+    crashes = dict.fromkeys(workers, 0)
+    counts = queue.counts()
+    history = deque([(time.monotonic(), counts[DONE] + counts[FAILED])])
+    try:
+        while True:
+            idle = queue.idle()
+            for worker, process in workers.items():
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None and process.exitcode != 0:
+                    # The process died mid-job; hand its leases back rather than waiting them out
+                    crashes[worker] += 1
+                    if crashes[worker] > MAX_CRASHES:
+                        raise RuntimeError(f'Job {worker} exited with status {process.exitcode} '
+                                           f'{crashes[worker]} times')
+                    queue.recover(worker)
+                    idle = False
+                    workers[worker] = None
+                if not idle:
+                    workers[worker] = start(worker)
+
+            time.sleep(report_interval)
+            for seq, url, result in queue.results_since(seq):
+                output.write(json.dumps({'url': url, **result}) + '\n')
+            output.flush()
+
+            counts = queue.counts()
+            now = time.monotonic()
+            finished = counts[DONE] + counts[FAILED]
+            history.append((now, finished))
+            while len(history) > 1 and now - history[0][0] > THROUGHPUT_WINDOW:
+                history.popleft()
+            elapsed = now - history[0][0]
+            throughput = (finished - history[0][1]) / elapsed if elapsed > 0 else 0.0
+            remaining = counts[PENDING] + counts[RUNNING]
+            if progress is not None:
+                progress({**counts, 'throughput': throughput, 'processes': processes,
+                          'eta': remaining / throughput if throughput > 0 else None})
+
+            if not remaining and not any(process is not None and process.is_alive()
+                                         for process in workers.values()):
+                return counts
+    finally:
+        for process in workers.values():
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join()
+        queue.close()
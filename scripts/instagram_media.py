@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Media download engine for the Instagram downloader scripts
+
+Fetches an extracted video_url with parallel HTTP Range requests into a
+preallocated file. Finished chunks are recorded in a sidecar state file so
+interrupted downloads resume where they stopped.
+
+With a MediaStore (instagram_store.py) attached, finished files are kept
+once per content hash and assets already in the store are hardlinked into
+place instead of being downloaded again.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CHUNK_SIZE = 2 * 1024 * 1024
+STREAM_BLOCK_SIZE = 64 * 1024
+STATE_SUFFIX = '.part.json'
+
+
+class BandwidthThrottle:
+    def __init__(self, bytes_per_second: float):
+        self.rate = float(bytes_per_second)
+        self._lock = threading.Lock()
+        self._allowance = self.rate
+        self._last = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        """Block until amount bytes fit within the shared rate"""
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= amount
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+def print_progress(downloaded: int, total: Optional[int]) -> None:
+    """Default progress reporter writing to stderr"""
+    if total:
+        sys.stderr.write(f'\rDownloaded {downloaded}/{total} bytes ({downloaded * 100 // total}%)')
+    else:
+        sys.stderr.write(f'\rDownloaded {downloaded} bytes')
+    if total and downloaded >= total:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+
+class MediaDownloader:
+    def __init__(self, session: Optional['requests.Session'] = None,
+                 connections: int = DEFAULT_CONNECTIONS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_bytes_per_second: Optional[float] = None,
+                 progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                 timeout: float = 30.0, store: Optional['MediaStore'] = None):
+        if session is None:
+            import requests
+
+            session = requests.Session()
+        self.session = session
+        self.connections = max(1, int(connections))
+        self.chunk_size = max(STREAM_BLOCK_SIZE, int(chunk_size))
+        self.throttle = BandwidthThrottle(max_bytes_per_second) if max_bytes_per_second else None
+        self.progress = progress
+        self.timeout = timeout
+        self.store = store
+
+    def probe(self, url: str) -> Tuple[Optional[int], bool]:
+        """Return (size, supports_ranges) for url"""
+        response = self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                return (int(total) if total.isdigit() else None), True
+            length = response.headers.get('Content-Length')
+            return (int(length) if length and length.isdigit() else None), False
+        finally:
+            response.close()
+
+    def download(self, url: str, output_path: str, expected_size: Optional[int] = None) -> Dict[str, Any]:
+        """Download url to output_path, resuming from a previous partial download"""
+        started = time.monotonic()
+        size, ranged = self.probe(url)
+
+        if size and expected_size and size != expected_size:
+            raise Exception(f"Server reports {size} bytes but {expected_size} were expected")
+
+        if size and ranged:
+            resumed = self._download_ranges(url, output_path, size)
+        else:
+            resumed = 0
+            self._download_stream(url, output_path)
+
+        actual_size = os.path.getsize(output_path)
+        if (size and actual_size != size) or (expected_size and actual_size != expected_size):
+            raise Exception(f"Downloaded {actual_size} bytes but expected {expected_size or size}")
+
+        return {
+            'path': os.path.abspath(output_path),
+            'size': actual_size,
+            'resumed_bytes': resumed,
+            'connections': self.connections if ranged else 1,
+            'elapsed': round(time.monotonic() - started, 3),
+        }
+
+    def _download_stream(self, url: str, output_path: str) -> None:
+        """Fallback for servers without Range support: one sequential stream"""
+        downloaded = 0
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            total = response.headers.get('Content-Length')
+            total = int(total) if total and total.isdigit() else None
+            with open(output_path, 'wb') as f:
+                for block in response.iter_content(STREAM_BLOCK_SIZE):
+                    if self.throttle:
+                        self.throttle.consume(len(block))
+                    f.write(block)
+                    downloaded += len(block)
+                    if self.progress:
+                        self.progress(downloaded, total)
+
+    def _download_ranges(self, url: str, output_path: str, size: int) -> int:
+        """Fetch missing chunks in parallel; return the number of bytes reused from a prior run"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        state_path = output_path + STATE_SUFFIX
+        chunks = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+        done = self._load_state(state_path, size, output_path)
+
+        # Preallocate so every worker can write its chunk in place
+        mode = 'r+b' if os.path.exists(output_path) and done else 'wb'
+        with open(output_path, mode) as f:
+            f.truncate(size)
+
+        resumed = sum(end - start + 1 for index, (start, end) in enumerate(chunks) if index in done)
+        downloaded = [resumed]
+        lock = threading.Lock()
+
+        def fetch(index: int) -> None:
+            start, end = chunks[index]
+            with self.session.get(url, headers={'Range': f'bytes={start}-{end}'},
+                                  stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise Exception("Server ignored the Range request")
+
+                with open(output_path, 'r+b') as f:
+                    f.seek(start)
+                    written = 0
+                    for block in response.iter_content(STREAM_BLOCK_SIZE):
+                        if self.throttle:
+                            self.throttle.consume(len(block))
+                        f.write(block)
+                        written += len(block)
+                        with lock:
+                            downloaded[0] += len(block)
+                            if self.progress:
+                                self.progress(downloaded[0], size)
+
+            if written != end - start + 1:
+                raise Exception(f"Chunk {index} returned {written} bytes, expected {end - start + 1}")
+
+            with lock:
+                done.add(index)
+                self._save_state(state_path, size, done)
+
+        pending = [index for index in range(len(chunks)) if index not in done]
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            # list() re-raises the first chunk failure; the state file keeps finished chunks
+            list(executor.map(fetch, pending))
+
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return resumed
+
+    def _load_state(self, state_path: str, size: int, output_path: str) -> set:
+        if not os.path.exists(state_path) or not os.path.exists(output_path):
+            return set()
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if state.get('size') != size or state.get('chunk_size') != self.chunk_size:
+            return set()
+        return set(state.get('done', []))
+
+    def _save_state(self, state_path: str, size: int, done: set) -> None:
+        temp_path = state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'chunk_size': self.chunk_size, 'done': sorted(done)}, f)
+        os.replace(temp_path, state_path)
+
+
+def media_path(output_path: str, video_info: Dict[str, Any]) -> str:
+    """Resolve output_path, naming the file after the post (and carousel item) when it is a directory"""
+    if os.path.isdir(output_path):
+        name = video_info.get('id') or 'video'
+        if video_info.get('media_index'):
+            # Items of one carousel download side by side; each needs its own file and sidecar
+            name = f"{name}_{video_info['media_index']}"
+        return os.path.join(output_path, f"{name}.{video_info.get('format') or 'mp4'}")
+    return output_path
+
+
+def save_media(media: MediaDownloader, result: Dict[str, Any], output_path: str) -> Dict[str, Any]:
+    """Download the media for a successful download_video result"""
+    video_info = result['data']
+    if video_info.get('note') or not video_info.get('video_url'):
+        return {
+            'success': False,
+            'error': 'Could not download video: direct download URL not available'
+        }
+
+    try:
+        if media.store is None:
+            file_info = media.download(video_info['video_url'], media_path(output_path, video_info),
+                                       expected_size=video_info.get('filesize') or None)
+        else:
+            file_info = _save_stored(media, video_info, media_path(output_path, video_info))
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Could not download video: {str(e)}'
+        }
+
+    # Results may be shared through the cache, so copy rather than mutate
+    return {**result, 'data': {**video_info, 'file': file_info}}
+
+
+def _save_stored(media: MediaDownloader, video_info: Dict[str, Any], path: str) -> Dict[str, Any]:
+    """save_media through the content-addressed store"""
+    from instagram_store import link_or_copy
+
+    started = time.monotonic()
+    url = video_info['video_url']
+    stored = media.store.lookup(url)
+    if stored is not None:
+        link_or_copy(stored.path, path)
+        file_info = {
+            'path': os.path.abspath(path),
+            'size': stored.size,
+            'resumed_bytes': 0,
+            'connections': 0,
+            'elapsed': round(time.monotonic() - started, 3),
+            'from_store': True,
+        }
+    else:
+        if os.path.exists(path) and os.stat(path).st_nlink > 1:
+            # Never write into a file that is also a stored object
+            os.remove(path)
+        file_info = media.download(url, path, expected_size=video_info.get('filesize') or None)
+        stored = media.store.add(path, url, 'video/mp4' if path.endswith('.mp4') else None)
+    file_info['sha256'] = stored.sha256
+
+    # Keep the thumbnail too, so the thumbnail proxy can serve it without another fetch
+    thumbnail = video_info.get('thumbnail')
+    if thumbnail and thumbnail != url:
+        try:
+            file_info['thumbnail_sha256'] = media.store.fetch(media.session, thumbnail, timeout=media.timeout).sha256
+        except Exception:
+            pass
+    return file_info
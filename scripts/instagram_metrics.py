@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing instrumentation for the Instagram downloader scripts
+
+A Timings object is activated for the duration of one download_video call
+and the code along the way records stages into it: url_parse, connect (DNS,
+TCP and TLS), ttfb, download, parse, ytdlp, format_selection and
+serialization, plus bytes read and the strategy that produced the result.
+When no Timings is active every hook reduces to a context variable lookup.
+
+MetricsRegistry aggregates finished timings into Prometheus-style counters
+and histograms for the worker and batch modes.
+"""
+
+import functools
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current: ContextVar[Optional['Timings']] = ContextVar('instafetch_timings', default=None)
+
+
+class Timings:
+    __slots__ = ('stages', 'bytes_read', 'strategy', 'started')
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.bytes_read = 0
+        self.strategy: Optional[str] = None
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, seconds: float) -> None:
+        """Add seconds to a stage; repeated stages (e.g. redirects) accumulate"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def merge(self, other: 'Timings') -> None:
+        """Fold the stages recorded by another Timings (e.g. a strategy thread) into this one"""
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        self.bytes_read += other.bytes_read
+        self.strategy = other.strategy or self.strategy
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            'bytes_read': self.bytes_read,
+            'strategy': self.strategy,
+        }
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+def current_timings() -> Optional[Timings]:
+    """The Timings active in this thread or task, or None when instrumentation is off"""
+    return _current.get()
+
+
+def stage(name: str):
+    """Context manager timing a block as stage name; a no-op when instrumentation is off"""
+    timings = _current.get()
+    return _NULL_STAGE if timings is None else _Stage(timings, name)
+
+
+def run_with_timings(timings: Optional[Timings], fn: Callable[[], Any]) -> Any:
+    """Call fn with timings active (used for work handed to other threads)"""
+    if timings is None:
+        return fn()
+    token = _current.set(timings)
+    try:
+        return fn()
+    finally:
+        _current.reset(token)
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def inc(self, name: str, value: float = 1, description: str = '', **labels: str) -> None:
+        """Increment a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('counter', description))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, description: str = '', **labels: str) -> None:
+        """Record one histogram observation"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', description))
+            # Per-bucket counts followed by the sum and the total count
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def record(self, result: Dict[str, Any]) -> None:
+        """Aggregate one instrumented download_video result"""
+        timings = result['timings']
+        self.inc('instafetch_extractions_total',
+                 description='Extractions by outcome and producing strategy',
+                 outcome='success' if result.get('success') else 'error',
+                 strategy=timings['strategy'] or 'none')
+        self.inc('instafetch_bytes_read_total', timings['bytes_read'], description='Page bytes read')
+        self.observe('instafetch_extraction_seconds', timings['total_ms'] / 1000,
+                     description='End-to-end download_video duration')
+        for name, milliseconds in timings['stages_ms'].items():
+            self.observe_stage(name, milliseconds / 1000)
+
+    def observe_stage(self, name: str, seconds: float) -> None:
+        self.observe('instafetch_stage_seconds', seconds, description='Time spent per extraction stage', stage=name)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        with self._lock:
+            lines = []
+            for name, (kind, description) in sorted(self._help.items()):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'counter':
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f'{name}{label_text(labels)} {value:g}')
+                    continue
+
+                for (metric, labels), series in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets, series):
+                        lines.append(f'{name}_bucket{label_text(labels, [("le", f"{bound:g}")])} {count}')
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {series[-1]}')
+                    lines.append(f'{name}_sum{label_text(labels)} {series[-2]:.6f}')
+                    lines.append(f'{name}_count{label_text(labels)} {series[-1]}')
+            return '\n'.join(lines) + '\n'
+
+
+class Instrumentation:
+    def __init__(self, metrics: Optional[MetricsRegistry] = None):
+        self.metrics = metrics
+
+    def run(self, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Call fn with fresh Timings active and attach them to its result"""
+        timings = Timings()
+        return self.finish(timings, run_with_timings(timings, fn))
+
+    async def run_async(self, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Await fn with fresh Timings active and attach them to its result"""
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            result = await fn()
+        finally:
+            _current.reset(token)
+        return self.finish(timings, result)
+
+    def finish(self, timings: Timings, result: Dict[str, Any]) -> Dict[str, Any]:
+        # Results may be shared through the cache, so copy rather than mutate
+        result = {**result, 'timings': timings.as_dict()}
+        if self.metrics is not None:
+            self.metrics.record(result)
+        return result
+
+
+def instrumented(method: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    """Decorate download_video so it records timings when self.instrumentation is set"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        return instrumentation.run(lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+def instrumented_async(method: Callable[..., Awaitable[Dict[str, Any]]]) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    """instrumented for coroutine methods"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return await method(self, *args, **kwargs)
+        return await instrumentation.run_async(lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+def dumps_result(result: Dict[str, Any], indent: Optional[int] = None,
+                 metrics: Optional[MetricsRegistry] = None) -> str:
+    """json.dumps a result, timing the serialization into its timings block"""
+    timings = result.get('timings')
+    if timings is None:
+        return json.dumps(result, indent=indent)
+
+    started = time.perf_counter()
+    body = json.dumps({key: value for key, value in result.items() if key != 'timings'}, indent=indent)
+    elapsed = time.perf_counter() - started
+
+    timings = {**timings, 'stages_ms': {**timings['stages_ms'], 'serialization': round(elapsed * 1000, 3)}}
+    if metrics is not None:
+        metrics.observe_stage('serialization', elapsed)
+
+    # Append the timings block as the last key, matching a plain json.dumps of the whole result
+    if indent is None:
+        return f'{body[:-1]}, "timings": {json.dumps(timings)}}}'
+    block = json.dumps(timings, indent=indent).replace('\n', '\n' + ' ' * indent)
+    return f'{body[:-2]},\n{" " * indent}"timings": {block}\n}}'
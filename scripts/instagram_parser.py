@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Single-pass metadata parser for Instagram post pages
+
+Collects JSON-LD blocks and og:*/twitter:* meta tags in one scan of the
+document. The parser accepts the page incrementally and stops as soon as
+it reaches </head> or finds a JSON-LD video, so callers can stop reading
+the response early. Streaming callers also stop at a byte cap; a page cut
+off there before any media URL raises PageTooLarge.
+
+Carousel posts list several videos and images (a JSON-LD posting's
+video/image arrays, or repeated og:video tags); all of them are returned
+in a compact `media` list.
+"""
+
+import json
+import re
+from html import unescape
+from typing import Any, Dict, List, Optional, Tuple
+
+from instagram_formats import media_item
+
+# One alternation so the document is scanned a single time
+TOKEN_PATTERN = re.compile(
+    r'<script\b[^>]*?\btype\s*=\s*["\']application/ld\+json["\'][^>]*>(?P<ld>.*?)</script\s*>'
+    r'|<meta\b(?=[^>]*?(?:og|twitter):)(?P<meta>[^>]*)>'
+    r'|(?P<head_end></head\s*>)',
+    re.IGNORECASE | re.DOTALL
+)
+LD_OPEN_PATTERN = re.compile(r'<script\b[^>]*?\btype\s*=\s*["\']application/ld\+json["\']', re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'([a-zA-Z_:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+# Page reading limits for streaming callers
+DEFAULT_MAX_BYTES = 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+class PageTooLarge(ValueError):
+    """A streamed page reached its byte cap before any media URL was found in it"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Post page exceeded {max_bytes} bytes before its media URL was found")
+        self.max_bytes = max_bytes
+
+
+class MetadataParser:
+    def __init__(self):
+        self.meta: Dict[str, str] = {}
+        self.json_ld: List[Any] = []
+        self.video_object: Optional[Dict[str, Any]] = None
+        self.media: List[Dict[str, Any]] = []
+        self._og_videos: List[Dict[str, str]] = []
+        self.done = False
+        self._buffer = ''
+
+    def feed(self, chunk: str) -> bool:
+        """Consume the next piece of the document; return True once parsing is complete"""
+        if self.done:
+            return True
+
+        self._buffer += chunk
+        position = 0
+        for match in TOKEN_PATTERN.finditer(self._buffer):
+            position = match.end()
+            self._handle(match)
+            if self.done:
+                self._buffer = ''
+                return True
+
+        # Keep only what could be the start of an unfinished token
+        rest = self._buffer[position:]
+        open_ld = LD_OPEN_PATTERN.search(rest)
+        if open_ld:
+            self._buffer = rest[open_ld.start():]
+        else:
+            last_tag = rest.rfind('<')
+            self._buffer = rest[last_tag:] if last_tag != -1 else ''
+        return False
+
+    def close(self) -> None:
+        """Mark the document as fully read"""
+        self.done = True
+        self._buffer = ''
+
+    def _handle(self, match) -> None:
+        kind = match.lastgroup
+        if kind == 'head_end':
+            self.done = True
+        elif kind == 'meta':
+            self._handle_meta(match.group('meta'))
+        else:
+            self._handle_json_ld(match.group('ld'))
+
+    def _handle_meta(self, attributes: str) -> None:
+        values = {}
+        for name, double_quoted, single_quoted in ATTRIBUTE_PATTERN.findall(attributes):
+            values[name.lower()] = double_quoted or single_quoted
+
+        key = (values.get('property') or values.get('name') or '').lower()
+        if key.startswith(('og:', 'twitter:')) and 'content' in values:
+            content = values['content']
+            content = unescape(content) if '&' in content else content
+            # Every og:video starts a carousel item; its width/height tags follow it
+            if key == 'og:video':
+                self._og_videos.append({'url': content})
+            elif key in ('og:video:width', 'og:video:height') and self._og_videos:
+                self._og_videos[-1].setdefault(key[len('og:video:'):], content)
+            # First occurrence wins, matching a forward re.search
+            self.meta.setdefault(key, content)
+
+    def _handle_json_ld(self, text: str) -> None:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return
+
+        self.json_ld.append(data)
+        if self.video_object is None and isinstance(data, dict):
+            videos, media = _json_ld_media(data)
+            if videos:
+                self.video_object = videos[0]
+                self.media = media
+                self.done = True
+
+    def capped_video_info(self, video_id: str, max_bytes: int) -> Dict[str, Any]:
+        """video_info for a page cut off at max_bytes; PageTooLarge if no media URL was reached"""
+        video_info = self.video_info(video_id)
+        if not video_info.get('video_url'):
+            raise PageTooLarge(max_bytes)
+        return video_info
+
+    def video_info(self, video_id: str) -> Dict[str, Any]:
+        """Build the downloader result dict from what has been parsed so far"""
+        if self.video_object is not None:
+            video_obj = self.video_object
+            video_info = {
+                'id': video_id,
+                'title': video_obj.get('name', 'Instagram Video'),
+                'description': video_obj.get('description', ''),
+                'thumbnail': video_obj.get('thumbnailUrl', ''),
+                'video_url': video_obj.get('contentUrl', ''),
+                'duration': video_obj.get('duration', 0),
+                'width': video_obj.get('width', 0),
+                'height': video_obj.get('height', 0),
+                'format': 'mp4',
+                'quality': 'normal'
+            }
+            if len(self.media) > 1:
+                video_info['media'] = self.media
+            return video_info
+
+        meta = self.meta
+        video_info = {
+            'id': video_id,
+            'title': meta.get('og:title') or meta.get('twitter:title') or 'Instagram Video',
+            'description': meta.get('og:description') or meta.get('twitter:description', ''),
+            'thumbnail': meta.get('og:image') or meta.get('twitter:image', ''),
+            'video_url': (meta.get('og:video') or meta.get('og:video:secure_url')
+                          or meta.get('twitter:player:stream', '')),
+            'duration': 0,
+            'width': _to_int(meta.get('og:video:width')),
+            'height': _to_int(meta.get('og:video:height')),
+            'format': 'mp4',
+            'quality': 'normal'
+        }
+        if len(self._og_videos) > 1:
+            video_info['media'] = [
+                media_item('video', video['url'], video_info['thumbnail'] if index == 0 else None,
+                           _to_int(video.get('width')), _to_int(video.get('height')))
+                for index, video in enumerate(self._og_videos)
+            ]
+        return video_info
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _json_ld_media(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Return (video objects, compact media items) from one JSON-LD block"""
+    if 'videoObject' in data:
+        videos = [video for video in _as_list(data['videoObject']) if isinstance(video, dict)]
+        images = []
+    else:
+        # A posting lists a carousel's videos and images separately
+        videos = [video for video in _as_list(data.get('video')) if isinstance(video, dict)]
+        images = _as_list(data.get('image'))
+        if videos:
+            # Carousel videos rarely carry their own title; use the posting's
+            posting = {'name': data.get('headline'), 'description': data.get('articleBody')}
+            posting = {key: value for key, value in posting.items() if value}
+            videos = [{**posting, **video} for video in videos]
+
+    video_items = [media_item('video', video.get('contentUrl', ''), video.get('thumbnailUrl'), video.get('width'),
+                              video.get('height'), video.get('duration'))
+                   for video in videos if video.get('contentUrl')]
+    by_thumbnail = {item['thumbnail']: item for item in video_items if 'thumbnail' in item}
+
+    # The image list covers every slide in order, videos by their poster
+    media = []
+    for image in images:
+        if isinstance(image, str):
+            image = {'url': image}
+        url = (image.get('url') or image.get('contentUrl')) if isinstance(image, dict) else None
+        if not url:
+            continue
+        video = by_thumbnail.pop(url, None)
+        media.append(video or media_item('image', url, None, image.get('width'), image.get('height')))
+    media.extend(item for item in video_items if item not in media)
+    return videos, media
+
+
+def _to_int(value: Optional[str]) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_video_info(html: str, video_id: str) -> Dict[str, Any]:
+    """Parse a complete page into the downloader result dict"""
+    parser = MetadataParser()
+    parser.feed(html)
+    return parser.video_info(video_id)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Upstream protection for the Instagram downloader scripts
+
+UpstreamGuard wraps every call that reaches Instagram. Per host it keeps
+a token bucket (shared by the page, yt-dlp and async paths), retries
+throttled or failed calls with jittered exponential backoff that honours
+Retry-After, and runs a circuit breaker that fails fast while the host
+keeps failing. Callers turn UpstreamUnavailable into a stale cached result
+when they have one. Abandoned attempts (see set_cancel_event) stop at their
+next wait instead of taking more tokens or retrying.
+"""
+
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 10.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RECOVERY_TIMEOUT = 30.0
+
+HTTP_ERROR_PATTERN = re.compile(r'HTTP Error (\d{3})')
+
+
+class UpstreamError(Exception):
+    """A response that shows the upstream is refusing or failing requests"""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: bool = True):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling upstream while its circuit breaker is open"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Instagram is temporarily unavailable ({host}); retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class AttemptCancelled(Exception):
+    """Raised in an abandoned attempt (e.g. a losing hedge) instead of calling upstream again"""
+
+
+_attempt = threading.local()
+
+
+def set_cancel_event(event: Optional[threading.Event]) -> None:
+    """Make this thread's UpstreamGuard calls stop at their next wait once event is set"""
+    _attempt.cancel = event
+
+
+def _wait(delay: float) -> None:
+    cancel = getattr(_attempt, 'cancel', None)
+    if cancel is None:
+        if delay:
+            time.sleep(delay)
+    elif cancel.wait(delay):
+        raise AttemptCancelled()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_failure(status: int, headers: Any) -> Tuple[bool, bool, Optional[float]]:
+    if status == 429 or status >= 500:
+        retry_after = parse_retry_after(headers.get('Retry-After')) if headers is not None else None
+        return True, True, retry_after
+    if status in (401, 403):
+        # Blocked or asked to log in: retrying immediately will not help
+        return True, False, None
+    return False, False, None
+
+
+def classify(error: BaseException) -> Tuple[bool, bool, Optional[float]]:
+    """Return (upstream_failure, retryable, retry_after) for an exception"""
+    if isinstance(error, UpstreamError):
+        return True, error.retryable, error.retry_after
+
+    # requests.HTTPError carries the response
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return _status_failure(status, response.headers)
+
+    # aiohttp.ClientResponseError carries status and headers itself
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return _status_failure(status, getattr(error, 'headers', None))
+
+    # Connection errors and timeouts from requests, aiohttp and asyncio are all OSErrors
+    if isinstance(error, OSError):
+        return True, True, None
+
+    # yt-dlp reports HTTP failures in its message
+    match = HTTP_ERROR_PATTERN.search(str(error))
+    if match:
+        return _status_failure(int(match.group(1)), None)
+    return False, False, None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self.waits = 0
+        self.waited = 0.0
+
+    def reserve(self) -> float:
+        """Take a token, returning how long the caller must wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            # A negative balance is a reservation on tokens that have not refilled yet
+            delay = max(-self._tokens / self.rate if self._tokens < 0 else 0.0, self._paused_until - now)
+            if delay > 0:
+                self.waits += 1
+                self.waited += delay
+            return delay
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for seconds (e.g. after a Retry-After)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(tokens, 2),
+                'paused_for': round(max(0.0, self._paused_until - now), 2),
+                'waits': self.waits,
+                'waited': round(self.waited, 3),
+            }
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = DEFAULT_RECOVERY_TIMEOUT):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.transitions = deque(maxlen=20)
+
+    def _transition(self, state: str) -> None:
+        self.transitions.append({'from': self.state, 'to': state, 'at': round(time.time(), 3)})
+        self.state = state
+
+    def allow(self) -> float:
+        """0 when a call may go ahead, otherwise the seconds until the next probe"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.recovery_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    return remaining
+                self._transition(self.HALF_OPEN)
+                self._probing = False
+
+            if self.state == self.HALF_OPEN:
+                # One probe at a time decides whether the host has recovered
+                if self._probing:
+                    self.rejected += 1
+                    return self.recovery_timeout
+                self._probing = True
+            return 0.0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self, trip: bool = False) -> None:
+        """Count a failure; trip opens the breaker at once (e.g. on a login wall)"""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and (
+                    trip or self._failures >= self.failure_threshold)):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def release(self) -> None:
+        """End a call that said nothing about upstream health (e.g. a parse error)"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected,
+                'transitions': list(self.transitions),
+            }
+
+
+class UpstreamGuard:
+    _shared: Optional['UpstreamGuard'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = DEFAULT_RECOVERY_TIMEOUT):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Tuple[TokenBucket, CircuitBreaker]] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def shared(cls) -> 'UpstreamGuard':
+        """The process-wide guard used by every downloader unless one is given"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def host(self, url: str) -> Tuple[str, TokenBucket, CircuitBreaker]:
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (TokenBucket(self.rate, self.burst),
+                                     CircuitBreaker(self.failure_threshold, self.recovery_timeout))
+                self._counters[host] = {'calls': 0, 'retries': 0, 'failures': 0}
+            return (host,) + self._hosts[host]
+
+    def _count(self, host: str, name: str) -> None:
+        with self._lock:
+            self._counters[host][name] += 1
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, self.backoff_base))
+        return delay
+
+    def _admit(self, host: str, breaker: CircuitBreaker) -> None:
+        retry_in = breaker.allow()
+        if retry_in:
+            raise UpstreamUnavailable(host, retry_in)
+        self._count(host, 'calls')
+
+    def _settle(self, host: str, bucket: TokenBucket, breaker: CircuitBreaker,
+                error: BaseException, attempt: int) -> float:
+        """Record a failed attempt; return the delay before retrying or re-raise"""
+        upstream_failure, retryable, retry_after = classify(error)
+        if not upstream_failure:
+            breaker.release()
+            raise error
+
+        # Non-retryable failures are blocks (login wall, 401/403), so stop calling at once
+        breaker.record_failure(trip=not retryable)
+        self._count(host, 'failures')
+        if retry_after:
+            bucket.pause(retry_after)
+        if not retryable or attempt >= self.max_retries or (retry_after or 0) > self.backoff_max:
+            raise error
+        self._count(host, 'retries')
+        return self.backoff(attempt, retry_after)
+
+    def call(self, url: str, fn: Callable[[], Any]) -> Any:
+        """Run fn under url's host limiter, retries and circuit breaker"""
+        host, bucket, breaker = self.host(url)
+        attempt = 0
+        while True:
+            _wait(0)
+            self._admit(host, breaker)
+            try:
+                _wait(bucket.reserve())
+            except AttemptCancelled:
+                breaker.release()
+                raise
+            try:
+                result = fn()
+            except Exception as e:
+                _wait(self._settle(host, bucket, breaker, e, attempt))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    async def call_async(self, url: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """call() for coroutines; waits without blocking the event loop"""
+        import asyncio
+
+        host, bucket, breaker = self.host(url)
+        attempt = 0
+        while True:
+            self._admit(host, breaker)
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                result = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._settle(host, bucket, breaker, e, attempt))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host limiter, retry and breaker state"""
+        with self._lock:
+            hosts = dict(self._hosts)
+            counters = {host: dict(values) for host, values in self._counters.items()}
+        return {
+            host: {**counters[host], 'limiter': bucket.stats(), 'breaker': breaker.stats()}
+            for host, (bucket, breaker) in hosts.items()
+        }
+
+
+def unavailable_result(cache, key: str, error: UpstreamUnavailable) -> Dict[str, Any]:
+    """Serve a stale cached result while upstream is unavailable, or fail fast"""
+    stale = cache.get_stale(key) if cache is not None else None
+    if stale is not None:
+        return {**stale, 'stale': True}
+    return {
+        'success': False,
+        'error': str(error),
+        'retry_after': round(error.retry_in, 1)
+    }
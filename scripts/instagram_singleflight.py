@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Request coalescing (single-flight) for the Instagram downloader scripts
+
+Concurrent callers asking for the same key share one in-flight call and
+all receive its result or exception.
+"""
+
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._counters = {'calls': 0, 'executions': 0, 'collapsed': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn for key, or wait for the call already in flight for it"""
+        with self._lock:
+            self._counters['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['executions'] += 1
+            else:
+                self._counters['collapsed'] += 1
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """Return call/execution/collapsed counters"""
+        with self._lock:
+            return {**self._counters, 'in_flight': len(self._calls)}
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._tasks: Dict[str, 'asyncio.Future'] = {}
+        self._counters = {'calls': 0, 'executions': 0, 'collapsed': 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn for key, or the task already in flight for it"""
+        import asyncio
+
+        self._counters['calls'] += 1
+        task = self._tasks.get(key)
+        if task is None:
+            self._counters['executions'] += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self._counters['collapsed'] += 1
+
+        # A cancelled waiter must not cancel the shared call for everyone else
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        """Return call/execution/collapsed counters"""
+        return {**self._counters, 'in_flight': len(self._tasks)}
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Local Instagram stand-in server
+Replays recorded Instagram pages from scripts/fixtures so the downloaders
+can be exercised without network access. /media/<size>.mp4 (under any
+path prefix) serves deterministic media bytes with HTTP Range support. Latency and a share of
+error responses (e.g. 500 or 429) can be injected to exercise failure paths;
+an injected 302 redirects to the login wall, as Instagram does when it
+wants a blocked client to log in. error_paths (a regex) limits injected
+errors to matching request paths.
+
+The server also accepts absolute-form request lines, so it can be used as
+an HTTP proxy: point a session's 'http' proxy at it and request
+http://www.instagram.com/p/<fixture>/ URLs unchanged.
+
+/api/v1/feed/user/<username>/username/ pages through a synthetic profile
+of profile_posts posts, count at a time with a max_id cursor. Its
+shortcodes are numbered fixture names (video_og-7), which the post routes
+serve as the fixture.
+
+With url_lifetime set, the oe= expiry of every CDN URL in a page is
+rewritten to that many seconds from now, as Instagram signs them.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+POST_PATH_PATTERN = re.compile(r'^/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)/?$')
+MEDIA_PATH_PATTERN = re.compile(r'^(?:/[\w-]+)*/media/(\d+)\.mp4$')
+FEED_PATH_PATTERN = re.compile(r'^/api/v1/feed/user/([A-Za-z0-9_.]+)/username/?$')
+NUMBERED_FIXTURE_PATTERN = re.compile(r'^(.+)-\d+$')
+CDN_EXPIRY_PATTERN = re.compile(rb'(oe=)[0-9A-Fa-f]{8}')
+LOGIN_PATH = '/accounts/login/'
+
+# (fixture, media_type, product_type) of the posts in a synthetic profile, repeating
+PROFILE_POSTS = [
+    ('video_jsonld', 2, 'clips'),
+    ('video_og', 2, 'feed'),
+    ('carousel', 8, 'carousel_container'),
+    ('no_video', 1, 'feed'),
+]
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+def media_bytes(size: int) -> bytes:
+    """Deterministic stand-in media content of the given size"""
+    block = bytes(range(256))
+    return (block * (size // len(block) + 1))[:size]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlsplit(self.path)
+        if url.path == LOGIN_PATH:
+            self.send_body(200, b'<html><head><title>Login \xe2\x80\xa2 Instagram</title></head></html>')
+            return
+
+        if server.inject_error(url.path):
+            headers = None
+            if server.error_status == 429:
+                headers = {'Retry-After': '1'}
+            elif server.error_status == 302:
+                headers = {'Location': f'{LOGIN_PATH}?next={url.path}'}
+            self.send_body(server.error_status, b'<html><head><title>Error</title></head></html>',
+                           headers=headers)
+            return
+
+        path = url.path
+        media_match = MEDIA_PATH_PATTERN.match(path)
+        if media_match:
+            self.send_media(int(media_match.group(1)))
+            return
+
+        feed_match = FEED_PATH_PATTERN.match(path)
+        if feed_match:
+            self.send_feed(feed_match.group(1), parse_qs(url.query))
+            return
+
+        match = POST_PATH_PATTERN.match(path)
+        page = None
+        if match:
+            numbered = NUMBERED_FIXTURE_PATTERN.match(match.group(1))
+            page = server.load_page(numbered.group(1) if numbered else match.group(1))
+        if page is None:
+            self.send_body(404, b'<html><head><title>Page Not Found</title></head></html>')
+            return
+
+        if server.url_lifetime is not None:
+            expiry = b'%08x' % int(time.time() + server.url_lifetime)
+            page = CDN_EXPIRY_PATTERN.sub(lambda m: m.group(1) + expiry, page)
+        self.send_body(200, page)
+
+    def send_feed(self, username: str, query: dict):
+        """Serve one page of the synthetic profile, newest post first"""
+        try:
+            count = max(1, int(query.get('count', ['12'])[0]))
+            start = int(query.get('max_id', ['0'])[0] or 0)
+        except ValueError:
+            self.send_body(400, b'{"status": "fail"}', 'application/json')
+            return
+
+        total = self.server.profile_posts
+        items = []
+        for number in range(start, min(start + count, total)):
+            fixture, media_type, product_type = PROFILE_POSTS[number % len(PROFILE_POSTS)]
+            items.append({'code': f'{fixture}-{number}', 'media_type': media_type,
+                          'product_type': product_type, 'user': {'username': username}})
+        more = start + count < total
+        page = {'items': items, 'num_results': len(items), 'more_available': more, 'status': 'ok'}
+        if more:
+            page['next_max_id'] = str(start + count)
+        self.server.feed_requests += 1
+        self.send_body(200, json.dumps(page).encode('utf-8'), 'application/json')
+
+    def send_media(self, size: int):
+        """Serve /media/<size>.mp4, honouring single Range requests when enabled"""
+        body = media_bytes(size)
+        range_match = RANGE_PATTERN.match(self.headers.get('Range', '')) if self.server.ranges else None
+        if range_match is None:
+            self.send_body(200, body, 'video/mp4')
+            return
+
+        start = int(range_match.group(1))
+        end = min(int(range_match.group(2) or size - 1), size - 1)
+        if start >= size or start > end:
+            self.send_body(416, b'', 'video/mp4', {'Content-Range': f'bytes */{size}'})
+            return
+
+        self.send_body(206, body[start:end + 1], 'video/mp4', {'Content-Range': f'bytes {start}-{end}/{size}'})
+
+    def send_body(self, status: int, body: bytes, content_type: str = 'text/html; charset=utf-8',
+                  headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, fixtures_dir: str = FIXTURES_DIR,
+                 latency: float = 0.0, ranges: bool = True, error_rate: float = 0.0,
+                 error_status: int = 500, seed: Optional[int] = None, profile_posts: int = 30,
+                 url_lifetime: Optional[float] = None, error_paths: Optional[str] = None):
+        super().__init__((host, port), StandInHandler)
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.ranges = ranges
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_paths = re.compile(error_paths) if error_paths else None
+        self.profile_posts = profile_posts
+        self.url_lifetime = url_lifetime
+        self.requests = 0
+        self.errors = 0
+        self.feed_requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server, usable as an HTTP proxy"""
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle_error(self, request, client_address):
+        # Clients that stop reading early (streaming fetches) are expected
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def inject_error(self, path: str = '/') -> bool:
+        """Count a request and decide whether it gets an injected error response"""
+        with self._lock:
+            self.requests += 1
+            failed = bool(self.error_rate) and (self.error_paths is None or bool(self.error_paths.search(path))) \
+                and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def load_page(self, name: str) -> Optional[bytes]:
+        """Return the recorded page for a fixture name, or None"""
+        if name not in self._pages:
+            path = os.path.join(self.fixtures_dir, f'{name}.html')
+            if not os.path.isfile(path):
+                return None
+            with open(path, 'rb') as f:
+                self._pages[name] = f.read()
+        return self._pages[name]
+
+    def start(self) -> 'StandInServer':
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """Run the stand-in server in the foreground"""
+    parser = argparse.ArgumentParser(description='Local Instagram stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=500, help='status code of injected errors')
+    parser.add_argument('--error-paths', metavar='REGEX', help='only inject errors into matching paths')
+    parser.add_argument('--profile-posts', type=int, default=30, help='posts in the synthetic profile feed')
+    parser.add_argument('--url-lifetime', type=float, help='sign CDN URLs to expire SECONDS from now')
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                           error_status=args.error_status, profile_posts=args.profile_posts,
+                           url_lifetime=args.url_lifetime, error_paths=args.error_paths)
+    print(f'Instagram stand-in serving {server.fixtures_dir} on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
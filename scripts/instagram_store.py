@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Content-addressed media store for the Instagram downloader scripts
+
+Downloaded videos and thumbnails are kept once per SHA-256 of their bytes
+under <root>/objects/, so reposts and re-submissions of the same clip
+share one file. Output files are hardlinks into the store (copies across
+filesystems). A SQLite index maps CDN asset paths to hashes - the signed
+query string changes between fetches, the path does not - so a known
+asset is never downloaded twice. The least recently used objects are
+evicted once the store grows past max_bytes.
+
+ThumbnailProxy serves thumbnails from the store over HTTP, fetching each
+one upstream once. Responses are content-addressed, so they carry the hash
+as a strong ETag and are cacheable for good.
+
+Usage: python instagram_store.py --root DIR [--max-bytes N] [--host H] [--port N]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_STORE_BYTES = 5 * 1024 ** 3
+HASH_BLOCK_SIZE = 1024 * 1024
+# Only Instagram's CDNs are proxied, so the proxy cannot be used to fetch arbitrary URLs
+PROXY_HOST_SUFFIXES = ('.cdninstagram.com', '.fbcdn.net')
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/heic': 'heic',
+    'video/mp4': 'mp4',
+}
+
+
+class StoredObject(NamedTuple):
+    sha256: str
+    path: str
+    size: int
+    content_type: Optional[str]
+
+
+def source_key(url: str) -> str:
+    """Identity of a CDN asset: its host-independent path, without the signature"""
+    return urlsplit(url).path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    """Atomically make destination a hardlink to source, copying when linking is impossible"""
+    temp_path = f'{destination}.{os.getpid()}.{threading.get_ident()}.link'
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        # Different filesystem, or one without hardlinks
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+
+
+class MediaStore:
+    def __init__(self, root: str, max_bytes: int = DEFAULT_STORE_BYTES):
+        import sqlite3
+
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.temp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stored': 0, 'deduplicated': 0, 'evictions': 0}
+        # Several processes (e.g. the job runner's) may share one store
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS objects (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL,'
+            ' content_type TEXT, ext TEXT NOT NULL, last_access REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS objects_lru ON objects (last_access);'
+            'CREATE TABLE IF NOT EXISTS sources (key TEXT PRIMARY KEY, sha256 TEXT NOT NULL);'
+        )
+        self._db.commit()
+
+    def object_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], f'{sha256}.{ext}')
+
+    def _object(self, row) -> Optional[StoredObject]:
+        sha256, size, content_type, ext = row
+        path = self.object_path(sha256, ext)
+        if not os.path.exists(path):
+            # Removed behind our back; forget it so it is fetched again
+            self._db.execute('DELETE FROM objects WHERE sha256 = ?', (sha256,))
+            self._db.execute('DELETE FROM sources WHERE sha256 = ?', (sha256,))
+            self._db.commit()
+            return None
+        self._db.execute('UPDATE objects SET last_access = ? WHERE sha256 = ?', (time.time(), sha256))
+        self._db.commit()
+        return StoredObject(sha256, path, size, content_type)
+
+    def get(self, sha256: str) -> Optional[StoredObject]:
+        """Look an object up by hash, marking it recently used"""
+        with self._lock:
+            row = self._db.execute('SELECT sha256, size, content_type, ext FROM objects WHERE sha256 = ?',
+                                   (sha256,)).fetchone()
+            return self._object(row) if row is not None else None
+
+    def lookup(self, url: str) -> Optional[StoredObject]:
+        """The stored object for a CDN URL fetched before, or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT o.sha256, o.size, o.content_type, o.ext FROM sources s'
+                ' JOIN objects o ON o.sha256 = s.sha256 WHERE s.key = ?',
+                (source_key(url),)).fetchone()
+            stored = self._object(row) if row is not None else None
+            self._counters['hits' if stored is not None else 'misses'] += 1
+            return stored
+
+    def add(self, path: str, url: Optional[str] = None, content_type: Optional[str] = None,
+            move: bool = False) -> StoredObject:
+        """Store the file at path under its hash, recording url as a source of it
+
+        The file at path is left as a hardlink to the stored object, or
+        removed when move is set. Content already in the store is not
+        stored again: path is relinked to the existing object.
+        """
+        sha256 = file_sha256(path)
+        size = os.path.getsize(path)
+        ext = EXTENSIONS.get(content_type or '') or os.path.splitext(path)[1].lstrip('.') or 'bin'
+        with self._lock:
+            row = self._db.execute('SELECT ext FROM objects WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is not None and os.path.exists(self.object_path(sha256, row[0])):
+                ext = row[0]
+                self._counters['deduplicated'] += 1
+                if move:
+                    os.remove(path)
+                else:
+                    link_or_copy(self.object_path(sha256, ext), path)
+            else:
+                object_path = self.object_path(sha256, ext)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                if move:
+                    os.replace(path, object_path)
+                else:
+                    link_or_copy(path, object_path)
+                self._counters['stored'] += 1
+
+            self._db.execute('INSERT OR REPLACE INTO objects (sha256, size, content_type, ext, last_access)'
+                             ' VALUES (?, ?, ?, ?, ?)', (sha256, size, content_type, ext, time.time()))
+            if url:
+                self._db.execute('INSERT OR REPLACE INTO sources (key, sha256) VALUES (?, ?)',
+                                 (source_key(url), sha256))
+            self._db.commit()
+            self._evict(keep=sha256)
+            return StoredObject(sha256, self.object_path(sha256, ext), size, content_type)
+
+    def fetch(self, session, url: str, timeout: float = 30.0) -> StoredObject:
+        """Return the stored object for url, downloading it into the store on a miss"""
+        stored = self.lookup(url)
+        if stored is not None:
+            return stored
+
+        response = session.get(url, stream=True, timeout=timeout)
+        try:
+            response.raise_for_status()
+            content_type = (response.headers.get('Content-Type') or '').split(';')[0].strip() or None
+            fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+            with os.fdopen(fd, 'wb') as f:
+                for block in response.iter_content(HASH_BLOCK_SIZE):
+                    f.write(block)
+        finally:
+            response.close()
+        try:
+            return self.add(temp_path, url, content_type, move=True)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Drop least recently used objects until the store fits in max_bytes"""
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for sha256, size, ext in self._db.execute(
+                'SELECT sha256, size, ext FROM objects WHERE sha256 != ? ORDER BY last_access',
+                (keep or '',)).fetchall():
+            try:
+                os.remove(self.object_path(sha256, ext))
+            except FileNotFoundError:
+                pass
+            self._db.execute('DELETE FROM objects WHERE sha256 = ?', (sha256,))
+            self._db.execute('DELETE FROM sources WHERE sha256 = ?', (sha256,))
+            self._counters['evictions'] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/dedup/eviction counters and the store size"""
+        with self._lock:
+            objects, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+            return {**self._counters, 'objects': objects, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ThumbnailHandler(BaseHTTPRequestHandler):
+    server_version = 'InstaFetchThumbnails/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/thumb':
+            self.send_error(404)
+            return
+        source = parse_qs(url.query).get('url', [''])[0]
+        host = urlsplit(source).hostname or ''
+        if urlsplit(source).scheme not in ('http', 'https') or not host.endswith(PROXY_HOST_SUFFIXES):
+            self.send_error(400, 'url must be an Instagram CDN URL')
+            return
+
+        try:
+            # Concurrent requests for a thumbnail not yet stored share one upstream fetch
+            stored = self.server.flight.do(source_key(source), lambda: self.server.store.fetch(
+                self.server.session, source))
+        except Exception:
+            self.send_error(502, 'Could not fetch the thumbnail upstream')
+            return
+
+        etag = f'"{stored.sha256}"'
+        headers = {
+            'ETag': etag,
+            # The bytes behind a hash never change
+            'Cache-Control': f'public, max-age={self.server.max_age}, immutable',
+        }
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', stored.content_type or 'application/octet-stream')
+        self.send_header('Content-Length', str(stored.size))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        with open(stored.path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+
+class ThumbnailProxy(ThreadingHTTPServer):
+    """GET /thumb?url=<CDN URL> serves the thumbnail from the store, fetching it on first use"""
+    daemon_threads = True
+
+    def __init__(self, store: MediaStore, host: str = '127.0.0.1', port: int = 0, session=None,
+                 max_age: int = 365 * 24 * 3600):
+        from instagram_singleflight import SingleFlight
+
+        super().__init__((host, port), ThumbnailHandler)
+        if session is None:
+            import requests
+
+            session = requests.Session()
+        self.store = store
+        self.session = session
+        self.max_age = max_age
+        self.flight = SingleFlight()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'ThumbnailProxy':
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'ThumbnailProxy':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve Instagram thumbnails from a local content-addressed store')
+    parser.add_argument('--root', required=True, help='store directory')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_STORE_BYTES, help='evict beyond this many bytes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    proxy = ThumbnailProxy(MediaStore(args.root, args.max_bytes), args.host, args.port)
+    print(f'Serving thumbnails on {proxy.url}/thumb?url=...', file=sys.stderr)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Hedged/raced extraction strategies for the Instagram downloader scripts
+
+Registered extractors run either as a race (all at once) or as a delayed
+hedge (the next one starts when the current one is slow or fails). The
+first complete result wins, the rest are abandoned, and one overall
+deadline bounds the whole run. Per-strategy win rates and latencies are
+recorded so the hedge order adapts over time.
+
+Every attempt runs on its own thread, so the deadline starts when the
+first attempt does rather than after a wait for a free pool thread.
+Abandoned attempts are cancelled at their next rate-limiter wait, and
+extra (hedged or raced) attempts are capped per runner so losers cannot
+pile up under load.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from instagram_metrics import Timings, current_timings, run_with_timings
+from instagram_ratelimit import AttemptCancelled, set_cancel_event
+
+DEFAULT_DEADLINE = 25.0
+DEFAULT_HEDGE_DELAY = 2.0
+DEFAULT_MAX_IN_FLIGHT = 32
+LATENCY_SMOOTHING = 0.2
+
+
+def is_complete(video_info: Dict[str, Any]) -> bool:
+    """A result is complete when it carries a real media URL"""
+    return bool(video_info.get('video_url')) and not video_info.get('note')
+
+
+class StrategyRunner:
+    def __init__(self, strategies: List[Tuple[str, Callable[[str], Dict[str, Any]]]],
+                 mode: str = 'hedge', hedge_delay: float = DEFAULT_HEDGE_DELAY,
+                 deadline: float = DEFAULT_DEADLINE, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        if mode not in ('race', 'hedge'):
+            raise ValueError(f"Unknown strategy mode: {mode}")
+
+        self.strategies = list(strategies)
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+        # Hedges and race entrants are skipped while this many attempts are running
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            name: {'attempts': 0, 'completes': 0, 'incomplete': 0, 'failures': 0, 'cancelled': 0,
+                   'wins': 0, 'latency': None}
+            for name, _ in self.strategies
+        }
+
+    def ordered(self) -> List[Tuple[str, Callable[[str], Dict[str, Any]]]]:
+        """Strategies ordered by smoothed win rate, then latency, then registration order"""
+        with self._lock:
+            def score(strategy):
+                stats = self._stats[strategy[0]]
+                # Laplace smoothing lets untried strategies start at an even 0.5
+                win_rate = (stats['wins'] + 1) / (stats['attempts'] + 2)
+                latency = stats['latency'] if stats['latency'] is not None else 0.0
+                return (-round(win_rate, 2), latency)
+
+            return sorted(self.strategies, key=score)
+
+    def _timed(self, name: str, fn: Callable[[str], Dict[str, Any]], url: str,
+               timings: Optional[Timings]) -> Tuple[Dict[str, Any], Optional[Timings]]:
+        started = time.monotonic()
+        outcome = 'failures'
+        try:
+            video_info = run_with_timings(timings, lambda: fn(url))
+            outcome = 'completes' if is_complete(video_info) else 'incomplete'
+            return video_info, timings
+        except AttemptCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                stats = self._stats[name]
+                stats['attempts'] += 1
+                stats[outcome] += 1
+                # A cancelled attempt stopped early, so its time says nothing about its latency
+                if outcome != 'cancelled':
+                    latency = stats['latency']
+                    stats['latency'] = elapsed if latency is None else latency + LATENCY_SMOOTHING * (elapsed - latency)
+
+    def _attempt(self, name: str, fn: Callable[[str], Dict[str, Any]], url: str, timings: Optional[Timings],
+                 cancel: threading.Event, results: 'queue.Queue') -> None:
+        set_cancel_event(cancel)
+        try:
+            video_info, timings = self._timed(name, fn, url, timings)
+            results.put((name, video_info, timings, None))
+        except Exception as e:
+            results.put((name, None, None, e))
+        finally:
+            set_cancel_event(None)
+            with self._lock:
+                self._in_flight -= 1
+
+    def run(self, url: str) -> Dict[str, Any]:
+        """Return the first complete result, or the best partial one when none completes"""
+        order = self.ordered()
+        # Each strategy records into its own Timings; only the winner's are kept
+        parent_timings = current_timings()
+        results: 'queue.Queue' = queue.Queue()
+        cancel = threading.Event()
+        launched: List[str] = []
+        running = 0
+        best = None
+        last_error: Optional[Exception] = None
+
+        def launch(extra: bool) -> bool:
+            nonlocal running
+            with self._lock:
+                if extra and self._in_flight >= self.max_in_flight:
+                    return False
+                self._in_flight += 1
+            name, fn = order[len(launched)]
+            launched.append(name)
+            running += 1
+            timings = Timings() if parent_timings is not None else None
+            threading.Thread(target=self._attempt, args=(name, fn, url, timings, cancel, results),
+                             name=f'strategy-{name}', daemon=True).start()
+            return True
+
+        launch(extra=False)
+        # Attempts never queue for a thread, so the deadline runs from the first one's start
+        deadline = time.monotonic() + self.deadline
+        while self.mode == 'race' and len(launched) < len(order) and launch(extra=True):
+            pass
+        next_hedge = time.monotonic() + self.hedge_delay
+
+        try:
+            while running or len(launched) < len(order):
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+
+                if not running:
+                    # The previous strategy failed: fall back to the next one
+                    launch(extra=False)
+                    next_hedge = now + self.hedge_delay
+                    continue
+
+                timeout = deadline - now
+                if len(launched) < len(order):
+                    timeout = min(timeout, max(0.0, next_hedge - now))
+
+                try:
+                    name, video_info, timings, error = results.get(timeout=timeout)
+                except queue.Empty:
+                    # The running strategies are slow: hedge with the next one
+                    if len(launched) < len(order) and time.monotonic() >= next_hedge:
+                        launch(extra=True)
+                        next_hedge = time.monotonic() + self.hedge_delay
+                    continue
+
+                running -= 1
+                if error is not None:
+                    last_error = error
+                    continue
+                if is_complete(video_info):
+                    with self._lock:
+                        self._stats[name]['wins'] += 1
+                    self._keep_timings(parent_timings, timings, name)
+                    return video_info
+                if best is None:
+                    best = (video_info, timings, name)
+        finally:
+            # Losers stop at their next rate-limiter wait instead of taking more tokens
+            cancel.set()
+
+        if best is not None:
+            video_info, timings, name = best
+            self._keep_timings(parent_timings, timings, name)
+            return video_info
+        if last_error is not None:
+            raise last_error
+        raise Exception(f"Extraction deadline of {self.deadline}s exceeded")
+
+    @staticmethod
+    def _keep_timings(parent: Optional[Timings], timings: Optional[Timings], name: str) -> None:
+        if parent is not None and timings is not None:
+            parent.merge(timings)
+            parent.strategy = name
+
+    def in_flight(self) -> int:
+        """Attempts still running, including abandoned ones winding down"""
+        with self._lock:
+            return self._in_flight
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return per-strategy attempts, wins, win rate and smoothed latency"""
+        with self._lock:
+            return {
+                name: {
+                    **stats,
+                    'latency': round(stats['latency'], 4) if stats['latency'] is not None else None,
+                    'win_rate': round(stats['wins'] / stats['attempts'], 4) if stats['attempts'] else 0.0,
+                }
+                for name, stats in self._stats.items()
+            }
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Instagram URL handling for the Instagram downloader scripts
+
+Kept free of network imports so the command line can reject bad URLs
+before requests or yt-dlp are loaded.
+
+The same post reaches us under many URLs: /p/, /reel/, /reels/ and /tv/
+paths, profile-prefixed links, m. and instagr.am hosts, share links and
+tracking query strings (igshid, utm_*). parse_url maps all of them to one
+canonical form with a (shortcode, index) key, and DedupIndex uses that key
+to fetch each post in a batch only once. The key leaves out the path kind:
+/p/X/ and /reel/X/ are one post, just as they are one metadata cache entry
+and one single-flight extraction.
+
+Media URLs on Instagram's CDN are signed and stop working at the Unix
+time in their oe= parameter (hex); cdn_url_expiry reads it.
+"""
+
+import re
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# One pass over the URL recognises every known shape. Hosts are matched
+# case-insensitively; shortcodes are case-sensitive.
+URL_PATTERN = re.compile(
+    r'(?:^|[/.@])(?i:instagram\.com|instagr\.am)(?::\d+)?/'
+    r'(?:'
+    r'share/(?:(?:p|reels?)/)?(?P<token>[A-Za-z0-9_-]+)'
+    r'|(?:[A-Za-z0-9_.]+/)?(?P<kind>p|reels?|tv)/(?!audio/)(?P<shortcode>[A-Za-z0-9_-]+)'
+    r')'
+    r'(?:[/?#]|$)'
+)
+SCHEME_PATTERN = re.compile(r'^\s*(?i:(https?))://')
+INDEX_PATTERN = re.compile(r'[?&]img_index=(\d+)')
+PROFILE_PATTERN = re.compile(
+    r'(?:^|[/.@])(?i:instagram\.com|instagr\.am)(?::\d+)?/'
+    r'(?P<username>[A-Za-z0-9_.]{1,30})/?(?:reels/?)?(?:[?#]|$)'
+)
+CDN_EXPIRY_PATTERN = re.compile(r'[?&]oe=([0-9A-Fa-f]{8})(?:[&#]|$)')
+
+# First path segments that are Instagram pages rather than accounts
+RESERVED_PATHS = frozenset({
+    'p', 'reel', 'reels', 'tv', 'share', 'stories', 'explore', 'accounts', 'direct', 'about',
+    'developer', 'legal', 'web', 'api', 'graphql', 'static', 'emails', 'challenge',
+})
+
+CANONICAL_HOST = 'www.instagram.com'
+
+Key = Tuple[str, Optional[int]]
+
+
+class InstagramURL(NamedTuple):
+    kind: str
+    shortcode: str
+    scheme: str = 'https'
+    # img_index of a carousel link, 1-based
+    index: Optional[int] = None
+
+    @property
+    def key(self) -> Key:
+        """Identity of the post (and carousel item), independent of scheme, host, path kind and query"""
+        return self.shortcode, self.index
+
+    @property
+    def url(self) -> str:
+        """Canonical URL: fixed host and path, no query string; the scheme is kept"""
+        if self.kind == 'share':
+            return f'{self.scheme}://{CANONICAL_HOST}/share/{self.shortcode}/'
+        return f'{self.scheme}://{CANONICAL_HOST}/{self.kind}/{self.shortcode}/'
+
+
+def parse_url(url: str) -> Optional[InstagramURL]:
+    """Parse any known Instagram post URL shape, or return None"""
+    match = URL_PATTERN.search(url)
+    if match is None:
+        return None
+
+    scheme = SCHEME_PATTERN.match(url)
+    scheme = scheme.group(1).lower() if scheme else 'https'
+    index = INDEX_PATTERN.search(url, match.end() - 1) if '?' in url else None
+    index = int(index.group(1)) if index else None
+
+    token = match.group('token')
+    if token is not None:
+        # Share links carry an opaque token; Instagram redirects it to the post
+        return InstagramURL('share', token, scheme, index)
+
+    kind = match.group('kind')
+    return InstagramURL('reel' if kind == 'reels' else kind, match.group('shortcode'), scheme, index)
+
+
+def canonical_url(url: str) -> Optional[str]:
+    """The canonical form of an Instagram post URL, or None"""
+    post = parse_url(url)
+    return post.url if post else None
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Extract the post shortcode (or share token) from an Instagram URL"""
+    post = parse_url(url)
+    return post.shortcode if post else None
+
+
+def parse_profile_url(url: str) -> Optional[Tuple[str, str]]:
+    """Return (scheme, username) for an Instagram profile URL, or None"""
+    match = PROFILE_PATTERN.search(url)
+    if match is None or match.group('username').lower() in RESERVED_PATHS:
+        return None
+    scheme = SCHEME_PATTERN.match(url)
+    return (scheme.group(1).lower() if scheme else 'https'), match.group('username')
+
+
+def cdn_url_expiry(url: Optional[str]) -> Optional[float]:
+    """Unix time at which a signed CDN URL expires, or None when it carries no oe= expiry"""
+    match = CDN_EXPIRY_PATTERN.search(url) if url else None
+    return float(int(match.group(1), 16)) if match else None
+
+
+class DedupIndex:
+    """Canonical keys seen in one job, so duplicate URLs are fetched once
+
+    URLs for different carousel items (img_index) of one post are not
+    duplicates of each other.
+    """
+
+    def __init__(self):
+        self._first: Dict[Key, str] = {}
+        self._counters = {'urls': 0, 'unique': 0, 'duplicates': 0, 'invalid': 0}
+
+    def add(self, url: str) -> Tuple[Optional[Key], bool]:
+        """Return (key, first_seen) for url; key is None for unrecognised URLs"""
+        self._counters['urls'] += 1
+        post = parse_url(url)
+        if post is None:
+            self._counters['invalid'] += 1
+            return None, True
+
+        key = post.key
+        if key in self._first:
+            self._counters['duplicates'] += 1
+            return key, False
+        self._first[key] = url
+        self._counters['unique'] += 1
+        return key, True
+
+    def __len__(self) -> int:
+        return len(self._first)
+
+    def __contains__(self, url: str) -> bool:
+        post = parse_url(url)
+        return post is not None and post.key in self._first
+
+    def stats(self) -> Dict[str, int]:
+        """Return URL/unique/duplicate counters"""
+        return dict(self._counters)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Long-lived worker mode for the Instagram downloader scripts
+
+Reads newline-delimited JSON requests on stdin and writes one JSON result
+per line on stdout, keeping the downloader (and its HTTP session) warm
+between requests.
+
+Request lines:
+    {"id": "1", "op": "extract", "url": "https://www.instagram.com/p/..."}
+    {"id": "2", "op": "ping"}     (or "stats"; both return worker and cache counters)
+    {"id": "3", "op": "metrics"}  (Prometheus text; needs --timings)
+
+Extract requests may carry a "format" selection policy, e.g.
+{"max_height": 720}, {"max_bytes": 5000000}, {"target_height": 480} or
+{"audio_only": true}; it is applied to the result's format index. An
+"index" (1-based) picks one item of a carousel post from the cached fetch.
+
+Every response echoes the request "id".
+
+With a cache, hot entries are re-extracted in the background shortly
+before their signed media URLs expire (refresh_ahead seconds).
+
+A timed-out extraction is answered with an error straight away, but its
+thread cannot be cancelled and runs on until the download returns. Until
+then it still counts against max_backlog (by default BACKLOG_PER_THREAD
+per concurrency slot). Extract requests beyond the backlog are refused at
+once, so stuck upstream calls cannot queue work without bound.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, IO, Optional
+
+from instagram_cache import DEFAULT_REFRESH_LEAD, CacheRefresher
+from instagram_formats import FormatPolicy, apply_format_policy
+from instagram_metrics import dumps_result
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 25.0
+# Extractions accepted per concurrency slot before new ones are refused
+BACKLOG_PER_THREAD = 8
+
+
+class ExtractionWorker:
+    def __init__(self, downloader, concurrency: int = DEFAULT_CONCURRENCY,
+                 timeout: float = DEFAULT_TIMEOUT, output: Optional[IO[str]] = None,
+                 refresh_ahead: float = DEFAULT_REFRESH_LEAD, max_backlog: Optional[int] = None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from instagram_http import configure_session_pool
+
+        self.downloader = downloader
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.max_backlog = max(1, int(max_backlog or self.concurrency * BACKLOG_PER_THREAD))
+        self.output = output or sys.stdout
+        instrumentation = getattr(downloader, 'instrumentation', None)
+        self.metrics = instrumentation.metrics if instrumentation is not None else None
+        self.started_at = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._in_flight = 0
+        self._served = 0
+        self._timeouts = 0
+        # Extractions queued or still running, answered or not
+        self._backlog = 0
+        self._rejected = 0
+
+        # One pooled connection per concurrent request keeps keep-alive effective
+        configure_session_pool(downloader.session, self.concurrency)
+
+        cache = getattr(downloader, 'cache', None)
+        self.refresher = None
+        if cache is not None and refresh_ahead > 0:
+            self.refresher = CacheRefresher(cache, lead=refresh_ahead).start()
+
+    def write(self, message: Dict[str, Any]) -> None:
+        """Write one JSON response line"""
+        line = dumps_result(message, metrics=self.metrics)
+        with self._write_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return worker health counters"""
+        with self._state_lock:
+            stats = {
+                'pid': os.getpid(),
+                'uptime': round(time.monotonic() - self.started_at, 3),
+                'in_flight': self._in_flight,
+                'served': self._served,
+                'timeouts': self._timeouts,
+                'backlog': self._backlog,
+                'rejected': self._rejected,
+                'concurrency': self.concurrency,
+            }
+
+        cache = getattr(self.downloader, 'cache', None)
+        if cache is not None:
+            stats['cache'] = cache.stats()
+        if self.refresher is not None:
+            stats['refresher'] = self.refresher.stats()
+        stats['singleflight'] = self.downloader.flight.stats()
+        strategies = getattr(self.downloader, 'strategies', None)
+        if strategies is not None:
+            stats['strategies'] = strategies.stats()
+        guard = getattr(self.downloader, 'guard', None)
+        if guard is not None:
+            stats['upstream'] = guard.stats()
+        egress = getattr(self.downloader.session, 'pool', None)
+        if egress is not None:
+            stats['egress'] = egress.stats()
+        return stats
+
+    def handle_line(self, line: str) -> None:
+        """Parse and dispatch a single request line"""
+        line = line.strip()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+        except ValueError as e:
+            self.write({'id': None, 'success': False, 'error': f'Invalid request: {str(e)}'})
+            return
+
+        request_id = request.get('id')
+        op = request.get('op', 'extract')
+
+        if op in ('ping', 'stats'):
+            self.write({'id': request_id, 'success': True, 'op': 'pong', 'data': self.stats()})
+        elif op == 'metrics':
+            if self.metrics is None:
+                self.write({'id': request_id, 'success': False, 'error': 'Metrics are disabled; start the worker with --timings'})
+            else:
+                self.write({'id': request_id, 'success': True, 'op': 'metrics', 'data': self.metrics.render()})
+        elif op == 'extract':
+            url = request.get('url')
+            if not url:
+                self.write({'id': request_id, 'success': False, 'error': 'URL is required'})
+                return
+            try:
+                timeout = float(request.get('timeout', self.timeout))
+            except (TypeError, ValueError):
+                timeout = self.timeout
+            try:
+                policy = FormatPolicy.from_dict(request.get('format'))
+            except (AttributeError, TypeError, ValueError) as e:
+                self.write({'id': request_id, 'success': False, 'error': f'Invalid format policy: {str(e)}'})
+                return
+            index = request.get('index')
+            if index is not None and (not isinstance(index, int) or isinstance(index, bool) or index < 1):
+                self.write({'id': request_id, 'success': False, 'error': 'index must be a positive integer'})
+                return
+            self.submit(request_id, url, timeout, policy, index)
+        else:
+            self.write({'id': request_id, 'success': False, 'error': f'Unknown op: {op}'})
+
+    def submit(self, request_id: Any, url: str, timeout: float, policy: Optional[FormatPolicy] = None,
+               index: Optional[int] = None) -> None:
+        """Run an extraction in the pool and answer once, on completion or timeout"""
+        answered = threading.Event()
+        answer_lock = threading.Lock()
+
+        def answer(message: Dict[str, Any], timed_out: bool = False) -> None:
+            with answer_lock:
+                if answered.is_set():
+                    return
+                answered.set()
+            with self._state_lock:
+                self._in_flight -= 1
+                self._served += 1
+                if timed_out:
+                    self._timeouts += 1
+            self.write({'id': request_id, **message})
+
+        def run() -> None:
+            try:
+                if answered.is_set():
+                    return
+                try:
+                    result = apply_format_policy(self.downloader.download_video(url, index=index), policy)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                timer.cancel()
+                answer(result)
+            finally:
+                with self._state_lock:
+                    self._backlog -= 1
+
+        timer = threading.Timer(timeout, answer,
+                                args=({'success': False, 'error': 'Extraction timeout'}, True))
+        timer.daemon = True
+
+        with self._state_lock:
+            overloaded = self._backlog >= self.max_backlog
+            if overloaded:
+                self._rejected += 1
+            else:
+                self._backlog += 1
+                self._in_flight += 1
+        if overloaded:
+            self.write({'id': request_id, 'success': False,
+                        'error': 'Worker is overloaded; retry later'})
+            return
+        timer.start()
+        self.executor.submit(run)
+
+    def serve(self, stream: IO[str]) -> None:
+        """Process request lines until EOF, then drain in-flight work"""
+        for line in stream:
+            self.handle_line(line)
+        self.executor.shutdown(wait=True)
+        if self.refresher is not None:
+            self.refresher.stop()
+
+
+def run_worker(downloader, concurrency: int = DEFAULT_CONCURRENCY,
+               timeout: float = DEFAULT_TIMEOUT, refresh_ahead: float = DEFAULT_REFRESH_LEAD) -> None:
+    """Serve newline-delimited JSON requests from stdin"""
+    worker = ExtractionWorker(downloader, concurrency=concurrency, timeout=timeout, refresh_ahead=refresh_ahead)
+    worker.write({'id': None, 'success': True, 'op': 'ready', 'data': worker.stats()})
+    worker.serve(sys.stdin)
@@ -30,11 +30,1077 @@ def test_instagram_downloader():
         from instagram_downloader_simple import SimpleInstagramDownloader
         downloader = SimpleInstagramDownloader()
         print("✓ Simple Instagram downloader can be instantiated")
+
+        # Every URL shape of a post maps to one canonical URL
+        from instagram_urls import DedupIndex, canonical_url
+        variants = [
+            'https://www.instagram.com/reel/C0ffee00001/?igshid=MzRlODBiNWFlZA==',
+            'https://instagram.com/reels/C0ffee00001',
+            'https://m.instagram.com/instafetch_demo/reel/C0ffee00001/?utm_source=ig_web_copy_link',
+            'instagr.am/reel/C0ffee00001/',
+            'https://www.instagram.com/p/C0ffee00001/',
+        ]
+        canonical = {canonical_url(url) for url in variants[:-1]}
+        if canonical != {'https://www.instagram.com/reel/C0ffee00001/'}:
+            print(f"✗ URL variants did not canonicalize to one URL: {canonical}")
+            return False
+        index = DedupIndex()
+        for url in variants + ['https://example.com/not-instagram']:
+            index.add(url)
+        index.add('https://www.instagram.com/p/C0ffee00001/?img_index=2')
+        if index.stats() != {'urls': 7, 'unique': 2, 'duplicates': 4, 'invalid': 1}:
+            print(f"✗ Dedup index miscounted: {index.stats()}")
+            return False
+
+        # /p/ and /reel/ links of one post are one job, as they are one cache entry
+        from instagram_jobs import job_key
+        if job_key(variants[0]) != job_key(variants[-1]):
+            print("✗ /p/ and /reel/ links got different job keys")
+            return False
+        print("✓ URL variants canonicalize and dedup to one post")
         return True
     except Exception as e:
         print(f"✗ Simple Instagram downloader failed: {e}")
         return False
 
+def test_standin_extraction():
+    """Test sync and async extraction against the local stand-in server"""
+    try:
+        from instagram_standin import StandInServer
+        from instagram_downloader_simple import SimpleInstagramDownloader
+
+        url = 'http://www.instagram.com/reel/video_jsonld/'
+        with StandInServer() as server:
+            downloader = SimpleInstagramDownloader()
+            downloader.session.proxies = {'http': server.url}
+            result = downloader.download_video(url)
+            if not result['success'] or not result['data']['video_url'].endswith('oe=6F3A2B10'):
+                print(f"✗ Stand-in extraction returned {result}")
+                return False
+            print("✓ Simple downloader extracts from the stand-in server")
+
+            # Each carousel item is served from the one cached page fetch
+            from instagram_cache import MetadataCache
+            downloader.cache = MetadataCache()
+            requests_before = server.requests
+            items = [downloader.download_video('http://www.instagram.com/p/carousel/', index=index)
+                     for index in (1, 2, 3)]
+            types = [item['data']['format'] for item in items if item['success']]
+            if types != ['mp4', 'jpg', 'mp4'] or server.requests - requests_before != 1:
+                print(f"✗ Carousel items were {types} after {server.requests - requests_before} fetches")
+                return False
+            downloader.cache = None
+            print("✓ Carousel items are all returned from a single fetch")
+
+            from instagram_downloader import InstagramDownloader
+            racing = InstagramDownloader(strategy_mode='race')
+            racing.session.proxies = {'http': server.url}
+            raced = racing.download_video(url)
+            if raced['data']['video_url'] != result['data']['video_url'] or racing.strategies.stats()['html']['wins'] != 1:
+                print(f"✗ Raced strategies returned {raced}")
+                return False
+            print("✓ Raced strategies return the first complete result")
+
+            import threading
+            import time
+            from concurrent.futures import ThreadPoolExecutor
+            from instagram_ratelimit import UpstreamGuard
+            from instagram_strategies import StrategyRunner
+
+            # A losing hedge stops at its next rate-limiter wait instead of calling upstream again
+            throttled = UpstreamGuard(rate=5, burst=1)
+            loser_calls = []
+
+            def slow(post_url):
+                while True:
+                    throttled.call(post_url, lambda: loser_calls.append(1))
+
+            def fast(post_url):
+                time.sleep(0.05)
+                return {'video_url': 'http://cdn.example/v.mp4'}
+
+            hedged = StrategyRunner([('slow', slow), ('fast', fast)], hedge_delay=0.01, deadline=2)
+            hedged.run(url)
+            calls_at_win = len(loser_calls)
+            time.sleep(0.5)
+            if hedged.in_flight() or hedged.stats()['slow']['cancelled'] != 1 or len(loser_calls) > calls_at_win + 1:
+                print(f"✗ Losing strategy kept running: {hedged.stats()['slow']}, {len(loser_calls) - calls_at_win} late calls")
+                return False
+
+            # Deadlines run from each attempt's start, so load can't queue attempts past them
+            busy = StrategyRunner([('sleepy', lambda post_url: time.sleep(0.3) or {'video_url': 'v'})], deadline=0.5)
+            with ThreadPoolExecutor(max_workers=64) as pool:
+                loaded = list(pool.map(lambda _: busy.run(url), range(64)))
+            if not all(result.get('video_url') for result in loaded):
+                print("✗ Concurrent runs missed their deadline")
+                return False
+
+            # Hedges are skipped once max_in_flight attempts are running
+            release = threading.Event()
+            capped = StrategyRunner([('stuck', lambda post_url: release.wait() and {}),
+                                     ('hedge', lambda post_url: {'video_url': 'v'})],
+                                    hedge_delay=0.01, deadline=0.2, max_in_flight=1)
+            try:
+                capped.run(url)
+            except Exception:
+                pass
+            release.set()
+            if capped.stats()['hedge']['attempts']:
+                print(f"✗ Hedge ran past max_in_flight: {capped.stats()}")
+                return False
+            print("✓ Hedged losers are cancelled, deadlines hold under load, hedges are capped")
+
+            from instagram_metrics import Instrumentation, MetricsRegistry
+            downloader.instrumentation = Instrumentation(MetricsRegistry())
+            timed = downloader.download_video('http://www.instagram.com/p/video_og/')
+            stages = timed.get('timings', {}).get('stages_ms', {})
+            if not {'url_parse', 'ttfb', 'download', 'parse'} <= set(stages) or not timed['timings']['bytes_read']:
+                print(f"✗ Timings block incomplete: {timed.get('timings')}")
+                return False
+            downloader.instrumentation = None
+            print("✓ Per-stage timings are recorded when instrumentation is on")
+
+            try:
+                import aiohttp
+            except ImportError:
+                print("⚠ aiohttp not found, skipping async engine (optional)")
+                return True
+
+            import asyncio
+            from instagram_downloader_async import AsyncInstagramDownloader
+
+            async def extract():
+                async with AsyncInstagramDownloader(proxy=server.url) as async_downloader:
+                    return await async_downloader.download_video(url)
+
+            async_result = asyncio.run(extract())
+            if async_result != result:
+                print(f"✗ Async engine returned {async_result}")
+                return False
+            print("✓ Async engine matches the simple downloader")
+        return True
+    except Exception as e:
+        print(f"✗ Stand-in extraction failed: {e}")
+        return False
+
+def test_media_download():
+    """Test ranged, resumable media downloads against the local stand-in server"""
+    try:
+        import os
+        import tempfile
+        from instagram_media import MediaDownloader
+        from instagram_standin import StandInServer, media_bytes
+
+        size = 5 * 1024 * 1024 + 17
+        with StandInServer() as server, tempfile.TemporaryDirectory() as directory:
+            url = f'{server.url}/media/{size}.mp4'
+            path = os.path.join(directory, 'video.mp4')
+
+            # Pretend an earlier run finished the first chunk only
+            media = MediaDownloader(connections=4, chunk_size=1024 * 1024)
+            with open(path, 'wb') as f:
+                f.write(media_bytes(1024 * 1024))
+            media._save_state(path + '.part.json', size, {0})
+
+            info = media.download(url, path, expected_size=size)
+            with open(path, 'rb') as f:
+                if f.read() != media_bytes(size) or info['resumed_bytes'] != 1024 * 1024:
+                    print(f"✗ Media download produced the wrong file: {info}")
+                    return False
+            print("✓ Media downloads resume and reassemble ranged chunks")
+
+            # Two items of one carousel saved into one directory at once keep separate files
+            from concurrent.futures import ThreadPoolExecutor
+            from instagram_downloader_simple import SimpleInstagramDownloader
+            from instagram_media import save_media
+
+            downloader = SimpleInstagramDownloader()
+            downloader.session.proxies = {'http': server.url}
+            media = MediaDownloader(downloader.session, connections=2, chunk_size=256 * 1024)
+            sizes = {1: 1024 * 1024 + 1, 3: 768 * 1024 + 3}
+            items = []
+            for index, item_size in sizes.items():
+                item = downloader.download_video('http://www.instagram.com/p/carousel/', index=index)
+                # The fixture's CDN URLs are not served offline; point each item at stand-in media
+                items.append({**item, 'data': {**item['data'], 'video_url': f'{server.url}/media/{item_size}.mp4'}})
+            with ThreadPoolExecutor(2) as pool:
+                saved = list(pool.map(lambda item: save_media(media, item, directory), items))
+            files = [result['data']['file'] for result in saved if result['success']]
+            paths = [info['path'] for info in files]
+            if len(set(paths)) != 2 or [os.path.getsize(path) for path in paths] != list(sizes.values()) \
+                    or any(name.endswith('.part.json') for name in os.listdir(directory)):
+                print(f"✗ Carousel items were saved as {paths}")
+                return False
+            print(f"✓ Carousel items are saved side by side ({', '.join(os.path.basename(path) for path in paths)})")
+
+            # A batch into a directory that does not exist yet still gets one file per post
+            from instagram_cache import MetadataCache
+            from instagram_urls import parse_url
+
+            downloader.cache = MetadataCache()
+            posts = {'http://www.instagram.com/p/video_og/': 300 * 1024 + 1,
+                     'http://www.instagram.com/reel/video_jsonld/': 200 * 1024 + 7}
+            for post_url, post_size in posts.items():
+                extracted = downloader.download_video(post_url)
+                downloader.cache.put(parse_url(post_url).shortcode, {
+                    **extracted, 'data': {**extracted['data'], 'video_url': f'{server.url}/media/{post_size}.mp4'}})
+            batch_dir = os.path.join(directory, 'new', 'posts')
+            batch = dict(downloader.download_videos(posts, max_workers=2, output_dir=batch_dir))
+            batch_paths = {result['data']['file']['path'] for result in batch.values() if result['success']}
+            if len(batch_paths) != 2 or any(os.path.dirname(path) != batch_dir for path in batch_paths) \
+                    or sorted(os.path.getsize(path) for path in batch_paths) != sorted(posts.values()):
+                print(f"✗ Batch into a new directory saved {batch_paths}")
+                return False
+            print("✓ Batch downloads create their output directory and save one file per post")
+        return True
+    except Exception as e:
+        print(f"✗ Media download failed: {e}")
+        return False
+
+def test_cold_start():
+    """Test that the CLI scripts start within the import-time budget"""
+    try:
+        from benchmark_startup import SCRIPTS, STARTUP_BUDGET_MS, check_startup
+
+        success = True
+        for script in SCRIPTS:
+            result = check_startup(script)
+            if result['heavy_modules']:
+                print(f"✗ {script} loads {', '.join(result['heavy_modules'])} to reject an invalid URL")
+                success = False
+            elif not result['ok']:
+                print(f"✗ {script} imports in {result['import_ms']} ms (budget {STARTUP_BUDGET_MS:.0f} ms)")
+                success = False
+            else:
+                print(f"✓ {script} imports in {result['import_ms']} ms")
+        return success
+    except Exception as e:
+        print(f"✗ Cold-start check failed: {e}")
+        return False
+
+def test_upstream_protection():
+    """Test retries, the circuit breaker and stale serving against a failing stand-in"""
+    try:
+        import time
+        from instagram_cache import MetadataCache
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_ratelimit import UpstreamGuard
+        from instagram_standin import StandInServer
+
+        url = 'http://www.instagram.com/p/video_og/'
+        with StandInServer(error_rate=0.5, error_status=503, seed=3) as server:
+            downloader = SimpleInstagramDownloader(cache=MetadataCache(ttl=0.01, max_ttl=0.01))
+            downloader.guard = UpstreamGuard(rate=100, backoff_base=0.01, max_retries=5,
+                                             failure_threshold=3, recovery_timeout=60)
+            downloader.session.proxies = {'http': server.url}
+
+            # Half the responses fail; retries should still get every request through
+            results = [downloader.download_video(url) for _ in range(5)]
+            if not all(result['success'] for result in results):
+                print(f"✗ Retries did not recover from 503s: {results}")
+                return False
+            print(f"✓ Retries recovered from {server.errors} injected 503s")
+
+            # A failing host opens the breaker, after which the expired result is served stale
+            server.error_rate = 1.0
+            time.sleep(0.02)
+            results = [downloader.download_video(url) for _ in range(3)]
+            host = downloader.guard.stats()['www.instagram.com']
+            if host['breaker']['state'] != 'open' or not results[-1].get('stale'):
+                print(f"✗ Circuit breaker did not open and serve stale results: {host['breaker']}")
+                return False
+            print(f"✓ Circuit breaker opened and served a stale result ({host['breaker']['rejected']} rejected)")
+        return True
+    except Exception as e:
+        print(f"✗ Upstream protection check failed: {e}")
+        return False
+
+def test_profile_crawl():
+    """Test a checkpointed profile crawl that is stopped and resumed"""
+    try:
+        import io
+        import json
+        import os
+        import tempfile
+        from instagram_crawl import run_crawl
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_ratelimit import UpstreamGuard
+        from instagram_standin import StandInServer
+
+        profile = 'http://www.instagram.com/standin/'
+        with StandInServer(profile_posts=30) as server, tempfile.TemporaryDirectory() as tmp:
+            downloader = SimpleInstagramDownloader()
+            downloader.guard = UpstreamGuard(rate=1000, burst=100)
+            downloader.session.proxies = {'http': server.url}
+            checkpoint = os.path.join(tmp, 'standin.jsonl')
+
+            # Stop part way through the second page, then resume from the checkpoint
+            first, second = io.StringIO(), io.StringIO()
+            run_crawl(downloader, profile, checkpoint, max_workers=4, limit=17, output=first)
+            fetched = server.requests - server.feed_requests
+            run_crawl(downloader, profile, checkpoint, max_workers=4, output=second)
+            lines = [json.loads(line) for line in (first.getvalue() + second.getvalue()).splitlines()]
+            urls = {line['url'] for line in lines}
+            post_fetches = server.requests - server.feed_requests
+            if len(lines) != 30 or len(urls) != 30 or fetched != 17 or post_fetches != 30:
+                print(f"✗ Resumed crawl returned {len(lines)} lines for {len(urls)} posts "
+                      f"after {post_fetches} post fetches")
+                return False
+            print(f"✓ Crawl resumed from its checkpoint without refetching ({server.feed_requests} feed pages)")
+
+        # Posts that failed are not done: resuming once upstream is healthy fetches them again
+        with StandInServer(profile_posts=30, error_rate=0.5, seed=5, error_paths=r'^/(p|reel)/') as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            downloader = SimpleInstagramDownloader()
+            downloader.guard = UpstreamGuard(rate=1000, burst=100, max_retries=0, failure_threshold=1000)
+            downloader.session.proxies = {'http': server.url}
+            checkpoint = os.path.join(tmp, 'standin.jsonl')
+
+            first, second = io.StringIO(), io.StringIO()
+            run_crawl(downloader, profile, checkpoint, max_workers=4, output=first)
+            failed = {line['url'] for line in map(json.loads, first.getvalue().splitlines())
+                      if not line['success'] and line['url'] != profile}
+            server.error_rate = 0.0
+            run_crawl(downloader, profile, checkpoint, max_workers=4, output=second)
+            lines = [json.loads(line) for line in (first.getvalue() + second.getvalue()).splitlines()]
+            extracted = {line['url'] for line in lines if line['success']}
+            retried = {line['url'] for line in map(json.loads, second.getvalue().splitlines()) if line['success']}
+            if not failed or len(extracted) != 30 or not failed <= retried:
+                print(f"✗ Resumed crawl extracted {len(extracted)} posts; "
+                      f"{len(failed - retried)} of {len(failed)} failed posts were not retried")
+                return False
+            print(f"✓ Resumed crawl retried every failed post ({len(failed)} of 30)")
+        return True
+    except Exception as e:
+        print(f"✗ Profile crawl check failed: {e}")
+        return False
+
+def test_job_runner():
+    """Test the durable multi-process job runner, including recovery of a crashed claim"""
+    try:
+        import io
+        import json
+        import os
+        import tempfile
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_jobs import JobQueue, run_jobs
+        from instagram_standin import StandInServer
+
+        urls = [f'http://www.instagram.com/p/{name}/' for name in ('video_og', 'video_jsonld', 'carousel', 'no_video')]
+        urls.append('http://instagram.com/p/video_og/?igshid=abc')
+        with StandInServer() as server, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'jobs.sqlite')
+            # A job claimed by a process that died must be run again
+            queue = JobQueue(path)
+            queue.enqueue(urls)
+            queue.claim('crashed', 1)
+            queue.close()
+
+            # Worker processes inherit the proxy from the environment
+            proxy = os.environ.get('http_proxy')
+            os.environ['http_proxy'] = server.url
+            try:
+                output = io.StringIO()
+                counts = run_jobs(path, SimpleInstagramDownloader, processes=2, threads=2,
+                                  output=output, report_interval=0.2)
+                rerun = io.StringIO()
+                run_jobs(path, SimpleInstagramDownloader, urls=urls, processes=2, output=rerun, report_interval=0.2)
+            finally:
+                if proxy is None:
+                    del os.environ['http_proxy']
+                else:
+                    os.environ['http_proxy'] = proxy
+
+            results = [json.loads(line) for line in output.getvalue().splitlines()]
+            if counts['done'] != 4 or len(results) != 4 or not all(r['success'] for r in results) \
+                    or rerun.getvalue() or server.requests != 4:
+                print(f"✗ Job runner finished with {counts} after {server.requests} fetches")
+                return False
+            print(f"✓ Job runner recovered a crashed claim and finished {counts['done']} jobs once each")
+        return True
+    except Exception as e:
+        print(f"✗ Job runner check failed: {e}")
+        return False
+
+def test_expiry_refresh():
+    """Test cache lifetimes from signed URL expiry and refreshing hot entries before it"""
+    try:
+        import time
+        from instagram_cache import CacheRefresher, MetadataCache, media_expiry
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_standin import StandInServer
+
+        with StandInServer(url_lifetime=3) as server:
+            cache = MetadataCache(expiry_margin=1)
+            downloader = SimpleInstagramDownloader(cache=cache)
+            downloader.session.proxies = {'http': server.url}
+
+            hot, cold = 'http://www.instagram.com/p/video_og/', 'http://www.instagram.com/reel/video_jsonld/'
+            first = downloader.download_video(hot)
+            downloader.download_video(cold)
+            ttl = cache.ttl_for(first)
+            if not 0 < ttl <= 2:
+                print(f"✗ Cache lifetime {ttl:.1f}s does not follow the URL expiry")
+                return False
+            print(f"✓ Results are cached until shortly before their URLs expire ({ttl:.1f}s)")
+
+            downloader.download_video(hot)
+            downloader.download_video(hot)
+            # Inside the refresh lead but short of expiry; expired entries are never refreshed
+            time.sleep(max(0.0, ttl - 1.0))
+            requests_before = server.requests
+            refresher = CacheRefresher(cache, lead=1.5, min_hits=2)
+            refreshed = refresher.run_once()
+            warm = downloader.download_video(hot)
+            if refreshed != 1 or server.requests - requests_before != 1 \
+                    or media_expiry(warm) <= media_expiry(first):
+                print(f"✗ Refresher refreshed {refreshed} entries: {refresher.stats()}")
+                return False
+            print("✓ Hot entries are re-extracted before expiry and served warm")
+
+            # A refresh racing a miss on the same post shares its single-flight extraction
+            import threading
+            downloader.download_video(hot)
+            refresh = next(refresh for key, refresh in cache.due_for_refresh(lead=60, min_hits=1) if key == 'video_og')
+            cache.clear()
+            server.latency = 0.3
+            requests_before = server.requests
+            background = threading.Thread(target=refresh)
+            background.start()
+            time.sleep(0.05)
+            missed = downloader.download_video(hot)
+            background.join()
+            server.latency = 0.0
+            if server.requests - requests_before != 1 or not missed['success']:
+                print(f"✗ Refresh and miss made {server.requests - requests_before} upstream fetches")
+                return False
+            print("✓ A background refresh and a concurrent miss share one extraction")
+
+            # A refresh that fails is not retried every pass, and expired entries are never refreshed
+            from instagram_ratelimit import UpstreamGuard
+            failing = MetadataCache(expiry_margin=1)
+            flaky = SimpleInstagramDownloader(cache=failing)
+            flaky.guard = UpstreamGuard(rate=1000, burst=100, max_retries=0, failure_threshold=1000)
+            flaky.session.proxies = {'http': server.url}
+            for _ in range(3):
+                flaky.download_video(hot)
+            server.error_rate = 1.0
+            requests_before = server.requests
+            refresher = CacheRefresher(failing, lead=60, min_hits=2)
+            for _ in range(3):
+                refresher.run_once()
+            server.error_rate = 0.0
+            expiring = f'https://scontent.cdninstagram.com/v.mp4?oe={int(time.time()) + 2:08x}'
+            failing.get_or_extract('expiring', lambda: {'success': True, 'data': {'video_url': expiring}})
+            failing.get('expiring')
+            time.sleep(1.1)
+            if server.requests - requests_before != 1 or refresher.stats()['failed'] != 1 \
+                    or failing.due_for_refresh(lead=60, min_hits=1):
+                print(f"✗ Failed or expired entries kept being refreshed: {refresher.stats()}")
+                return False
+            print("✓ Failed refreshes back off and expired entries are not refreshed")
+
+        # The on-disk tier is bounded like the LRU, including rows left by an earlier run
+        import os
+        import sqlite3
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            disk = MetadataCache(max_entries=2, path=path)
+            for number in range(5):
+                disk.put(f'post{number}', {'success': True, 'data': {'id': f'post{number}'}})
+            disk.close()
+            MetadataCache(max_entries=1, path=path).close()
+            db = sqlite3.connect(path)
+            rows = [row[0] for row in db.execute('SELECT key FROM metadata_cache')]
+            db.close()
+            if rows != ['post4']:
+                print(f"✗ On-disk cache was not bounded by max_entries: {rows}")
+                return False
+            print("✓ The on-disk cache tier is bounded by max_entries")
+        return True
+    except Exception as e:
+        print(f"✗ Expiry-aware cache check failed: {e}")
+        return False
+
+def test_media_store():
+    """Test the content-addressed media store, its eviction and the thumbnail proxy"""
+    try:
+        import os
+        import tempfile
+        import requests
+        from instagram_media import MediaDownloader, save_media
+        from instagram_standin import StandInServer
+        from instagram_store import MediaStore, ThumbnailProxy
+
+        cdn = 'http://scontent.cdninstagram.com'
+        with StandInServer() as server, tempfile.TemporaryDirectory() as tmp:
+            session = requests.Session()
+            session.proxies = {'http': server.url}
+            store = MediaStore(os.path.join(tmp, 'store'), max_bytes=400000)
+            media = MediaDownloader(session, store=store)
+
+            # A re-signed URL of a stored asset is linked without a fetch; a repost is stored once
+            sources = {'a': f'{cdn}/v1/media/300000.mp4?oe=1', 'b': f'{cdn}/v1/media/300000.mp4?oe=2',
+                       'c': f'{cdn}/v2/media/300000.mp4?oe=1'}
+            files = {}
+            for name, url in sources.items():
+                before = server.requests
+                result = save_media(media, {'success': True, 'data': {'id': name, 'video_url': url}}, tmp)
+                files[name] = result['data']['file']
+                files[name]['requests'] = server.requests - before
+            inodes = {os.stat(info['path']).st_ino for info in files.values()}
+            stats = store.stats()
+            if len(inodes) != 1 or files['b']['requests'] or not files['b'].get('from_store') \
+                    or stats['objects'] != 1 or stats['deduplicated'] != 1:
+                print(f"✗ Media store did not deduplicate: {files} {stats}")
+                return False
+            print("✓ Media store links re-signed URLs and reposts to one stored file")
+
+            save_media(media, {'success': True, 'data': {'id': 'd', 'video_url': f'{cdn}/v3/media/200000.mp4'}}, tmp)
+            stats = store.stats()
+            if stats['evictions'] != 1 or stats['bytes'] != 200000 or not os.path.exists(files['a']['path']):
+                print(f"✗ Media store did not evict down to its size bound: {stats}")
+                return False
+            print("✓ Least recently used media is evicted past the size bound")
+
+            with ThumbnailProxy(store, session=session) as proxy:
+                thumb = f'{proxy.url}/thumb?url={requests.utils.quote(cdn + "/t/media/4096.mp4?oe=1", safe="")}'
+                before = server.requests
+                first = requests.get(thumb)
+                again = requests.get(thumb, headers={'If-None-Match': first.headers.get('ETag', '')})
+                refused = requests.get(f'{proxy.url}/thumb?url=http://example.com/x.jpg')
+            if first.status_code != 200 or len(first.content) != 4096 or again.status_code != 304 \
+                    or 'immutable' not in first.headers.get('Cache-Control', '') \
+                    or server.requests - before != 1 or refused.status_code != 400:
+                print(f"✗ Thumbnail proxy returned {first.status_code}/{again.status_code}/{refused.status_code}")
+                return False
+            print("✓ Thumbnail proxy fetches once and serves from disk with an ETag")
+            store.close()
+        return True
+    except Exception as e:
+        print(f"✗ Media store check failed: {e}")
+        return False
+
+def test_egress_pool():
+    """Test routing around blocked and slow egress proxies, and recovery from quarantine"""
+    try:
+        import time
+        from contextlib import ExitStack
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_egress import EgressPool
+        from instagram_ratelimit import UpstreamGuard
+        from instagram_standin import StandInServer
+
+        with ExitStack() as stack:
+            blocked = stack.enter_context(StandInServer(error_rate=1.0, error_status=429))
+            slow = stack.enter_context(StandInServer(latency=0.1))
+            healthy = stack.enter_context(StandInServer())
+            pool = EgressPool([blocked.url, slow.url, healthy.url], quarantine=3)
+            downloader = SimpleInstagramDownloader()
+            downloader.session = pool.session(template=downloader.session)
+            downloader.guard = UpstreamGuard(rate=1000, burst=100)
+
+            results = [downloader.download_video('http://www.instagram.com/p/video_og/') for _ in range(10)]
+            egresses = pool.stats()['egresses']
+            if not all(result['success'] for result in results) or blocked.requests != 1 \
+                    or egresses[blocked.url]['quarantines'] != 1 or healthy.requests <= slow.requests:
+                print(f"✗ Egress pool did not route around bad proxies: {egresses}")
+                return False
+            print(f"✓ Egress pool quarantined a blocked proxy and preferred the fastest "
+                  f"({healthy.requests} healthy / {slow.requests} slow requests)")
+
+            blocked.error_rate = 0.0
+            time.sleep(egresses[blocked.url]['quarantined_for'] + 0.1)
+            downloader.download_video('http://www.instagram.com/reel/video_jsonld/')
+            egress = pool.stats()['egresses'][blocked.url]
+            if egress['successes'] != 1 or egress['quarantined_for']:
+                print(f"✗ Blocked proxy did not recover after its quarantine: {egress}")
+                return False
+            print("✓ A quarantined proxy is probed and recovers once unblocked")
+
+        # A 403 or a login wall from one proxy fails over; the host breaker never hears of it
+        with ExitStack() as stack:
+            forbidden = stack.enter_context(StandInServer(error_rate=1.0, error_status=403))
+            login_wall = stack.enter_context(StandInServer(error_rate=1.0, error_status=302))
+            healthy = stack.enter_context(StandInServer())
+            pool = EgressPool([forbidden.url, login_wall.url, healthy.url], quarantine=60)
+            downloader = SimpleInstagramDownloader()
+            downloader.session = pool.session(template=downloader.session)
+            downloader.guard = UpstreamGuard(rate=1000, burst=100)
+
+            results = [downloader.download_video('http://www.instagram.com/p/video_og/') for _ in range(6)]
+            stats = pool.stats()
+            host = downloader.guard.stats()['www.instagram.com']
+            if not all(result['success'] for result in results) or host['failures'] \
+                    or host['breaker']['state'] != 'closed' or healthy.requests != 6 \
+                    or stats['egresses'][forbidden.url]['blocks'] != 1 \
+                    or stats['egresses'][login_wall.url]['blocks'] != 1:
+                print(f"✗ Blocked proxies reached the host breaker: {host['breaker']} {stats}")
+                return False
+            print(f"✓ 403 and login-wall proxies failed over without tripping the breaker "
+                  f"({stats['failovers']} failovers)")
+
+        # A 403 from the CDN is an expired URL, not a burned egress
+        with ExitStack() as stack:
+            cdns = [stack.enter_context(StandInServer(error_rate=1.0, error_status=403, error_paths='/media/'))
+                    for _ in range(2)]
+            pool = EgressPool([cdn.url for cdn in cdns])
+            response = pool.session().get('http://scontent.cdninstagram.com/v/media/100.mp4?oe=1')
+            stats = pool.stats()
+            if response.status_code != 403 or stats['failovers'] \
+                    or any(egress['quarantines'] for egress in stats['egresses'].values()):
+                print(f"✗ A CDN 403 quarantined egresses: {stats}")
+                return False
+            print("✓ A CDN 403 is not scored as a block")
+        return True
+    except Exception as e:
+        print(f"✗ Egress pool check failed: {e}")
+        return False
+
+def test_worker_protocol():
+    """Test the NDJSON worker protocol the Node pool speaks, over a real worker process"""
+    import os
+    import queue
+    import subprocess
+    import threading
+
+    worker = None
+    try:
+        from instagram_standin import StandInServer
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instagram_downloader_simple.py')
+        with StandInServer(latency=0.3) as server:
+            worker = subprocess.Popen([sys.executable, script, '--worker', '--concurrency', '1', '--proxy', server.url],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            lines: 'queue.Queue' = queue.Queue()
+            threading.Thread(target=lambda: [lines.put(json.loads(line)) for line in worker.stdout], daemon=True).start()
+            if lines.get(timeout=10).get('op') != 'ready':
+                print("✗ Worker did not announce it was ready")
+                return False
+
+            def send(request):
+                worker.stdin.write((request if isinstance(request, str) else json.dumps(request)) + '\n')
+                worker.stdin.flush()
+
+            send('not json')
+            send({'id': 'ping', 'op': 'ping'})
+            send({'id': 'bad', 'url': 'https://example.com/not-a-post'})
+            send({'id': 'ok', 'url': 'http://www.instagram.com/p/video_og-1/'})
+            send({'id': 'slow', 'url': 'http://www.instagram.com/p/video_og-2/', 'timeout': 0.05})
+            # One concurrency slot accepts 8 extractions; the rest are refused at once
+            flood = [f'flood-{n}' for n in range(10)]
+            for n, request_id in enumerate(flood):
+                send({'id': request_id, 'url': f'http://www.instagram.com/p/video_og-{10 + n}/', 'timeout': 0.05})
+
+            expected = {None, 'ping', 'bad', 'ok', 'slow', *flood}
+            replies = {}
+            while not expected <= set(replies):
+                reply = lines.get(timeout=15)
+                if reply['id'] in replies:
+                    print(f"✗ Request {reply['id']} was answered twice")
+                    return False
+                replies[reply['id']] = reply
+
+            refused = [request_id for request_id in flood if replies[request_id].get('error') == 'Worker is overloaded; retry later']
+            if replies[None]['success'] or replies['ping'].get('op') != 'pong' or replies['bad']['success'] \
+                    or not replies['ok']['success'] or replies['slow'].get('error') != 'Extraction timeout':
+                print(f"✗ Worker replies were {replies}")
+                return False
+            if not refused or any(replies[request_id].get('error') != 'Extraction timeout'
+                                  for request_id in flood if request_id not in refused):
+                print(f"✗ Flooded worker replied {[replies[request_id].get('error') for request_id in flood]}")
+                return False
+            print(f"✓ Worker answers ping, times out slow requests and refuses {len(refused)} past its backlog")
+            print("✓ A failed or malformed request leaves the others in the same worker unaffected")
+
+            worker.stdin.close()
+            worker.wait(timeout=30)
+        return True
+    except Exception as e:
+        print(f"✗ Worker protocol test failed: {e}")
+        return False
+    finally:
+        if worker is not None and worker.poll() is None:
+            worker.kill()
+
+def test_format_selection():
+    """Test format policies and carousel item selection on a synthetic format index"""
+    try:
+        from instagram_formats import FormatPolicy, apply_format_policy, build_format_index, select_media
+
+        def fmt(format_id, ext, height, vcodec='avc1', acodec='mp4a', **extra):
+            return {'format_id': format_id, 'url': f'https://cdn.example/{format_id}.{ext}', 'ext': ext,
+                    'height': height, 'width': height * 9 // 16, 'vcodec': vcodec, 'acodec': acodec, **extra}
+
+        # yt-dlp lists the webm first; 720-approx only has a bitrate (2000 kbit/s over 20 s is 5 MB)
+        index = build_format_index([
+            fmt('1080-webm', 'webm', 1080, vcodec='vp9', acodec='opus', filesize=9000000),
+            fmt('1080', 'mp4', 1080, filesize=8000000),
+            fmt('720', 'mp4', 720, filesize=4000000),
+            fmt('720-approx', 'mp4', 720, tbr=2000),
+            fmt('480', 'mp4', 480, filesize=2000000),
+            fmt('audio-high', 'm4a', 0, vcodec='none', tbr=128),
+            fmt('audio-low', 'm4a', 0, vcodec='none', tbr=64),
+        ], duration=20)
+
+        cases = [
+            (FormatPolicy(), '1080'),
+            (FormatPolicy(max_height=720), '720'),
+            (FormatPolicy(max_bytes=3000000), '480'),
+            (FormatPolicy(max_bytes=4500000), '720'),
+            (FormatPolicy(target_height=600), '720'),
+            (FormatPolicy(target_height=2160), '1080'),
+            (FormatPolicy(audio_only=True), 'audio-high'),
+            (FormatPolicy(max_height=100), None),
+        ]
+        for policy, expected in cases:
+            picked = policy.select(index)
+            if (picked and picked['format_id']) != expected:
+                print(f"✗ {policy.as_dict() or 'default'} picked {picked and picked['format_id']}, not {expected}")
+                return False
+        webm_only = [entry for entry in index if entry['ext'] == 'webm']
+        if FormatPolicy(max_height=1080).select(webm_only)['format_id'] != '1080-webm':
+            print("✗ A non-mp4 format was rejected when it was the only one that qualified")
+            return False
+
+        result = {'success': True, 'data': {'id': 'post', 'video_url': index[1]['url'], 'formats': index}}
+        reselected = apply_format_policy(result, FormatPolicy.from_dict({'max_height': 480}))
+        refused = apply_format_policy(result, FormatPolicy(max_height=100))
+        if reselected['data']['video_url'] != 'https://cdn.example/480.mp4' or reselected['data']['quality'] != '480p' \
+                or result['data']['video_url'] != index[1]['url'] or refused['success']:
+            print(f"✗ Applying a policy returned {reselected['data'].get('video_url')} / {refused}")
+            return False
+        print("✓ Format policies pick by height, size, target and audio, preferring mp4")
+
+        media = [{'type': 'video', 'url': index[1]['url'], 'height': 1080},
+                 {'type': 'image', 'url': 'https://cdn.example/2.jpg', 'width': 1080, 'height': 1350},
+                 {'type': 'video', 'url': 'https://cdn.example/3.mp4', 'height': 640, 'duration': 7}]
+        carousel = {'success': True, 'data': {**result['data'], 'media': media, 'filesize': 8000000}}
+        first, image, video = (select_media(carousel, n)['data'] for n in (1, 2, 3))
+        if first.get('formats') != index or first['media_index'] != 1 \
+                or image['format'] != 'jpg' or image['video_url'] != media[1]['url'] or 'formats' in image \
+                or video['quality'] != '640p' or video['duration'] != 7 or video['filesize'] != 0:
+            print(f"✗ Carousel selection returned {first}, {image}, {video}")
+            return False
+        if select_media(carousel, 4)['success'] or select_media(result, 2)['success'] \
+                or select_media(result, 1) is not result or select_media(carousel, None) is not carousel:
+            print("✗ Out-of-range or missing carousel indexes were not handled")
+            return False
+        print("✓ Carousel items are selected by index, keeping the format index only for the first video")
+        return True
+    except Exception as e:
+        print(f"✗ Format selection test failed: {e}")
+        return False
+
+def test_single_flight():
+    """Test that concurrent callers of one key share a single upstream call"""
+    try:
+        import asyncio
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from instagram_singleflight import AsyncSingleFlight, SingleFlight
+
+        callers = 8
+        flight = SingleFlight()
+        upstream_calls = []
+
+        def wait_for_waiters(collapsed):
+            # Hold the leader until every other caller has joined its call
+            deadline = time.monotonic() + 5
+            while flight.stats()['collapsed'] < collapsed and time.monotonic() < deadline:
+                time.sleep(0.005)
+
+        def fetch():
+            upstream_calls.append(1)
+            wait_for_waiters(callers - 1)
+            return {'calls': len(upstream_calls)}
+
+        def fail():
+            upstream_calls.append(1)
+            wait_for_waiters(2 * (callers - 1))
+            raise RuntimeError('upstream down')
+
+        def run(fn):
+            barrier = threading.Barrier(callers)
+
+            def caller(_):
+                barrier.wait()
+                try:
+                    return flight.do('post', fn)
+                except RuntimeError as e:
+                    return e
+
+            with ThreadPoolExecutor(callers) as pool:
+                return list(pool.map(caller, range(callers)))
+
+        shared = run(fetch)
+        errors = run(fail)
+        if len(upstream_calls) != 2 or any(result is not shared[0] for result in shared) \
+                or any(error is not errors[0] or not isinstance(error, RuntimeError) for error in errors):
+            print(f"✗ {callers} concurrent callers made {len(upstream_calls)} upstream calls for 2 keys")
+            return False
+        if flight.stats() != {'calls': 2 * callers, 'executions': 2, 'collapsed': 2 * (callers - 1), 'in_flight': 0}:
+            print(f"✗ Single-flight counters were {flight.stats()}")
+            return False
+        print(f"✓ {callers} concurrent callers shared one call and its exception")
+
+        async def coalesce():
+            async_flight = AsyncSingleFlight()
+            async_calls = []
+
+            async def fetch_async():
+                async_calls.append(1)
+                await asyncio.sleep(0.05)
+                return {'calls': len(async_calls)}
+
+            async def fail_async():
+                async_calls.append(1)
+                await asyncio.sleep(0.05)
+                raise RuntimeError('upstream down')
+
+            results = await asyncio.gather(*(async_flight.do('post', fetch_async) for _ in range(callers)))
+            failures = await asyncio.gather(*(async_flight.do('post', fail_async) for _ in range(callers)),
+                                            return_exceptions=True)
+            # A waiter that gives up must not cancel the call the others are sharing
+            impatient = asyncio.ensure_future(async_flight.do('slow', fetch_async))
+            patient = asyncio.ensure_future(async_flight.do('slow', fetch_async))
+            await asyncio.sleep(0)
+            impatient.cancel()
+            survived = await patient
+            return async_calls, results, failures, survived, async_flight.stats()
+
+        async_calls, results, failures, survived, stats = asyncio.run(coalesce())
+        if len(async_calls) != 3 or any(result is not results[0] for result in results) \
+                or not all(isinstance(error, RuntimeError) for error in failures) or survived != {'calls': 3} \
+                or stats != {'calls': 2 * callers + 2, 'executions': 3, 'collapsed': 2 * callers - 1, 'in_flight': 0}:
+            print(f"✗ Async single-flight made {len(async_calls)} calls: {stats}")
+            return False
+        print("✓ Async callers share one task, its exception, and survive a cancelled waiter")
+        return True
+    except Exception as e:
+        print(f"✗ Single-flight test failed: {e}")
+        return False
+
+def test_streaming_fetch():
+    """Test that streamed page reads stop at the metadata and at the byte cap"""
+    try:
+        import os
+        import shutil
+        import tempfile
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_http import fetch_video_info
+        from instagram_metrics import Timings, run_with_timings
+        from instagram_parser import PageTooLarge
+        from instagram_standin import FIXTURES_DIR, StandInServer
+
+        cap = 64 * 1024
+        with open(os.path.join(FIXTURES_DIR, 'video_og.html'), encoding='utf-8') as f:
+            page = f.read()
+        filler = '<div>' + 'x' * 1024 + '</div>\n'
+        with tempfile.TemporaryDirectory() as fixtures:
+            shutil.copy(os.path.join(FIXTURES_DIR, 'video_og.html'), fixtures)
+            pages = {
+                # 2 MB of body after a complete <head>
+                'padded': page.replace('</body>', filler * 2048 + '</body>'),
+                # A <head> that never ends, with and without a media URL before the cap
+                'bloated': '<html><head><title>Post</title>\n' + filler * 512,
+                'bloated_video': page.replace('</head>', filler * 512),
+            }
+            for name, html in pages.items():
+                with open(os.path.join(fixtures, f'{name}.html'), 'w', encoding='utf-8') as f:
+                    f.write(html)
+
+            with StandInServer(fixtures_dir=fixtures) as server:
+                downloader = SimpleInstagramDownloader(max_bytes=cap)
+                downloader.session.proxies = {'http': server.url}
+
+                def fetch(name):
+                    timings = Timings()
+                    url = f'http://www.instagram.com/p/{name}/'
+                    video_info = run_with_timings(timings, lambda: fetch_video_info(
+                        downloader.session, url, name, timeout=10, max_bytes=cap))
+                    return video_info, timings.bytes_read
+
+                padded, padded_read = fetch('padded')
+                if not padded['video_url'] or padded_read >= len(page.encode()) + 64 * 1024:
+                    print(f"✗ Streaming read {padded_read} bytes of a {len(pages['padded'])} byte page")
+                    return False
+                print(f"✓ Streaming stops once the metadata is found ({padded_read} of {len(pages['padded'])} bytes)")
+
+                capped, capped_read = fetch('bloated_video')
+                try:
+                    fetch('bloated')
+                    print("✗ A page with no media URL within the byte cap was accepted")
+                    return False
+                except PageTooLarge:
+                    pass
+                refused = downloader.download_video('http://www.instagram.com/p/bloated/')
+                if not capped['video_url'] or not cap <= capped_read < 2 * cap \
+                        or refused['success'] or f'{cap} bytes' not in refused['error']:
+                    print(f"✗ Byte cap returned {capped.get('video_url')} after {capped_read} bytes / {refused}")
+                    return False
+                print("✓ Oversized pages stop at the byte cap and fail without a media URL")
+        return True
+    except Exception as e:
+        print(f"✗ Streaming fetch test failed: {e}")
+        return False
+
+def test_batch():
+    """Test that batch results stream per URL as they finish and failures stay isolated"""
+    try:
+        import io
+        import time
+        import requests
+        from instagram_batch import iter_batch, run_batch
+        from instagram_downloader_simple import SimpleInstagramDownloader
+        from instagram_standin import StandInServer
+
+        # The slow URL is listed first but must not hold back the others
+        delays = {'slow': 0.5, 'fast-1': 0.01, 'fast-2': 0.02, 'boom': 0.01}
+
+        def download(url):
+            time.sleep(delays[url])
+            if url == 'boom':
+                raise RuntimeError('extractor crashed')
+            return {'success': True, 'data': {'id': url}}
+
+        started = time.monotonic()
+        arrivals = [(url, result, time.monotonic() - started)
+                    for url, result in iter_batch(download, delays, requests.Session(), max_workers=4)]
+        order = [url for url, _, _ in arrivals]
+        early = [elapsed for url, _, elapsed in arrivals if url != 'slow']
+        if order[-1] != 'slow' or sorted(order) != sorted(delays) or max(early) >= delays['slow'] \
+                or dict((url, result) for url, result, _ in arrivals)['boom'] != {'success': False, 'error': 'extractor crashed'}:
+            print(f"✗ Batch results arrived as {[(url, round(elapsed, 2)) for url, _, elapsed in arrivals]}")
+            return False
+        print("✓ Batch results stream as each URL finishes, not in input order")
+
+        with StandInServer() as server:
+            downloader = SimpleInstagramDownloader()
+            downloader.session.proxies = {'http': server.url}
+            urls = ['http://www.instagram.com/p/video_og/', 'http://www.instagram.com/p/missing/',
+                    'https://example.com/not-a-post', 'http://www.instagram.com/reel/video_jsonld/',
+                    'http://www.instagram.com/reel/video_og/']
+            output = io.StringIO()
+            run_batch(downloader, io.StringIO('\n'.join(urls) + '\n# comment\n'), max_workers=3, output=output)
+            lines = [json.loads(line) for line in output.getvalue().splitlines()]
+            results = {line['url']: line for line in lines}
+            if len(lines) != len(urls) or set(results) != set(urls) \
+                    or [results[url]['success'] for url in urls] != [True, False, False, True, True] \
+                    or results[urls[4]]['data'] != results[urls[0]]['data']:
+                print(f"✗ Batch wrote {[(line['url'], line['success']) for line in lines]}")
+                return False
+        print("✓ Each URL gets one result line and bad URLs do not fail the rest")
+        return True
+    except Exception as e:
+        print(f"✗ Batch test failed: {e}")
+        return False
+
+def test_parser_escapes():
+    """Test entity and escape decoding of media URLs in the single-pass parser"""
+    try:
+        from instagram_parser import MetadataParser, parse_video_info
+
+        expected = 'https://cdn.example/o1/v.mp4?efg=a&_nc_ht=cdn.example&oe=6F3A2B10'
+        og_page = (
+            '<html><head>'
+            '<meta property="og:title" content="Tom &amp; Jerry &quot;classic&quot;" />'
+            "<meta content='https://cdn.example/o1/v.mp4?efg=a&amp;_nc_ht=cdn.example&#38;oe=6F3A2B10' property='og:video' />"
+            '<meta property="og:image" content="https://cdn.example/t.jpg?x=1&amp;amp;y=2" />'
+            '</head><body></body></html>'
+        )
+        ld_page = (
+            '<html><head><script type="application/ld+json">'
+            '{"@type": "SocialMediaPosting", "headline": "Tom \\u0026 Jerry", "video": [{'
+            '"contentUrl": "https:\\/\\/cdn.example\\/o1\\/v.mp4?efg=a\\u0026_nc_ht=cdn.example\\u0026oe=6F3A2B10", '
+            '"thumbnailUrl": "https:\\/\\/cdn.example\\/t.jpg?x=1\\u0026y=2"}]}'
+            '</script></head></html>'
+        )
+        for name, page in (('og', og_page), ('json-ld', ld_page)):
+            whole = parse_video_info(page, 'post')
+            # Chunks split entities and escapes across feed() calls
+            parser = MetadataParser()
+            for start in range(0, len(page), 7):
+                if parser.feed(page[start:start + 7]):
+                    break
+            chunked = parser.video_info('post')
+            if whole['video_url'] != expected or chunked != whole or whole['title'] != (
+                    'Tom & Jerry "classic"' if name == 'og' else 'Tom & Jerry'):
+                print(f"✗ {name} page parsed to {whole['video_url']!r} / {whole['title']!r} (chunked: {chunked['video_url']!r})")
+                return False
+        if parse_video_info(og_page, 'post')['thumbnail'] != 'https://cdn.example/t.jpg?x=1&amp;y=2' \
+                or parse_video_info(ld_page, 'post')['thumbnail'] != 'https://cdn.example/t.jpg?x=1&y=2':
+            print("✗ Thumbnail URLs were decoded more or less than once")
+            return False
+        print("✓ &amp;, &#38;, \\u0026 and \\/ in media URLs decode once, whole or chunked")
+        return True
+    except Exception as e:
+        print(f"✗ Parser escape test failed: {e}")
+        return False
+
+def test_ytdlp_in_process():
+    """Test in-process yt-dlp reuse and the fallback when the module is missing"""
+    import os
+    saved_module = sys.modules.get('yt_dlp')
+    saved_path = os.environ.get('PATH', '')
+    try:
+        import threading
+        from instagram_downloader import InstagramDownloader
+        from instagram_ratelimit import UpstreamGuard
+
+        url = 'https://www.instagram.com/reel/C0ffee00001/'
+        info = {'id': 'C0ffee00001', 'title': 'Reel', 'duration': 5, 'formats': [
+            {'format_id': '720', 'url': 'https://cdn.example/720.mp4', 'ext': 'mp4', 'height': 720, 'width': 405,
+             'vcodec': 'avc1', 'acodec': 'mp4a'}]}
+
+        try:
+            import yt_dlp
+        except ImportError:
+            print("⚠ yt-dlp module not found; skipping the YoutubeDL reuse check (optional)")
+        else:
+            downloader = InstagramDownloader()
+            downloader.guard = UpstreamGuard()
+            ydl = downloader._ytdlp_instance()
+            other_thread = []
+            thread = threading.Thread(target=lambda: other_thread.append(downloader._ytdlp_instance()))
+            thread.start()
+            thread.join()
+            # Only the network call is replaced; the YoutubeDL itself is yt-dlp's
+            extracted = []
+            ydl.extract_info = lambda info_url, download=True: extracted.append(info_url) or info
+            results = [downloader.get_video_info_ytdlp(url) for _ in range(3)]
+            if downloader._ytdlp_instance() is not ydl or other_thread[0] is ydl or extracted != [url] * 3 \
+                    or any(result['video_url'] != 'https://cdn.example/720.mp4' for result in results):
+                print(f"✗ yt-dlp was not reused in process ({len(extracted)} in-process extractions)")
+                return False
+            print("✓ yt-dlp runs in process on one reused YoutubeDL per thread")
+
+        # None in sys.modules makes `import yt_dlp` fail as it does when yt-dlp is not installed
+        sys.modules['yt_dlp'] = None
+        missing = InstagramDownloader()
+        missing.guard = UpstreamGuard()
+        binary_calls = []
+        missing.extract_info_ytdlp_subprocess = lambda info_url: binary_calls.append(info_url) or info
+        fallback = missing.get_video_info_ytdlp(url)
+        os.environ['PATH'] = ''
+        strategies = [name for name, _ in InstagramDownloader().strategies.strategies]
+        if binary_calls != [url] or fallback['video_url'] != 'https://cdn.example/720.mp4' or strategies != ['html']:
+            print(f"✗ Without yt-dlp: {len(binary_calls)} binary calls, strategies {strategies}")
+            return False
+        print("✓ Without the yt-dlp module the binary is used, and without either only HTML runs")
+        return True
+    except Exception as e:
+        print(f"✗ In-process yt-dlp test failed: {e}")
+        return False
+    finally:
+        os.environ['PATH'] = saved_path
+        if saved_module is None:
+            sys.modules.pop('yt_dlp', None)
+        else:
+            sys.modules['yt_dlp'] = saved_module
+
 def main():
     """Main test function"""
     print("Testing InstaFetch Python installation...")
@@ -51,7 +1117,87 @@ def main():
     print("\n2. Testing Instagram downloader:")
     if not test_instagram_downloader():
         success = False
+
+    # Test extraction end to end against recorded pages
+    print("\n3. Testing extraction against local stand-in:")
+    if not test_standin_extraction():
+        success = False
+
+    # Test the media download engine
+    print("\n4. Testing media downloads:")
+    if not test_media_download():
+        success = False
+
+    # Test the cold-start budget
+    print("\n5. Testing cold start:")
+    if not test_cold_start():
+        success = False
+
+    # Test rate limiting, retries and the circuit breaker
+    print("\n6. Testing upstream protection:")
+    if not test_upstream_protection():
+        success = False
     
+    # Test paging, checkpoints and resuming a profile crawl
+    print("\n7. Testing profile crawl:")
+    if not test_profile_crawl():
+        success = False
+
+    # Test the durable multi-process job runner
+    print("\n8. Testing job runner:")
+    if not test_job_runner():
+        success = False
+
+    # Test expiry-aware cache lifetimes and background refresh
+    print("\n9. Testing expiry-aware cache:")
+    if not test_expiry_refresh():
+        success = False
+
+    # Test the content-addressed media store and thumbnail proxy
+    print("\n10. Testing media store:")
+    if not test_media_store():
+        success = False
+
+    # Test egress proxy health scoring, quarantine and recovery
+    print("\n11. Testing egress pool:")
+    if not test_egress_pool():
+        success = False
+
+    # Test the NDJSON protocol between the Node pool and a worker process
+    print("\n12. Testing worker protocol:")
+    if not test_worker_protocol():
+        success = False
+
+    # Test format policies and carousel item selection
+    print("\n13. Testing format selection:")
+    if not test_format_selection():
+        success = False
+
+    # Test request coalescing for concurrent callers
+    print("\n14. Testing request coalescing:")
+    if not test_single_flight():
+        success = False
+
+    # Test early stop and the byte cap of streamed page reads
+    print("\n15. Testing streaming page reads:")
+    if not test_streaming_fetch():
+        success = False
+
+    # Test streaming batch results and per-URL failure isolation
+    print("\n16. Testing batch mode:")
+    if not test_batch():
+        success = False
+
+    # Test entity and escape decoding in the metadata parser
+    print("\n17. Testing parser escapes:")
+    if not test_parser_escapes():
+        success = False
+
+    # Test the in-process yt-dlp path and its fallbacks
+    print("\n18. Testing in-process yt-dlp:")
+    if not test_ytdlp_in_process():
+        success = False
+
     print("\n" + "=" * 50)
     if success:
         print("✓ All tests passed! Python setup is working correctly.")